@@ -1,3 +1,17 @@
-from .vector import Vector, Transform, Xyr, Units
+from .vector import Vector, VectorArray, Transform, Xyr, Units
 from .client import ApiClient
-from ._etch_item import HAlign, VAlign
\ No newline at end of file
+from .async_client import AsyncApiClient
+from ._pool import ClientPool, InstanceHealth
+from ._client_interface import PendingResponse, UnexpectedResponseError, RpcError
+from ._etch_item import HAlign, VAlign
+from ._loop_workspace import PathKind
+from ._spatial_index import SpatialIndex
+from ._codec import RawJson, JsonCodec, get_codec
+from ._etch_optimizer import EtchOptimizationReport, optimize_etch_lines
+from ._loop_geometry import LoopGeometry
+from ._loop_shapes import (ShapeCache, polygon_path, star_path, slot_path, keyhole_path, dogbone_rectangle_path,
+                           finger_joint_path, offset_path)
+from ._loop_workspace import LoopCache
+from ._patterns import (grid_pattern, staggered_pattern, hex_pattern, polar_pattern, bolt_circle_pattern,
+                        path_pattern, copy_bounds, clip_to_bounds, exclude_keep_out)
+from ._chunking import ChunkedSender, ChunkRate, ChunkReport, ChunkTiming, ChunkSendError
\ No newline at end of file
@@ -0,0 +1,476 @@
+from __future__ import annotations
+from typing import Awaitable, Callable, Optional, Sequence, Union
+from uuid import UUID
+
+import numpy
+from jsonrpcclient import request
+
+from ._chunking import _async_caller, _combined
+from ._client_interface import AsyncApiInterface
+from ._body_workspace import (LocalBodyQueries, _initial_extent, _initial_region, _region_extent, _select_transforms,
+                              _transforms_param, _transforms_encoder, _copies_request)
+from ._codec import RawJson
+from ._etch_item import (EtchTransaction, VAlign, HAlign, _make_line, _make_text, _add_items_request, _line_rows,
+                         _row_dicts, _optimize_rows, _text_dicts, _bulk_chunks, _items_encoder)
+from ._loop_geometry import LoopGeometry, LocalLoopQueries
+from ._loop_workspace import LoopCache, PathKind
+from ._patterns import _clip_pattern, _pattern_step
+from ._project_items import ProjectItem, _Change
+from . import _requests
+from ._work_settings import MaterialOption, FontOption
+from .vector import Vector, Xyr, Aabb
+
+
+# ==========================================================================================
+# Project Items
+# ==========================================================================================
+class AsyncProjectItem(ProjectItem):
+    """ Project item returned by an `AsyncApiClient`. Values are read through the same properties as `ProjectItem`,
+    but because a property setter can't be awaited, changes are made through the `set_*` coroutines instead. """
+    __slots__ = ()
+
+    visible = property(ProjectItem.visible.fget)
+    drag_locked = property(ProjectItem.drag_locked.fget)
+    for_construction = property(ProjectItem.for_construction.fget)
+    name = property(ProjectItem.name.fget)
+    origin = property(ProjectItem.origin.fget)
+    origin_parent = property(ProjectItem.origin_parent.fget)
+
+    async def _update_async(self, change: _Change):
+        """ Send a change built by `ProjectItem` and apply it locally once the server has accepted it """
+        await self._interface.call_checked(change.data, change.message)
+        change.apply()
+        self._interface.entity_changed(self, geometry=change.geometry)
+
+    async def set_visible(self, value: bool):
+        await self._update_async(self._visible_change(value))
+
+    async def set_drag_locked(self, value: bool):
+        await self._update_async(self._drag_locked_change(value))
+
+    async def set_for_construction(self, value: bool):
+        await self._update_async(self._for_construction_change(value))
+
+    async def set_name(self, value: str):
+        await self._update_async(self._name_change(value))
+
+    async def add_tag(self, tag: str):
+        await self._update_async(self._add_tag_change(tag))
+
+    async def remove_tag(self, tag: str):
+        await self._update_async(self._remove_tag_change(tag))
+
+    async def set_origin(self, value: Xyr):
+        await self._update_async(self._origin_change(value))
+
+    async def set_origin_parent(self, value: Union[ProjectItem, UUID, None]):
+        await self._update_async(self._origin_parent_change(value))
+
+    async def zoom_to(self):
+        await self._interface.call_checked(self._zoom_request(), "Failed to zoom to entity")
+
+    async def delete(self):
+        await self._interface.call_checked(self._delete_request(), "Failed to delete entity")
+        self._interface.entity_removed(self)
+
+
+class AsyncEtchTransaction(EtchTransaction):
+    """ Etch transaction for an `AsyncEtchItem`, used with `async with` so that the items can be sent when the block
+    exits. """
+
+    def __enter__(self):
+        raise TypeError("Use 'async with' for transactions on an AsyncEtchItem")
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is not None:
+            return
+        await _send_items(self._interface, str(self._project_item.id), self._prepared_payload(), split=False)
+        self._interface.entity_changed(self._project_item, geometry=True)
+
+
+class AsyncEtchItem(AsyncProjectItem):
+    __slots__ = ()
+
+    async def _add_payload(self, payload):
+        data = _add_items_request(self._interface, self._id_str(), payload)
+        result = await self._interface.call_checked(data, "Failed to add etch item")
+        self._interface.entity_changed(self, geometry=True)
+        return result
+
+    def transaction(self, optimize: bool = False) -> AsyncEtchTransaction:
+        return AsyncEtchTransaction(self, self._interface, optimize)
+
+    async def add_line(self, start: Vector, end: Vector, width: float):
+        """
+        Add a line to the etch item.
+        :param start: The starting point of the line
+        :param end: The ending point of the line
+        :param width: The width of the line
+        """
+        await self._add_payload([_make_line(self._interface, start, end, width)])
+
+    async def add_text(self, position: Vector, r: float, text: str, font_id: int, vertical: VAlign,
+                       horizontal: HAlign):
+        """
+        Add text to the etch item.
+        :param position: The reference position of the text
+        :param r: The rotation of the text in radians.
+        :param text: The text to add to the etch item
+        :param font_id: The ID of the font to use, found in the workspace settings under "Fonts"
+        :param vertical: Vertical alignment
+        :param horizontal: Horizontal alignment
+        """
+        await self._add_payload([_make_text(self._interface, position, r, text, font_id, vertical, horizontal)])
+
+    async def add_lines(self, starts, ends, widths, optimize: bool = False) -> int:
+        """ Add many lines at once. See `EtchItem.add_lines` for the accepted arguments. """
+        rows = _line_rows(self._interface, starts, ends, widths)
+        if optimize:
+            rows, _ = _optimize_rows(self._interface, rows)
+        items = _row_dicts(rows)
+        if items:
+            await _send_items(self._interface, self._id_str(), items)
+            self._interface.entity_changed(self, geometry=True)
+        return len(items)
+
+    async def add_texts(self, positions, rs, texts: Sequence[str], font_id, vertical=VAlign.CENTER,
+                        horizontal=HAlign.CENTER) -> int:
+        """ Add many texts at once. See `EtchItem.add_texts` for the accepted arguments. """
+        items = _text_dicts(self._interface, positions, rs, texts, font_id, vertical, horizontal)
+        if items:
+            await _send_items(self._interface, self._id_str(), items)
+            self._interface.entity_changed(self, geometry=True)
+        return len(items)
+
+
+async def _send_items(interface: AsyncApiInterface, item_id: str, items: list[dict], split: bool = True):
+    """ Async version of `_send_items` in the etch item module """
+    if interface.chunking is None:
+        chunks = _bulk_chunks(interface, items) if split else [_items_encoder(interface)(items)]
+        return _combined([await interface.call_checked(_add_items_request(interface, item_id, chunk),
+                                                       "Failed to add etch item")
+                          for chunk in chunks])
+
+    call = _async_caller(interface, lambda payload: _add_items_request(interface, item_id, payload),
+                         "Failed to add etch item")
+    return _combined(await interface.chunking.send_async("AddEtchEntityItem", items, _items_encoder(interface), call,
+                                                         repeatable=False))
+
+
+def create_async_entity(values: dict, interface: AsyncApiInterface) -> AsyncProjectItem:
+    type_name = values["TypeName"].replace("ViewModel", "")
+
+    if type_name == "Etch":
+        return AsyncEtchItem(values, interface)
+    else:
+        return AsyncProjectItem(values, interface)
+
+
+# ==========================================================================================
+# Work Settings Options
+# ==========================================================================================
+class AsyncMaterialOption(MaterialOption):
+
+    async def set_active(self):
+        response = await self._rpc(self._activate_request())
+        return response.result
+
+
+class AsyncFontOption(FontOption):
+    family = property(FontOption.family.fget)
+    size = property(FontOption.size.fget)
+
+    async def set_family(self, value: str):
+        await self._rpc(self._family_request(value))
+        self._family = value
+
+    async def set_size(self, value: float):
+        await self._rpc(self._size_request(value))
+        self._size = value
+
+    async def delete(self):
+        await self._rpc(self._delete_request())
+
+
+# ==========================================================================================
+# Scratch Workspace Handles
+# ==========================================================================================
+def _bounds_from_result(result: dict, interface: AsyncApiInterface) -> Aabb:
+    b_min = Vector(result["MinX"], result["MinY"])
+    b_max = Vector(result["MaxX"], result["MaxY"])
+    return Aabb(interface.convert_from_api(b_min), interface.convert_from_api(b_max))
+
+
+class AsyncLoopHandle(LocalLoopQueries):
+    """ Async version of `LoopHandle`, which keeps a local copy of the loop's geometry and handles cached loops in
+    the same way """
+
+    def __init__(self, guid: str, interface: AsyncApiInterface, geometry: Optional[LoopGeometry] = None):
+        self.id = guid
+        self._interface = interface
+        self._geometry = geometry
+        self._recreate: Optional[Callable[[], Awaitable[str]]] = None
+
+    @property
+    def is_shared(self) -> bool:
+        return self._recreate is not None
+
+    async def _own(self):
+        if self._recreate is not None:
+            recreate, self._recreate = self._recreate, None
+            self.id = await recreate()
+            if self._geometry is not None:
+                self._geometry = self._geometry.copy()
+
+    async def _call(self, method: str, *params):
+        response = await self._interface(request(method, params=(self.id, *params)))
+        return response.result
+
+    async def move_cursor_to(self, i: int):
+        await self._own()
+        result = await self._call("LoopMoveCursorTo", i)
+        if self._edit_at_cursor() is not None:
+            self._geometry.move_cursor_to(i)
+        return result
+
+    async def reverse(self):
+        await self._own()
+        result = await self._call("LoopReverse")
+        if self._geometry is not None:
+            self._geometry.reverse()
+        return result
+
+    async def insert_arc_abs(self, point: Vector, center: Vector, is_cw: bool):
+        await self._own()
+        p = self._interface.convert_to_api(point)
+        c = self._interface.convert_to_api(center)
+        result = await self._call("LoopInsertArcAbs", p.x, p.y, c.x, c.y, is_cw)
+        if self._edit_at_cursor() is not None:
+            self._geometry.insert(p.x, p.y, c.x, c.y, PathKind.ARC_CW if is_cw else PathKind.ARC_CCW)
+        return result
+
+    async def insert_arc_rel(self, point: Vector, center: Vector, is_cw: bool):
+        await self._own()
+        p = self._interface.convert_to_api(point)
+        c = self._interface.convert_to_api(center)
+        result = await self._call("LoopInsertArcRel", p.x, p.y, c.x, c.y, is_cw)
+        if self._edit_at_cursor() is not None:
+            self._geometry.insert_relative(p.x, p.y, c.x, c.y, PathKind.ARC_CW if is_cw else PathKind.ARC_CCW)
+        return result
+
+    async def insert_seg_abs(self, point: Vector) -> int:
+        await self._own()
+        p = self._interface.convert_to_api(point)
+        result = await self._call("LoopInsertSegAbs", p.x, p.y)
+        if self._edit_at_cursor() is not None:
+            self._geometry.insert(p.x, p.y)
+        return result
+
+    async def insert_seg_rel(self, point: Vector) -> int:
+        await self._own()
+        p = self._interface.convert_to_api(point)
+        result = await self._call("LoopInsertSegRel", p.x, p.y)
+        if self._edit_at_cursor() is not None:
+            self._geometry.insert_relative(p.x, p.y)
+        return result
+
+    async def mirror_x(self, x0: float):
+        await self._own()
+        x0 = self._interface.convert_to_api(x0)
+        result = await self._call("LoopMirrorX", x0)
+        if self._geometry is not None:
+            self._geometry.mirror_x(x0)
+        return result
+
+    async def mirror_y(self, y0: float):
+        await self._own()
+        y0 = self._interface.convert_to_api(y0)
+        result = await self._call("LoopMirrorY", y0)
+        if self._geometry is not None:
+            self._geometry.mirror_y(y0)
+        return result
+
+    async def transform(self, xyr: Xyr):
+        await self._own()
+        t = self._interface.convert_to_api(xyr)
+        result = await self._call("LoopTransform", t.x, t.y, t.r)
+        if self._geometry is not None:
+            self._geometry.transform(t.x, t.y, t.r)
+        return result
+
+    async def union(self, other: AsyncLoopHandle) -> list[AsyncLoopHandle]:
+        result = await self._call("LoopUnion", other.id)
+        return [AsyncLoopHandle(x, self._interface) for x in result]
+
+    async def intersection(self, other: AsyncLoopHandle) -> list[AsyncLoopHandle]:
+        """ Find the area shared by two loops as new loops. If both loops are tracked and don't overlap, the empty
+        result is returned without a request. """
+        if self._geometry is not None and other._geometry is not None and not self._geometry.overlaps(other._geometry):
+            return []
+        result = await self._call("LoopIntersect", other.id)
+        return [AsyncLoopHandle(x, self._interface) for x in result]
+
+    async def bounds(self) -> Aabb:
+        """ The bounds of the loop, computed locally if its geometry is being tracked """
+        if self._geometry is not None:
+            return self._local_bounds()
+        return _bounds_from_result(await self._call("GetLoopBounds"), self._interface)
+
+
+class AsyncBodyHandle(LocalBodyQueries):
+    """ Async version of `BodyHandle`, which is tracked locally in the same way """
+
+    def __init__(self, guid: str, interface: AsyncApiInterface, region: Optional[list[numpy.ndarray]] = None,
+                 extent: Optional[tuple] = None):
+        self.id = guid
+        self._interface = interface
+        self._region = region
+        self._extent = extent if region is None else _region_extent(region)
+
+    async def _call(self, method: str, *params):
+        response = await self._interface(request(method, params=(self.id, *params)))
+        return response.result
+
+    async def operate(self, loop: AsyncLoopHandle):
+        """ Perform an operations on the body with the specified loop as the tool. If the loop is positive, it will
+        perform an add (union) operation.  If the loop is negative, it will perform a cut (intersection) operation. """
+        changed, region, extent = self._apply_tool(loop)
+        if not changed:
+            return None
+        try:
+            result = await self._call("BodyOperate", loop.id)
+        except Exception:
+            self._failed(extent)
+            raise
+        self._updated(region, extent)
+        return result
+
+    async def operate_copies(self, loop: AsyncLoopHandle, transforms: Union[list[Xyr], numpy.ndarray, RawJson]):
+        """ Perform a set of operations on the body with the specified loop as a tool, in which the tool is copied and
+         transformed once for each transform in the list before the operation is done. """
+        keep, region, extent = self._screen_copies(loop, transforms)
+        if keep is not None:
+            if not keep:
+                return None
+            transforms = _select_transforms(transforms, keep)
+
+        sender = self._interface.chunking
+        try:
+            if sender is None or isinstance(transforms, RawJson):
+                result = await self._call("BodyOperateCopies", loop.id,
+                                          _transforms_param(self._interface, transforms))
+            else:
+                call = _async_caller(self._interface, _copies_request(self.id, loop.id))
+                rows = self._interface.convert_xyrs_to_api(transforms)
+                result = _combined(await sender.send_async("BodyOperateCopies", rows,
+                                                           _transforms_encoder(self._interface), call))
+        except Exception:
+            self._failed(extent)
+            raise
+        self._updated(region, extent)
+        return result
+
+    async def operate_pattern(self, loop: AsyncLoopHandle, transforms: Union[list[Xyr], numpy.ndarray],
+                              clip: bool = False, margin: float = 0.0, keep_out=None,
+                              chunk_size: Optional[int] = None) -> int:
+        """ Perform `operate_copies` with a large set of transforms, as `BodyHandle.operate_pattern` """
+        body_bounds = await self.bounds() if clip else None
+        tool_bounds = await loop.bounds() if clip else None
+        transforms = _clip_pattern(transforms, body_bounds, tool_bounds, margin, keep_out)
+        step = _pattern_step(self._interface, chunk_size, len(transforms))
+        for start in range(0, len(transforms), step):
+            await self.operate_copies(loop, transforms[start:start + step])
+        return len(transforms)
+
+    async def add_inner_unchecked(self, loop: AsyncLoopHandle):
+        """ Performs an unchecked insertion of a loop into the body as an inner boundary. """
+        try:
+            result = await self._call("InsertLoopIntoBody", loop.id)
+        except Exception:
+            self._failed(self._extent)
+            raise
+        self._region = self._inserted(loop)
+        return result
+
+    async def bounds(self) -> Aabb:
+        """ The bounds of the body, computed locally if it's being tracked """
+        if self._region is not None:
+            return self._local_bounds()
+        return _bounds_from_result(await self._call("GetBodyBounds"), self._interface)
+
+
+class AsyncLoopScratchPad:
+    def __init__(self, interface: AsyncApiInterface, track_geometry: bool = False):
+        self._interface = interface
+        self.track_geometry = track_geometry
+        self.loop_cache: Optional[LoopCache] = None
+
+    async def _create(self, geometry: LoopGeometry, method: str, *params) -> AsyncLoopHandle:
+        response = await self._interface(request(method, params=params))
+        return AsyncLoopHandle(response.result, self._interface, geometry if self.track_geometry else None)
+
+    async def _primitive(self, geometry: LoopGeometry, method: str, *params) -> AsyncLoopHandle:
+        """ A handle to a new loop, or to the cached loop for the same shape if there's a loop cache """
+        if self.loop_cache is None:
+            return await self._create(geometry, method, *params)
+
+        async def create() -> str:
+            response = await self._interface(request(method, params=params))
+            return response.result
+
+        key = (method, *params)
+        entry = self.loop_cache.lookup(key)
+        if entry is None:
+            entry = await create(), geometry
+            self.loop_cache.add(key, *entry)
+        guid, geometry = entry
+        handle = AsyncLoopHandle(guid, self._interface, geometry if self.track_geometry else None)
+        handle._recreate = create
+        return handle
+
+    async def create(self) -> AsyncLoopHandle:
+        return await self._create(LoopGeometry(), "LoopCreate")
+
+    async def circle(self, center: Vector, radius: float) -> AsyncLoopHandle:
+        c = self._interface.convert_to_api(center)
+        r = self._interface.convert_to_api(radius)
+        return await self._primitive(LoopGeometry.circle(c.x, c.y, r), "LoopCircle", c.x, c.y, r)
+
+    async def rectangle(self, corner: Vector, width: float, height: float) -> AsyncLoopHandle:
+        c = self._interface.convert_to_api(corner)
+        w = self._interface.convert_to_api(width)
+        h = self._interface.convert_to_api(height)
+        return await self._primitive(LoopGeometry.rectangle(c.x, c.y, w, h), "LoopRectangle", c.x, c.y, w, h)
+
+    async def rounded_rectangle(self, corner: Vector, width: float, height: float, radius: float) -> AsyncLoopHandle:
+        c = self._interface.convert_to_api(corner)
+        w = self._interface.convert_to_api(width)
+        h = self._interface.convert_to_api(height)
+        r = self._interface.convert_to_api(radius)
+        return await self._primitive(LoopGeometry.rounded_rectangle(c.x, c.y, w, h, r), "LoopRoundedRectangle",
+                                     c.x, c.y, w, h, r)
+
+    async def clear(self):
+        response = await self._interface(_requests.clear_loops())
+        if self.loop_cache is not None:
+            self.loop_cache.clear()
+        return response.result
+
+
+class AsyncBodyScratchPad:
+    def __init__(self, interface: AsyncApiInterface):
+        self._interface = interface
+
+    async def create(self, loop: AsyncLoopHandle, local: bool = False) -> AsyncBodyHandle:
+        """ Create a body from a positive loop, tracked as with `BodyScratchPad.create` """
+        response = await self._interface(_requests.create_scratch_body(loop.id))
+        return AsyncBodyHandle(response.result, self._interface, _initial_region(loop) if local else None,
+                               _initial_extent(loop))
+
+    def prepare_transforms(self, transforms: Union[list[Xyr], numpy.ndarray]) -> RawJson:
+        """ Convert and serialize a set of transforms once, so that it can be passed to `operate_copies` on any number
+        of bodies without being encoded again """
+        return RawJson(self._interface.codec.dumps(_transforms_param(self._interface, transforms)))
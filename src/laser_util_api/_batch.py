@@ -0,0 +1,82 @@
+from typing import Callable
+
+from jsonrpcclient import parse, Error
+
+from ._client_interface import PendingResponse, RpcError
+
+
+class RpcBatch:
+    """ Collects requests into a single JSON-RPC batch array which is sent in one write when the batch is flushed.
+    Each queued request is given a `PendingResponse` which is resolved by its request id once the server responds.
+
+    Batches are used through `ApiClient.batch()`. Nested `with` blocks share the same batch, which is only sent when
+    the outermost block exits. """
+
+    def __init__(self, send: Callable[[list[dict]], list[dict]]):
+        self._send = send
+        self._queued: list[tuple[dict, PendingResponse]] = []
+        self._depth = 0
+
+    def __len__(self):
+        return len(self._queued)
+
+    def __enter__(self):
+        self._depth += 1
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self._depth -= 1
+        if self._depth > 0:
+            return
+
+        if exc_type is not None:
+            self.discard(Exception("Batch was abandoned because of an exception in its block"))
+        else:
+            self.flush()
+
+    @property
+    def is_open(self) -> bool:
+        return self._depth > 0
+
+    def add(self, request_data: dict) -> PendingResponse:
+        pending = PendingResponse(request_data["id"], self.flush)
+        self._queued.append((request_data, pending))
+        return pending
+
+    def discard(self, error: Exception):
+        """ Drop all queued requests without sending them, failing their placeholders with the given error """
+        queued, self._queued = self._queued, []
+        for _, pending in queued:
+            pending.set_error(error)
+
+    def flush(self):
+        """ Send every queued request in a single batch and resolve the placeholders by id. If any of the requests
+        failed, the first failure is raised after all placeholders have been resolved. """
+        queued, self._queued = self._queued, []
+        if not queued:
+            return
+
+        responses = self._send([data for data, _ in queued])
+        if isinstance(responses, dict):
+            # The server may answer an unusable batch with a single error object
+            responses = [responses]
+
+        by_id = {}
+        for parsed in parse(responses):
+            by_id[parsed.id] = parsed
+
+        first_error = None
+        for data, pending in queued:
+            parsed = by_id.get(data["id"])
+            if parsed is None:
+                pending.set_error(Exception(f"No response to batched request {data['method']} (id={data['id']!r})"))
+            elif isinstance(parsed, Error):
+                pending.set_error(RpcError.from_response(parsed))
+            else:
+                pending.set_result(parsed.result)
+
+            if pending.error is not None and first_error is None:
+                first_error = pending.error
+
+        if first_error is not None:
+            raise first_error
@@ -1,41 +1,219 @@
+import math
+from typing import Optional, Union
+
+import numpy
 from jsonrpcclient import request
 
 from ._client_interface import ApiInterface
+from ._chunking import _caller, _combined
+from ._codec import RawJson
+from ._loop_boolean import (bounds_overlap, oriented, region_area, region_bounds, region_difference,
+                            region_union)
+from ._loop_geometry import LoopGeometry
 from ._loop_workspace import LoopHandle
+from ._patterns import _clip_pattern, _pattern_step
+from . import _requests
 from .vector import Aabb, Vector, Xyr
 
+# An operate_copies call with more copies than this is only screened by the bounds of the copies, and stops the
+# body's local tracking, since working out the body after each copy locally would cost more than it saves
+_MAX_TRACKED_COPIES = 256
+
+
+class LocalBodyQueries:
+    """ Local model of a body, shared by the sync and async body handles. A body created from a loop whose geometry
+    is tracked (see `LoopScratchPad.track_geometry`) keeps a box which contains it, in millimeters, for as long as
+    every loop used on it is tracked. Cuts whose tool, or copies of it, lie outside that box are skipped without a
+    request. The box grows with each addition but isn't shrunk by cuts, which keeps it cheap to maintain.
+
+    A body created with `local` set also keeps its boundaries as polygons, worked out with the local Boolean
+    operations after each change. Operations which would not change it, such as cuts in an area already cut away or
+    additions which lie entirely inside it, are then skipped as well, and `operate_copies` only sends the copies which
+    change it. This costs a local Boolean operation per operation or copy, which grows with the complexity of the body,
+    so it only pays off where requests are expensive. Arcs are flattened to a small tolerance, so the local bounds and
+    area can differ from the server's by about that much. """
+    _region: Optional[list[numpy.ndarray]]
+    _extent: Optional[tuple[float, float, float, float]]
+
+    @property
+    def region(self) -> Optional[list[numpy.ndarray]]:
+        """ The body's boundaries as Nx2 arrays of vertices in millimeters, the outer boundary counter-clockwise and
+        holes clockwise, or None if the body isn't being tracked """
+        return self._region
+
+    @property
+    def is_tracked(self) -> bool:
+        return self._region is not None
+
+    @property
+    def area(self) -> float:
+        if self._region is None:
+            raise Exception("The body's geometry is not being tracked locally")
+        units = self._interface.get_units()
+        return units.from_mm(units.from_mm(region_area(self._region)))
+
+    def _local_bounds(self) -> Aabb:
+        x0, y0, x1, y1 = region_bounds(self._region)
+        return Aabb(self._interface.convert_from_api(Vector(x0, y0)), self._interface.convert_from_api(Vector(x1, y1)))
+
+    def _apply_tool(self, loop) -> tuple[bool, Optional[list[numpy.ndarray]], Optional[tuple]]:
+        """ Whether operating on the body with the loop could change it, and the body's region and box afterwards
+        where they can be worked out locally """
+        geometry = loop.geometry
+        if geometry is None or not len(geometry) or self._extent is None:
+            return True, None, None
+        if self._region is not None:
+            changed, region = _operate_region(self._region, geometry)
+            return changed, region, _region_extent(region)
+
+        tool = geometry.bounds()
+        if geometry.is_positive:
+            return True, None, _merge_bounds(self._extent, tool)
+        return bounds_overlap(self._extent, tool), None, self._extent
+
+    def _screen_copies(self, loop, transforms) -> tuple[Optional[list[int]], Optional[list[numpy.ndarray]],
+                                                        Optional[tuple]]:
+        """ The indices of the transforms whose copies of the loop could change the body, or None if they can't be
+        screened, and the body's region and box afterwards where they can be worked out locally """
+        geometry = loop.geometry
+        if geometry is None or not len(geometry) or self._extent is None:
+            return None, None, None
+        if isinstance(transforms, RawJson):
+            return None, None, None if geometry.is_positive else self._extent
+
+        xyrs = self._interface.convert_xyrs_to_api(transforms)
+        if self._region is not None and len(xyrs) <= _MAX_TRACKED_COPIES:
+            region = self._region
+            keep = []
+            for i, (x, y, r) in enumerate(xyrs.tolist()):
+                copy = geometry.copy()
+                copy.transform(x, y, r)
+                changed, region = _operate_region(region, copy)
+                if changed:
+                    keep.append(i)
+            return keep, region, _region_extent(region)
 
-class BodyHandle:
-    def __init__(self, guid: str, interface: ApiInterface):
+        if geometry.is_positive:
+            return None, None, _merge_bounds(self._extent, _copies_extent(geometry, xyrs))
+        return _copies_near(self._extent, geometry, xyrs), None, self._extent
+
+    def _updated(self, region: Optional[list[numpy.ndarray]], extent: Optional[tuple]):
+        self._region = region
+        self._extent = extent
+
+    def _failed(self, extent: Optional[tuple]):
+        """ Stop tracking the region after a request which failed, and may have been partly carried out, keeping a box
+        which holds the body either way """
+        self._region = None
+        self._extent = _merge_bounds(self._extent, extent)
+
+    def _inserted(self, loop) -> Optional[list[numpy.ndarray]]:
+        """ The body's region after inserting the loop as an inner boundary """
+        geometry = loop.geometry
+        if self._region is None or geometry is None or not len(geometry):
+            return None
+        return self._region + [oriented(geometry.flatten(), positive=False)]
+
+
+class BodyHandle(LocalBodyQueries):
+    def __init__(self, guid: str, interface: ApiInterface, region: Optional[list[numpy.ndarray]] = None,
+                 extent: Optional[tuple] = None):
         self.id = guid
         self._interface = interface
+        self._region = region
+        self._extent = extent if region is None else _region_extent(region)
 
     def operate(self, loop: LoopHandle):
         """ Perform an operations on the body with the specified loop as the tool. If the loop is positive, it will
-        perform an add (union) operation.  If the loop is negative, it will perform a cut (intersection) operation. """
+        perform an add (union) operation.  If the loop is negative, it will perform a cut (intersection) operation.
+        If the body and loop are tracked locally and the operation would not change the body, no request is made and
+        None is returned. """
+        changed, region, extent = self._apply_tool(loop)
+        if not changed:
+            return None
+
         data = request("BodyOperate", params=(self.id, loop.id))
-        response = self._interface(data)
-        return response.result
+        try:
+            response = self._interface(data)
+        except Exception:
+            self._failed(extent)
+            raise
+        result = self._interface.result(response)
+        self._updated(region, extent)
+        return result
 
-    def operate_copies(self, loop: LoopHandle, transforms: list[Xyr]):
+    def operate_copies(self, loop: LoopHandle, transforms: Union[list[Xyr], numpy.ndarray, RawJson]):
         """ Perform a set of operations on the body with the specified loop as a tool, in which the tool is copied and
          transformed once for each transform in the list before the operation is done. This allows bulk generation of
-         pattern based features. """
-        t = [{"X": x.x, "Y": x.y, "R": x.r} for x in map(self._interface.convert_to_api, transforms)]
-        data = request("BodyOperateCopies", params=(self.id, loop.id, t))
-        response = self._interface(data)
-        return response.result
+         pattern based features. The transforms may be a list of `Xyr`, an Nx3 array of (x, y, r) rows, or a set of
+         transforms prepared with `BodyScratchPad.prepare_transforms`. If the body and loop are tracked locally, only
+         the copies which could change the body are sent, and if there are none no request is made and None is
+         returned.
+
+         If the client has a `chunking` sender, large sets of transforms are split into several requests by it, other
+         than prepared ones, which are sent as they are. """
+        keep, region, extent = self._screen_copies(loop, transforms)
+        if keep is not None:
+            if not keep:
+                return None
+            transforms = _select_transforms(transforms, keep)
+
+        sender = self._interface.chunking
+        try:
+            if sender is None or isinstance(transforms, RawJson):
+                data = request("BodyOperateCopies",
+                               params=(self.id, loop.id, _transforms_param(self._interface, transforms)))
+                result = self._interface.result(self._interface(data))
+            else:
+                build = _copies_request(self.id, loop.id)
+                rows = self._interface.convert_xyrs_to_api(transforms)
+                result = _combined(sender.send("BodyOperateCopies", rows, _transforms_encoder(self._interface),
+                                               _caller(self._interface, build)))
+        except Exception:
+            # Some of the chunks may have been carried out before one failed
+            self._failed(extent)
+            raise
+        self._updated(region, extent)
+        return result
+
+    def operate_pattern(self, loop: LoopHandle, transforms: Union[list[Xyr], numpy.ndarray], clip: bool = False,
+                        margin: float = 0.0, keep_out=None, chunk_size: Optional[int] = None) -> int:
+        """ Perform `operate_copies` with a large set of transforms, such as those made by the pattern generators.
+        With `chunk_size` set, the transforms are sent in requests of at most that many transforms each. Otherwise
+        they're split by the client's `chunking` sender if it has one, or sent `PATTERN_CHUNK` at a time if not.
+
+        :param clip: Only keep the copies of the loop which lie entirely inside the body's bounds shrunk by `margin`
+        :param margin: Distance kept from the body's bounds when clipping, and from the edges of the keep-out polygons
+        :param keep_out: An Nx2 array of polygon vertices, or a sequence of them, inside which no copy is placed
+        :return: The number of transforms left after clipping
+        """
+        transforms = _clip_pattern(transforms, self.bounds if clip else None, loop.bounds if clip else None, margin,
+                                   keep_out)
+        step = _pattern_step(self._interface, chunk_size, len(transforms))
+        for start in range(0, len(transforms), step):
+            self.operate_copies(loop, transforms[start:start + step])
+        return len(transforms)
 
     def add_inner_unchecked(self, loop: LoopHandle):
         """ Performs an unchecked insertion of a loop into the body as an inner boundary. If the loop is positive, it
         will throw an exception.  If the loop intersects with one of the body's existing boundaries, the behavior will
         be undefined. """
         data = request("InsertLoopIntoBody", params=(self.id, loop.id))
-        response = self._interface(data)
-        return response.result
+        try:
+            response = self._interface(data)
+        except Exception:
+            self._failed(self._extent)
+            raise
+        result = self._interface.result(response)
+        self._region = self._inserted(loop)
+        return result
 
     @property
     def bounds(self) -> Aabb:
+        """ The bounds of the body, computed locally if it's being tracked """
+        if self._region is not None:
+            return self._local_bounds()
+
         data = request("GetBodyBounds", params=(self.id, ))
         response = self._interface(data)
         b_min = Vector(response.result["MinX"], response.result["MinY"])
@@ -46,7 +224,113 @@ class BodyScratchPad:
     def __init__(self, interface: ApiInterface):
         self._interface = interface
 
-    def create(self, loop: LoopHandle) -> BodyHandle:
-        data = request("BodyCreate", params=(loop.id,))
-        response = self._interface(data)
-        return BodyHandle(response.result, self._interface)
+    def create(self, loop: LoopHandle, local: bool = False) -> BodyHandle:
+        """ Create a body from a positive loop. If the loop's geometry is tracked, the body keeps a box which contains
+        it, and with `local` set it also keeps its boundaries, as described in `LocalBodyQueries`. """
+        response = self._interface(_requests.create_scratch_body(loop.id))
+        return BodyHandle(response.result, self._interface, _initial_region(loop) if local else None,
+                          _initial_extent(loop))
+
+    def prepare_transforms(self, transforms: Union[list[Xyr], numpy.ndarray]) -> RawJson:
+        """ Convert and serialize a set of transforms once, so that it can be passed to `operate_copies` on any number
+        of bodies without being encoded again. The transforms are converted with the client's current units. """
+        return RawJson(self._interface.codec.dumps(_transforms_param(self._interface, transforms)))
+
+
+def _initial_region(loop) -> Optional[list[numpy.ndarray]]:
+    geometry = loop.geometry
+    if geometry is None or not len(geometry):
+        return None
+    return geometry.region()
+
+
+def _initial_extent(loop) -> Optional[tuple]:
+    geometry = loop.geometry
+    if geometry is None or not len(geometry):
+        return None
+    return geometry.bounds()
+
+
+def _region_extent(region: list[numpy.ndarray]) -> Optional[tuple]:
+    return region_bounds(region) if region else None
+
+
+def _merge_bounds(a: Optional[tuple], b: Optional[tuple]) -> Optional[tuple]:
+    """ The box containing two (min x, min y, max x, max y) boxes, or None if either is unknown """
+    if a is None or b is None:
+        return None
+    return min(a[0], b[0]), min(a[1], b[1]), max(a[2], b[2]), max(a[3], b[3])
+
+
+def _operate_region(region: list[numpy.ndarray], tool: LoopGeometry) -> tuple[bool, list[numpy.ndarray]]:
+    """ Add a positive tool loop to a region or cut a negative one from it, returning whether the region's area
+    changed and the new region """
+    if tool.is_positive:
+        result = region_union(region, tool.region())
+    else:
+        if not bounds_overlap(region_bounds(region), tool.bounds()):
+            return False, region
+        result = region_difference(region, tool.region())
+
+    # Rings which were passed through untouched are the same objects in both, so only the others are compared
+    same = {id(r) for r in region} & {id(r) for r in result}
+    added = [r for r in result if id(r) not in same]
+    removed = [r for r in region if id(r) not in same]
+    change = region_area(added) - region_area(removed)
+    scale = sum(abs(region_area([r])) for r in added + removed)
+    if abs(change) <= 1e-9 * max(1.0, scale):
+        return False, region
+    return True, result
+
+
+def _copy_circles(tool: LoopGeometry, xyrs: numpy.ndarray) -> tuple[numpy.ndarray, numpy.ndarray, float]:
+    """ The centers and radius of circles around each copy of the tool's bounds, which let the copies' rotations be
+    handled in one vectorized step """
+    x0, y0, x1, y1 = tool.bounds()
+    cx, cy = 0.5 * (x0 + x1), 0.5 * (y0 + y1)
+    radius = 0.5 * math.hypot(x1 - x0, y1 - y0)
+    c = numpy.cos(xyrs[:, 2])
+    s = numpy.sin(xyrs[:, 2])
+    return c * cx - s * cy + xyrs[:, 0], s * cx + c * cy + xyrs[:, 1], radius
+
+
+def _copies_near(bounds: tuple, tool: LoopGeometry, xyrs: numpy.ndarray) -> list[int]:
+    """ The indices of the transforms which place a copy of the tool where its bounds could touch the given bounds """
+    px, py, radius = _copy_circles(tool, xyrs)
+    near = ((px + radius > bounds[0]) & (px - radius < bounds[2]) & (py + radius > bounds[1]) &
+            (py - radius < bounds[3]))
+    return numpy.flatnonzero(near).tolist()
+
+
+def _copies_extent(tool: LoopGeometry, xyrs: numpy.ndarray) -> tuple:
+    """ A box containing every copy of the tool, which is empty if there are no copies """
+    if not len(xyrs):
+        return math.inf, math.inf, -math.inf, -math.inf
+    px, py, radius = _copy_circles(tool, xyrs)
+    return (float(px.min()) - radius, float(py.min()) - radius, float(px.max()) + radius,
+            float(py.max()) + radius)
+
+
+def _select_transforms(transforms: Union[list[Xyr], numpy.ndarray], keep: list[int]):
+    if isinstance(transforms, numpy.ndarray):
+        return transforms.reshape(-1, 3)[keep]
+    return [transforms[i] for i in keep]
+
+
+def _transforms_param(interface: ApiInterface, transforms: Union[list[Xyr], numpy.ndarray, RawJson]):
+    if isinstance(transforms, RawJson):
+        return transforms
+    rows = interface.convert_xyrs_to_api(transforms)
+    return [{"X": x, "Y": y, "R": r} for x, y, r in rows.tolist()]
+
+
+def _transforms_encoder(interface: ApiInterface):
+    """ Encodes a chunk of an Nx3 array of transforms, already in millimeters, for `BodyOperateCopies` """
+    def encode(rows: numpy.ndarray) -> RawJson:
+        return RawJson(interface.codec.dumps([{"X": x, "Y": y, "R": r} for x, y, r in rows.tolist()]))
+
+    return encode
+
+
+def _copies_request(body_id: str, loop_id: str):
+    return lambda payload: request("BodyOperateCopies", params=(body_id, loop_id, payload))
@@ -0,0 +1,290 @@
+from __future__ import annotations
+import asyncio
+import time
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Optional, Sequence
+
+from ._client_interface import PendingResponse
+from ._codec import RawJson
+
+
+@dataclass
+class ChunkTiming:
+    """ How one chunk of a bulk request went. `seconds` is the time taken by the attempt which succeeded, and is zero
+    for chunks whose requests were deferred by a batch or pipeline. """
+    index: int
+    items: int
+    bytes: int
+    seconds: float
+    attempts: int = 1
+
+
+@dataclass
+class ChunkReport:
+    """ The chunks a bulk request was split into, in the order they were sent """
+    chunks: list[ChunkTiming] = field(default_factory=list)
+
+    @property
+    def items(self) -> int:
+        return sum(c.items for c in self.chunks)
+
+    @property
+    def bytes(self) -> int:
+        return sum(c.bytes for c in self.chunks)
+
+    @property
+    def seconds(self) -> float:
+        return sum(c.seconds for c in self.chunks)
+
+    @property
+    def retries(self) -> int:
+        return sum(c.attempts - 1 for c in self.chunks)
+
+    @property
+    def items_per_second(self) -> float:
+        seconds = self.seconds
+        return self.items / seconds if seconds > 0 else 0.0
+
+    def __str__(self):
+        return (f"{self.items} items in {len(self.chunks)} chunks ({self.bytes} bytes), {self.seconds:.3f} s, "
+                f"{self.items_per_second:.0f} items/s, {self.retries} retries")
+
+
+@dataclass
+class ChunkRate:
+    """ What a `ChunkedSender` has learned about one kind of request: the size of its next chunk, the moving average
+    time per item, the fixed latency of a request measured from small chunks, and the `ceiling` on the chunk size set
+    by a timeout """
+    chunk_items: int
+    seconds_per_item: Optional[float] = None
+    latency: Optional[float] = None
+    ceiling: Optional[int] = None
+
+
+class ChunkSendError(Exception):
+    """ Raised when a chunk of a bulk request still fails after every retry. The chunks before it were sent, and are
+    described by `report`; `items_sent` is how many items they held. """
+
+    def __init__(self, message: str, report: ChunkReport, items_sent: int):
+        super().__init__(message)
+        self.report = report
+        self.items_sent = items_sent
+
+
+class ChunkedSender:
+    """ Splits large bulk requests, such as the transforms of `BodyHandle.operate_copies` and the items added to an
+    etch, into chunks sized to the server's measured speed.
+
+    Each chunk's round trip is timed and the time per item is tracked as a moving average, from which the next chunk
+    is sized to take about `target_seconds`, growing by at most double each time. A last chunk smaller than planned
+    doesn't grow the size, and only shrinks it if it took longer than `target_seconds`, since its time is mostly the
+    request's fixed latency; when it's much smaller, it's used to measure that latency instead, which is then left out
+    of the time per item. A chunk is also split further if its encoded payload would be larger than `max_bytes`.
+
+    What's learned is kept between calls in a `ChunkRate` for each request method, in `rates`, so the sender settles
+    on a size for each kind of request the server handles. Adding etch items and copying a tool over a body take very
+    different times per item, and neither affects the other's chunks.
+
+    A chunk which fails with a connection error or a timeout, or which the server answers with a falsy result where a
+    truthy one is required, is retried, halving the chunk size each time and waiting `backoff` seconds doubled on each
+    attempt, up to `max_attempts` attempts in all. After a timeout, which may have been caused by the chunk's size, the
+    halved size also becomes a `ceiling` which later chunks don't grow past, so that a slow server isn't sent another
+    large request every few chunks; it can be set back to None, or the method's rate removed from `rates`, to let the
+    chunks grow again. After the last attempt a `ChunkSendError` is raised. Errors returned by the server, such as an
+    unknown entity id, are raised unchanged without retrying.
+
+    A chunk whose request timed out or was rejected may still have been carried out by the server, so retrying it can
+    repeat it. That's harmless for requests which are `repeatable`, such as cutting the same copy of a tool from a body
+    twice, but requests which aren't, such as adding etch items, are only retried when the connection was refused
+    before anything was sent, and otherwise fail with a `ChunkSendError` straight away.
+
+    The chunks of the last bulk request are described in `last_report`, and `progress` is called with each chunk's
+    `ChunkTiming` as it's sent. """
+
+    def __init__(self, target_seconds: float = 0.5, initial_items: int = 2000, min_items: int = 16,
+                 max_items: int = 100000, max_bytes: int = 2 ** 23, max_attempts: int = 3, backoff: float = 0.1,
+                 progress: Optional[Callable[[ChunkTiming], None]] = None):
+        if not 1 <= min_items <= max_items:
+            raise ValueError("min_items must be at least 1 and no more than max_items")
+        if max_attempts < 1:
+            raise ValueError("max_attempts must be at least 1")
+
+        self.target_seconds = target_seconds
+        self.min_items = min_items
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.progress = progress
+        self.initial_items = min(max(initial_items, min_items), max_items)
+        self.rates: dict[str, ChunkRate] = {}
+        self.last_report: Optional[ChunkReport] = None
+
+    def rate(self, method: str) -> ChunkRate:
+        """ The rate learned for the request method, starting a new one if it hasn't been sent yet """
+        rate = self.rates.get(method)
+        if rate is None:
+            rate = self.rates[method] = ChunkRate(self.initial_items)
+        return rate
+
+    def send(self, method: str, items: Sequence, encode: Callable[[Sequence], RawJson],
+             call: Callable[[RawJson], Any], repeatable: bool = True) -> list:
+        """ Send the items in chunks, encoding each chunk with `encode` and sending it with `call`, and return the
+        result of each chunk's call. The chunks are sized by the rate learned for `method`, the request method `call`
+        sends. Unless the request is `repeatable`, a chunk is only retried when nothing was sent. """
+        plan = _Plan(self, self.rate(method), items, encode, repeatable)
+        while not plan.done:
+            payload = plan.payload()
+            start = time.perf_counter()
+            try:
+                result = call(payload)
+            except Exception as e:
+                time.sleep(plan.failed(e))
+                continue
+            plan.succeeded(result, time.perf_counter() - start)
+        return plan.results
+
+    async def send_async(self, method: str, items: Sequence, encode: Callable[[Sequence], RawJson],
+                         call: Callable[[RawJson], Awaitable[Any]], repeatable: bool = True) -> list:
+        """ Async version of `send` """
+        plan = _Plan(self, self.rate(method), items, encode, repeatable)
+        while not plan.done:
+            payload = plan.payload()
+            start = time.perf_counter()
+            try:
+                result = await call(payload)
+            except Exception as e:
+                await asyncio.sleep(plan.failed(e))
+                continue
+            plan.succeeded(result, time.perf_counter() - start)
+        return plan.results
+
+    def _adapt(self, rate: ChunkRate, items: int, seconds: float, last: bool):
+        short = last and items < rate.chunk_items
+        if short and seconds <= self.target_seconds:
+            # A last chunk smaller than planned which was quick enough says little about the time per item, but a much
+            # smaller one is a good measure of the latency
+            if 4 * items <= rate.chunk_items and rate.seconds_per_item is not None:
+                sample = max(seconds - items * rate.seconds_per_item, 0.0)
+                rate.latency = sample if rate.latency is None else 0.5 * (rate.latency + sample)
+            return
+
+        # The latency is taken off the chunk's time, but never more than half of it in case it was measured when the
+        # server was quicker than it is now
+        latency = min(rate.latency or 0.0, 0.5 * seconds)
+        per_item = (seconds - latency) / items
+        if rate.seconds_per_item is None:
+            rate.seconds_per_item = per_item
+        else:
+            rate.seconds_per_item = 0.5 * (rate.seconds_per_item + per_item)
+        budget = max(self.target_seconds - (rate.latency or 0.0), 0.5 * self.target_seconds)
+        target = int(budget / max(rate.seconds_per_item, 1e-12))
+        limit = min(2 * max(items, rate.chunk_items), rate.ceiling or self.max_items)
+        size = max(self.min_items, min(target, limit))
+        # A short last chunk which was too slow can only make the chunks smaller
+        rate.chunk_items = min(size, rate.chunk_items) if short else size
+
+    def _shrink(self, rate: ChunkRate, items: int, limit: bool):
+        rate.chunk_items = max(self.min_items, min(items // 2, self.max_items))
+        if limit:
+            rate.ceiling = rate.chunk_items
+
+
+class _Plan:
+    """ Progress through one bulk request, shared by the sync and async send loops """
+
+    def __init__(self, sender: ChunkedSender, rate: ChunkRate, items: Sequence, encode: Callable[[Sequence], RawJson],
+                 repeatable: bool):
+        self.sender = sender
+        self.rate = rate
+        self.repeatable = repeatable
+        self.items = items
+        self.encode = encode
+        self.position = 0
+        self.size = 0
+        self.attempts = 1
+        self.results = []
+        self.report = ChunkReport()
+        self._payload: Optional[RawJson] = None
+        sender.last_report = self.report
+
+    @property
+    def done(self) -> bool:
+        return self.position >= len(self.items)
+
+    def payload(self) -> RawJson:
+        sender = self.sender
+        self.size = min(self.rate.chunk_items, len(self.items) - self.position)
+        payload = self.encode(self.items[self.position:self.position + self.size])
+        while len(payload) > sender.max_bytes and self.size > 1:
+            self.size = max(1, min(self.size - 1, int(self.size * sender.max_bytes / len(payload))))
+            payload = self.encode(self.items[self.position:self.position + self.size])
+        self._payload = payload
+        return payload
+
+    def succeeded(self, result, seconds: float):
+        deferred = isinstance(result, PendingResponse)
+        timing = ChunkTiming(len(self.report.chunks), self.size, len(self._payload), 0.0 if deferred else seconds,
+                             self.attempts)
+        self.report.chunks.append(timing)
+        self.results.append(result)
+        self.position += self.size
+        if not deferred:
+            self.sender._adapt(self.rate, self.size, seconds, self.done)
+        self.attempts = 1
+        if self.sender.progress is not None:
+            self.sender.progress(timing)
+
+    def failed(self, error: Exception) -> float:
+        """ Record a failed attempt, raising if the chunk can't be retried, and return how long to wait before the
+        next attempt """
+        if not isinstance(error, (OSError, _Rejected)):
+            raise error
+        # A refused connection is the only failure which is known to have happened before anything was sent
+        unsent = isinstance(error, ConnectionRefusedError)
+        if self.attempts >= self.sender.max_attempts or not (self.repeatable or unsent):
+            raise ChunkSendError(f"Chunk {len(self.report.chunks)} of {self.size} items failed on attempt "
+                                 f"{self.attempts}, with {self.position} of {len(self.items)} items sent: {error}",
+                                 self.report, self.position) from error
+        self.sender._shrink(self.rate, self.size, isinstance(error, TimeoutError))
+        self.attempts += 1
+        return self.sender.backoff * 2 ** (self.attempts - 2)
+
+
+class _Rejected(Exception):
+    """ The server answered a chunk with a falsy result where it should have been truthy """
+    pass
+
+
+def _caller(interface, build: Callable[[RawJson], dict], message: Optional[str] = None) -> Callable[[RawJson], Any]:
+    """ A call for `ChunkedSender.send` which sends the request built around each chunk's payload. With a `message`,
+    the result must be truthy; deferred requests are given the message to check their result with when it arrives. """
+    def call(payload: RawJson):
+        response = interface(build(payload))
+        if isinstance(response, PendingResponse):
+            if message is not None:
+                response.expect_true(message)
+            return response
+        if message is not None and not response.result:
+            raise _Rejected(message)
+        return response.result
+
+    return call
+
+
+def _async_caller(interface, build: Callable[[RawJson], dict],
+                  message: Optional[str] = None) -> Callable[[RawJson], Awaitable[Any]]:
+    async def call(payload: RawJson):
+        response = await interface(build(payload))
+        if message is not None and not response.result:
+            raise _Rejected(message)
+        return response.result
+
+    return call
+
+
+def _combined(results: list):
+    """ The result of a bulk request from the results of its chunks: the first falsy one, or else the last """
+    if not results:
+        return None
+    return next((r for r in results if not r), results[-1])
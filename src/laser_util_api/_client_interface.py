@@ -1,33 +1,257 @@
-from typing import Callable, Union
-from jsonrpcclient import Ok
-from .vector import Vector, Transform, Xyr, Units
+from typing import Any, Callable, Optional, Sequence, Union
+
+import numpy
+from jsonrpcclient import Ok, Error, parse
+from .vector import Vector, VectorArray, Transform, Xyr, Units
+from ._codec import JsonCodec, get_codec
+
+
+class RpcError(Exception):
+    """ Raised when the server answers a request with a JSON-RPC error response """
+
+    METHOD_NOT_FOUND = -32601
+
+    def __init__(self, message: str, code: Optional[int] = None, data: Any = None):
+        super().__init__(message)
+        self.code = code
+        self.data = data
+
+    @staticmethod
+    def from_response(response) -> "RpcError":
+        return RpcError(response.message, response.code, response.data)
+
+
+class UnexpectedResponseError(Exception):
+    """ Raised when the server answers with a response whose id does not match any request waiting for it, which means
+    the client and server have gotten out of step on the connection. """
+    pass
+
+
+class PendingResponse:
+    """ Placeholder for the response to a request which has been queued or sent, but which has not been read back
+    from the server yet. Reading `.result` before the response has arrived will force it to be resolved, so code which
+    needs a value immediately still works, it just loses the benefit of deferring the request. """
+
+    def __init__(self, request_id: Any, resolve: Callable[[], None]):
+        self.id = request_id
+        self._resolve = resolve
+        self._done = False
+        self._result = None
+        self._error: Optional[Exception] = None
+        self._failure_message: Optional[str] = None
+        self._callbacks: list[Callable[[], None]] = []
+
+    def __repr__(self):
+        if not self._done:
+            return f"PendingResponse(id={self.id!r})"
+        if self._error is not None:
+            return f"PendingResponse(id={self.id!r}, error={self._error!r})"
+        return f"PendingResponse(id={self.id!r}, result={self._result!r})"
+
+    def done(self) -> bool:
+        return self._done
+
+    @property
+    def error(self) -> Optional[Exception]:
+        return self._error
+
+    @property
+    def result(self):
+        if not self._done:
+            self._resolve()
+        if not self._done:
+            raise Exception(f"No response was received for request {self.id!r}")
+        if self._error is not None:
+            raise self._error
+        return self._result
+
+    def expect_true(self, message: str):
+        """ Mark this response as one whose result must be truthy, failing with the given message otherwise. """
+        self._failure_message = message
+
+    def then(self, callback: Callable[[], None]):
+        """ Call `callback` once the request has succeeded, including the check set by `expect_true`, or straight away
+        if it already has. It isn't called if the request fails. """
+        if not self._done:
+            self._callbacks.append(callback)
+        elif self._error is None:
+            callback()
+
+    def set_result(self, value):
+        self._result = value
+        if self._failure_message is not None and not value:
+            self._error = Exception(self._failure_message)
+        self._done = True
+        callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            if self._error is not None:
+                break
+            try:
+                callback()
+            except Exception as e:
+                # Kept as the response's error, so that a batch or pipeline still resolves the other responses
+                # before raising it
+                self._error = e
+
+    def set_error(self, error: Exception):
+        self._error = error
+        self._done = True
 
 
 class ApiInterface:
-    def __init__(self, get_units: Callable[[], Units], rpc_call: Callable[[dict], Ok]):
+    def __init__(self, get_units: Callable[[], Units], rpc_call: Callable[[dict], Union[Ok, PendingResponse]],
+                 batch_call: Optional[Callable[[list[dict]], list]] = None, codec: Optional[JsonCodec] = None):
         self.get_units = get_units
+        self.codec = codec if codec is not None else get_codec()
         self._rpc = rpc_call
+        self._batch = batch_call
+
+        # Names of server methods which have been found not to exist, so that callers with a fallback don't keep
+        # trying them
+        self.unsupported: set[str] = set()
+
+        # Objects notified when project entities are created, changed, or deleted through this interface, such as a
+        # tree cache. Each must have `entity_added`, `entity_changed`, `entity_removed`, and `entities_reset` methods.
+        self.entity_listeners: list = []
+
+        # The `ChunkedSender` which splits bulk requests into chunks and retries them, set by the clients. Without
+        # one, bulk requests are sent whole, or in fixed size chunks where they have always been split.
+        self.chunking = None
+
+    def entity_added(self, item):
+        for listener in self.entity_listeners:
+            listener.entity_added(item)
+
+    def entity_changed(self, item, geometry: bool = False):
+        """ Notify listeners that an entity was modified by the client. `geometry` indicates a change which will have
+        altered the entity's bounds on the server, which the client can't compute locally. """
+        for listener in self.entity_listeners:
+            listener.entity_changed(item, geometry)
+
+    def entity_removed(self, item):
+        for listener in self.entity_listeners:
+            listener.entity_removed(item)
+
+    def entities_reset(self):
+        """ Notify listeners that the whole project was replaced, such as by opening or creating a project """
+        for listener in self.entity_listeners:
+            listener.entities_reset()
 
     def __call__(self, *args, **kwargs):
         return self._rpc(*args, **kwargs)
 
-    def convert_from_api(self, value: Union[float, Vector, Xyr]):
+    @staticmethod
+    def result(response: Union[Ok, PendingResponse]):
+        """ Get the result of a response, or the placeholder itself if the request is deferred, such as when it is
+        part of an open batch. Use this where the caller does not need the value right away. """
+        if isinstance(response, PendingResponse):
+            return response
+        return response.result
+
+    def call_checked(self, request_data: dict, message: str, on_success: Optional[Callable[[], None]] = None):
+        """ Perform a call whose result must be truthy, raising an exception with the given message otherwise. If the
+        request is deferred the check is performed when the response arrives. `on_success` is called once the check
+        has passed, so that local state is only updated to match a change the server accepted. """
+        response = self._rpc(request_data)
+        if isinstance(response, PendingResponse):
+            response.expect_true(message)
+            if on_success is not None:
+                response.then(on_success)
+            return response
+
+        if not response.result:
+            raise Exception(message)
+        if on_success is not None:
+            on_success()
+        return response.result
+
+    def call_batch(self, requests: list[dict]) -> list:
+        """ Send a list of requests in a single JSON-RPC batch and return their results in the same order, raising the
+        first error. Falls back to individual calls if the client was not given a way to send batches. """
+        if self._batch is None:
+            return [self._rpc(data).result for data in requests]
+
+        responses = self._batch(requests)
+        if isinstance(responses, dict):
+            responses = [responses]
+
+        by_id = {parsed.id: parsed for parsed in parse(responses)}
+        results = []
+        for data in requests:
+            parsed = by_id.get(data["id"])
+            if parsed is None:
+                raise UnexpectedResponseError(f"No response to batched request {data['method']} (id={data['id']!r})")
+            if isinstance(parsed, Error):
+                raise RpcError.from_response(parsed)
+            results.append(parsed.result)
+        return results
+
+    def convert_from_api(self, value: Union[float, Vector, Xyr, VectorArray, numpy.ndarray, Sequence]):
+        """ Convert a value from the server's millimeters into the client's units. Besides single values, this takes
+        NumPy arrays of lengths, `VectorArray`s, and lists of `Vector` or `Xyr`, which are converted in one vectorized
+        operation and returned as an Nx2 or Nx3 array. Nothing is scaled when the client is using millimeters. """
         u = self.get_units()
         if isinstance(value, Vector):
             return Vector(u.from_mm(value.x), u.from_mm(value.y))
         elif isinstance(value, Xyr):
             return Xyr(u.from_mm(value.x), u.from_mm(value.y), value.r)
+        elif isinstance(value, VectorArray):
+            return value if u == Units.MM else VectorArray(u.from_mm(value.array))
+        elif isinstance(value, (list, tuple)):
+            return _convert_sequence(value, u, u.from_mm)
         else:
             return u.from_mm(value)
 
-    def convert_to_api(self, value: Union[float, Vector, Xyr]):
+    def convert_to_api(self, value: Union[float, Vector, Xyr, VectorArray, numpy.ndarray, Sequence]):
+        """ Convert a value from the client's units into the server's millimeters, taking the same kinds of values as
+        `convert_from_api` """
         u = self.get_units()
         if isinstance(value, Vector):
             return Vector(u.to_mm(value.x), u.to_mm(value.y))
         elif isinstance(value, Xyr):
             return Xyr(u.to_mm(value.x), u.to_mm(value.y), value.r)
+        elif isinstance(value, VectorArray):
+            return value if u == Units.MM else VectorArray(u.to_mm(value.array))
+        elif isinstance(value, (list, tuple)):
+            return _convert_sequence(value, u, u.to_mm)
         else:
             return u.to_mm(value)
 
+    def convert_xyrs_to_api(self, values: Union[Sequence[Xyr], numpy.ndarray]) -> numpy.ndarray:
+        """ Convert a list of `Xyr` or an Nx3 array of (x, y, r) rows into an Nx3 array in millimeters, leaving the
+        angles untouched """
+        u = self.get_units()
+        if isinstance(values, numpy.ndarray):
+            rows = values.astype(float).reshape(-1, 3)
+            if u != Units.MM:
+                rows[:, :2] = u.to_mm(rows[:, :2])
+            return rows
+        return _convert_sequence(values, u, u.to_mm).reshape(-1, 3)
+
+
+def _convert_sequence(values: Sequence, units: Units, convert: Callable) -> numpy.ndarray:
+    if values and isinstance(values[0], Xyr):
+        rows = numpy.array([(v.x, v.y, v.r) for v in values], dtype=float)
+        if units != Units.MM:
+            rows[:, :2] = convert(rows[:, :2])
+        return rows
+
+    if values and isinstance(values[0], Vector):
+        rows = numpy.array([(v.x, v.y) for v in values], dtype=float)
+    else:
+        rows = numpy.array(values, dtype=float)
+    return rows if units == Units.MM else convert(rows)
+
+
+class AsyncApiInterface(ApiInterface):
+    """ Interface handed to the objects created by an `AsyncApiClient`. Calls are coroutines which resolve to the
+    response, while unit conversion is shared with the synchronous interface. """
 
+    async def __call__(self, request_data: dict) -> Ok:
+        return await self._rpc(request_data)
 
+    async def call_checked(self, request_data: dict, message: str):
+        response = await self._rpc(request_data)
+        if not response.result:
+            raise Exception(message)
+        return response.result
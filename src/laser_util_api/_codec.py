@@ -0,0 +1,127 @@
+from __future__ import annotations
+import json
+import secrets
+from typing import Any, Optional, Union
+from uuid import UUID
+
+import numpy
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import ujson
+except ImportError:
+    ujson = None
+
+# Marks the places in an encoded request where pre-serialized fragments are spliced in. The random part keeps it from
+# colliding with anything a caller might send.
+_PLACEHOLDER = "@@laser-util-raw-json-{}-" + secrets.token_hex(8) + "@@"
+
+
+class RawJson:
+    """ A value which has already been serialized to JSON, such as a large set of transforms which is prepared once
+    and sent many times. When it's used as a request parameter its bytes are written into the request as they are
+    instead of being encoded again. Etch items are also collected as `RawJson`, but since the server takes them as a
+    string they are escaped into the request as one, rather than spliced in. """
+    __slots__ = ("data",)
+
+    def __init__(self, data: Union[bytes, str]):
+        self.data = data.encode("utf-8") if isinstance(data, str) else bytes(data)
+
+    def __len__(self):
+        return len(self.data)
+
+    def __repr__(self):
+        return f"RawJson({len(self.data)} bytes)"
+
+
+def _default(value):
+    # Types which appear in request parameters but aren't natively handled by every JSON library
+    if isinstance(value, numpy.ndarray):
+        return value.tolist()
+    if isinstance(value, numpy.generic):
+        return value.item()
+    if isinstance(value, UUID):
+        return str(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+class JsonCodec:
+    """ Encodes requests to bytes and decodes responses, using the Python standard library. Subclasses use faster
+    JSON libraries when they are installed; `get_codec()` picks the fastest one available. """
+    name = "json"
+
+    def dumps(self, value: Any) -> bytes:
+        return json.dumps(value, default=_default).encode("utf-8")
+
+    def loads(self, data: Union[bytes, str]) -> Any:
+        return json.loads(data)
+
+    def encode_request(self, value: Union[dict, list[dict]]) -> bytes:
+        """ Encode a request or a batch of requests, splicing in any `RawJson` parameters without re-encoding them """
+        fragments: list[bytes] = []
+        if isinstance(value, list):
+            swapped = [_swap_raw(data, fragments) for data in value]
+        else:
+            swapped = _swap_raw(value, fragments)
+
+        encoded = self.dumps(swapped)
+        for i, fragment in enumerate(fragments):
+            encoded = encoded.replace(b'"' + _PLACEHOLDER.format(i).encode("ascii") + b'"', fragment, 1)
+        return encoded
+
+
+class OrjsonCodec(JsonCodec):
+    name = "orjson"
+
+    def dumps(self, value: Any) -> bytes:
+        return orjson.dumps(value, default=_default, option=orjson.OPT_SERIALIZE_NUMPY)
+
+    def loads(self, data: Union[bytes, str]) -> Any:
+        return orjson.loads(data)
+
+
+class UjsonCodec(JsonCodec):
+    name = "ujson"
+
+    def dumps(self, value: Any) -> bytes:
+        return ujson.dumps(value, ensure_ascii=False, default=_default).encode("utf-8")
+
+    def loads(self, data: Union[bytes, str]) -> Any:
+        return ujson.loads(data)
+
+
+def get_codec(name: Optional[str] = None) -> JsonCodec:
+    """ Get a codec by name ("orjson", "ujson", or "json"), or the fastest one installed if no name is given """
+    available = {"json": JsonCodec}
+    if ujson is not None:
+        available["ujson"] = UjsonCodec
+    if orjson is not None:
+        available["orjson"] = OrjsonCodec
+
+    if name is None:
+        for preferred in ("orjson", "ujson", "json"):
+            if preferred in available:
+                return available[preferred]()
+    if name not in available:
+        raise ValueError(f"JSON codec '{name}' is not installed, available codecs are {list(available)}")
+    return available[name]()
+
+
+def _swap_raw(data: dict, fragments: list[bytes]) -> dict:
+    """ Replace any `RawJson` parameters of a request with placeholder strings, collecting their bytes """
+    params = data.get("params")
+    if not isinstance(params, (list, tuple)) or not any(isinstance(p, RawJson) for p in params):
+        return data
+
+    swapped = []
+    for p in params:
+        if isinstance(p, RawJson):
+            swapped.append(_PLACEHOLDER.format(len(fragments)))
+            fragments.append(p.data)
+        else:
+            swapped.append(p)
+    return dict(data, params=swapped)
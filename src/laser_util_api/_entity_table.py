@@ -0,0 +1,136 @@
+from __future__ import annotations
+from typing import Optional, Union
+
+import numpy
+
+from ._lazy_entities import LazyEntity
+from .vector import Aabb, Vector, Units
+
+
+class EntityTable:
+    """ Columnar snapshot of the project tree, holding each property of every entity in its own array so that
+    questions about the whole project can be answered with vectorized NumPy operations instead of a Python loop over
+    `ProjectItem` objects. Lengths are in the client's units.
+
+    Columns:
+        ids: (N,) array of UUID strings
+        names: (N,) object array of names
+        type_codes: (N,) integer array of indices into `type_names`
+        visible, locked, for_construction: (N,) boolean arrays
+        bounds: (N, 4) array of (min x, min y, max x, max y)
+        origins: (N, 3) array of (x, y, r)
+
+    Boolean masks returned by the query methods can be passed to `select` to get a smaller table, and a row's entity
+    can be retrieved with `client.tree[table.ids[i]]`. """
+
+    def __init__(self, ids: numpy.ndarray, names: numpy.ndarray, type_names: list[str], type_codes: numpy.ndarray,
+                 visible: numpy.ndarray, locked: numpy.ndarray, for_construction: numpy.ndarray,
+                 bounds: numpy.ndarray, origins: numpy.ndarray):
+        self.ids = ids
+        self.names = names
+        self.type_names = type_names
+        self.type_codes = type_codes
+        self.visible = visible
+        self.locked = locked
+        self.for_construction = for_construction
+        self.bounds = bounds
+        self.origins = origins
+
+    @staticmethod
+    def from_entries(entries: list[LazyEntity], units: Units) -> EntityTable:
+        """ Build a table from tree entries, reading the raw server values of any which haven't been turned into
+        project items yet """
+        count = len(entries)
+        ids = []
+        names = numpy.empty(count, dtype=object)
+        type_names: dict[str, int] = {}
+        type_codes = numpy.empty(count, dtype=numpy.int32)
+        flags = numpy.empty((count, 3), dtype=bool)
+
+        # Geometry is gathered in millimeters so that it can be converted to the client's units in one step
+        bounds = numpy.empty((count, 4))
+        origins = numpy.empty((count, 3))
+
+        for i, entry in enumerate(entries):
+            ids.append(entry.id_str)
+            names[i] = entry.name
+            type_codes[i] = type_names.setdefault(entry.type_name, len(type_names))
+
+            raw = entry.raw
+            if entry.materialized:
+                item = entry.item
+                flags[i] = (item.visible, item.drag_locked, item.for_construction)
+            else:
+                info = raw["Info"]
+                flags[i] = (info["IsVisible"], info["IsLocked"], info["IsSuppressed"])
+
+            if raw is not None:
+                # Geometry changes made by the client mark an entry stale, so the raw values are current
+                b = raw["Bounds"]
+                bounds[i] = (b["MinX"], b["MinY"], b["MaxX"], b["MaxY"])
+                o = raw["Info"]["Origin"]["Xyr"]
+                origins[i] = (o["X"], o["Y"], o["R"])
+            else:
+                b = entry.item.aabb
+                bounds[i] = units.to_mm(numpy.array((b.min_bound.x, b.min_bound.y, b.max_bound.x, b.max_bound.y)))
+                o = entry.item.origin
+                origins[i] = (units.to_mm(o.x), units.to_mm(o.y), o.r)
+
+        bounds = units.from_mm(bounds)
+        origins[:, :2] = units.from_mm(origins[:, :2])
+
+        return EntityTable(numpy.array(ids, dtype="U36"), names, list(type_names), type_codes,
+                           flags[:, 0].copy(), flags[:, 1].copy(), flags[:, 2].copy(), bounds, origins)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __repr__(self):
+        return f"EntityTable({len(self)} entities)"
+
+    def select(self, mask: Union[numpy.ndarray, slice, list]) -> EntityTable:
+        """ Get a table of only the rows selected by a boolean mask, index array, or slice """
+        return EntityTable(self.ids[mask], self.names[mask], self.type_names, self.type_codes[mask],
+                           self.visible[mask], self.locked[mask], self.for_construction[mask],
+                           self.bounds[mask], self.origins[mask])
+
+    def of_type(self, type_name: str) -> numpy.ndarray:
+        """ Mask of the entities of the given type, such as "Body" or "Etch" """
+        if type_name not in self.type_names:
+            return numpy.zeros(len(self), dtype=bool)
+        return self.type_codes == self.type_names.index(type_name)
+
+    def overlapping(self, region: Aabb) -> numpy.ndarray:
+        """ Mask of the entities whose bounds touch or overlap the region """
+        b = self.bounds
+        return ((b[:, 2] >= region.min_bound.x) & (b[:, 0] <= region.max_bound.x) &
+                (b[:, 3] >= region.min_bound.y) & (b[:, 1] <= region.max_bound.y))
+
+    def inside(self, region: Aabb) -> numpy.ndarray:
+        """ Mask of the entities whose bounds lie entirely within the region """
+        b = self.bounds
+        return ((b[:, 0] >= region.min_bound.x) & (b[:, 2] <= region.max_bound.x) &
+                (b[:, 1] >= region.min_bound.y) & (b[:, 3] <= region.max_bound.y))
+
+    def crossing(self, region: Aabb) -> numpy.ndarray:
+        """ Mask of the entities whose bounds overlap the region but are not entirely within it, such as the
+        entities which hang over the edge of the bed """
+        return self.overlapping(region) & ~self.inside(region)
+
+    def in_region(self, region: Aabb, contained: bool = False) -> EntityTable:
+        """ Get a table of the entities overlapping the region, or only of those entirely within it if `contained`
+        is set """
+        return self.select(self.inside(region) if contained else self.overlapping(region))
+
+    def containing(self, point: Vector) -> numpy.ndarray:
+        """ Mask of the entities whose bounds contain the point """
+        b = self.bounds
+        return (b[:, 0] <= point.x) & (point.x <= b[:, 2]) & (b[:, 1] <= point.y) & (point.y <= b[:, 3])
+
+    def overall_bounds(self) -> Optional[Aabb]:
+        """ The bounding box of every entity in the table, or None if the table is empty """
+        if len(self) == 0:
+            return None
+        low = self.bounds[:, :2].min(axis=0)
+        high = self.bounds[:, 2:].max(axis=0)
+        return Aabb(Vector(float(low[0]), float(low[1])), Vector(float(high[0]), float(high[1])))
@@ -1,10 +1,15 @@
-import json
+import os
 from dataclasses import dataclass
+from typing import Callable, Iterator, Optional, Sequence, Union
 from uuid import uuid4, UUID
+import numpy
 from jsonrpcclient import request
 
+from ._chunking import _caller, _combined
 from ._client_interface import ApiInterface
-from .vector import Vector, Xyr, Units
+from ._codec import RawJson
+from ._etch_optimizer import EtchOptimizationReport, optimize_etch_lines
+from .vector import Vector, VectorArray, Xyr, Units
 from ._project_items import ProjectItem
 
 from enum import IntEnum
@@ -64,23 +69,190 @@ class EtchText:
             "horizontal": self.horizontal
         }
 
+def _make_line(interface: ApiInterface, start: Vector, end: Vector, width: float) -> EtchLine:
+    return EtchLine(uuid4(),
+                    interface.convert_to_api(start),
+                    interface.convert_to_api(end),
+                    interface.convert_to_api(width))
+
+
+def _make_text(interface: ApiInterface, position: Vector, r: float, text: str, font_id: int, vertical: VAlign,
+               horizontal: HAlign) -> EtchText:
+    return EtchText(uuid4(),
+                    interface.convert_to_api(position),
+                    r,
+                    text,
+                    font_id,
+                    int(vertical),
+                    int(horizontal))
+
+
+# Payloads larger than this many items are split across several requests by the bulk methods, when the client has no
+# `ChunkedSender` to size the requests
+_BULK_CHUNK_SIZE = 50000
+
+_HEX_DIGITS = numpy.frombuffer(b"0123456789abcdef", dtype=numpy.uint8)
+_UUID_DIGIT_COLUMNS = [i for i in range(36) if i not in (8, 13, 18, 23)]
+
+
+def _bulk_ids(count: int) -> list[str]:
+    """ Generate random (version 4) UUID strings in bulk, from a single read of the system's random source and with
+    the hex formatting done as array operations """
+    raw = numpy.frombuffer(os.urandom(16 * count), dtype=numpy.uint8).reshape(count, 16).copy()
+    raw[:, 6] = (raw[:, 6] & 0x0F) | 0x40
+    raw[:, 8] = (raw[:, 8] & 0x3F) | 0x80
+
+    nibbles = numpy.empty((count, 32), dtype=numpy.uint8)
+    nibbles[:, 0::2] = raw >> 4
+    nibbles[:, 1::2] = raw & 0x0F
+    chars = numpy.full((count, 36), ord("-"), dtype=numpy.uint8)
+    chars[:, _UUID_DIGIT_COLUMNS] = _HEX_DIGITS[nibbles]
+
+    text = chars.tobytes().decode("ascii")
+    return [text[i:i + 36] for i in range(0, 36 * count, 36)]
+
+
+def _points_to_api(interface: ApiInterface, points) -> numpy.ndarray:
+    converted = interface.convert_to_api(points)
+    array = converted.array if isinstance(converted, VectorArray) else numpy.asarray(converted, dtype=float)
+    if array.ndim != 2 or array.shape[1] != 2:
+        raise ValueError("Points must be an Nx2 array, a VectorArray, or a list of Vector")
+    return array
+
+
+def _per_item(value, count: int, dtype=float) -> numpy.ndarray:
+    """ Broadcast a scalar or an array of values to one value per item """
+    return numpy.broadcast_to(numpy.asarray(value, dtype=dtype), (count,))
+
+
+def _line_rows(interface: ApiInterface, starts, ends, widths) -> numpy.ndarray:
+    """ Convert arrays of line start points, end points, and widths in the client's units to an Nx5 array of
+    x0, y0, x1, y1, and width in millimeters """
+    starts = _points_to_api(interface, starts)
+    ends = _points_to_api(interface, ends)
+    if starts.shape != ends.shape:
+        raise ValueError("There must be the same number of start and end points")
+
+    widths = interface.convert_to_api(_per_item(widths, len(starts)))
+    rows = numpy.column_stack((starts, ends, widths))
+    if not numpy.isfinite(rows).all():
+        raise ValueError("Etch lines must have finite coordinates and widths")
+    return rows
+
+
+def _row_dicts(rows: numpy.ndarray) -> list[dict]:
+    """ The serializable form of each etch line in an Nx5 array from `_line_rows`, without creating an `EtchLine` for
+    each """
+    return [{"$type": "line", "id": i, "x0": x0, "y0": y0, "x1": x1, "y1": y1, "width": w}
+            for i, (x0, y0, x1, y1, w) in zip(_bulk_ids(len(rows)), rows.tolist())]
+
+
+def _line_dicts(interface: ApiInterface, starts, ends, widths) -> list[dict]:
+    """ Convert arrays of line start points, end points, and widths in the client's units directly to the serializable
+    form of each etch line """
+    return _row_dicts(_line_rows(interface, starts, ends, widths))
+
+
+def _optimize_rows(interface: ApiInterface, rows: numpy.ndarray) -> tuple[numpy.ndarray, EtchOptimizationReport]:
+    """ Run `optimize_etch_lines` on an Nx5 array of lines in millimeters, reporting the travel in the client's
+    units """
+    starts, ends, widths, report = optimize_etch_lines(rows[:, 0:2], rows[:, 2:4], rows[:, 4])
+    report.travel_before = float(interface.convert_from_api(report.travel_before))
+    report.travel_after = float(interface.convert_from_api(report.travel_after))
+    return numpy.column_stack((starts, ends, widths)), report
+
+
+def _text_dicts(interface: ApiInterface, positions, rs, texts: Sequence[str], font_ids, vertical,
+                horizontal) -> list[dict]:
+    """ Convert arrays of text positions, rotations, strings, and options to the serializable form of each etch
+    text """
+    positions = _points_to_api(interface, positions)
+    count = len(positions)
+    if len(texts) != count:
+        raise ValueError("There must be one text string for each position")
+
+    columns = zip(_bulk_ids(count), positions.tolist(), _per_item(rs, count).tolist(), texts,
+                  _per_item(font_ids, count, int).tolist(), _per_item(vertical, count, int).tolist(),
+                  _per_item(horizontal, count, int).tolist())
+    return [{"$type": "text", "id": i, "x": p[0], "y": p[1], "r": r, "text": str(t), "fontId": f, "vertical": v,
+             "horizontal": h}
+            for i, p, r, t, f, v, h in columns]
+
+
+def _bulk_chunks(interface: ApiInterface, items: list[dict],
+                 chunk_size: int = _BULK_CHUNK_SIZE) -> Iterator[RawJson]:
+    for i in range(0, len(items), chunk_size):
+        yield RawJson(interface.codec.dumps(items[i:i + chunk_size]))
+
+
+def _items_encoder(interface: ApiInterface) -> Callable[[list[dict]], RawJson]:
+    return lambda items: RawJson(interface.codec.dumps(items))
+
+
+def _send_items(interface: ApiInterface, item_id: str, items: list[dict], split: bool = True):
+    """ Add the serializable forms of etch items to the etch entity with the given id, in as many requests as the
+    client's `chunking` sender decides on, and return the combined result. Without a sender, the items are sent in
+    fixed size chunks, or all in one request if `split` is cleared. Adding items can't be safely repeated, so chunks
+    are only retried if they weren't sent. """
+    message = "Failed to add etch item"
+    if interface.chunking is None:
+        chunks = _bulk_chunks(interface, items) if split else [_items_encoder(interface)(items)]
+        return _combined([interface.call_checked(_add_items_request(interface, item_id, chunk), message)
+                          for chunk in chunks])
+
+    call = _caller(interface, lambda payload: _add_items_request(interface, item_id, payload), message)
+    return _combined(interface.chunking.send("AddEtchEntityItem", items, _items_encoder(interface), call,
+                                             repeatable=False))
+
+
+def _add_items_request(interface: ApiInterface, item_id: str, payload: Union[list, RawJson]) -> dict:
+    """ Build the request which adds a list of etch lines and/or texts to the etch entity with the given id.
+
+    AddEtchEntityItem takes the items as a JSON document inside a string parameter, so they are always encoded twice:
+    once into the inner document, and again when that string is escaped into the request. The inner document is made
+    with the client's codec, or taken from a `RawJson` array as it is, but a `RawJson` payload can't be spliced into
+    the request unescaped the way prepared transforms are. """
+    if isinstance(payload, RawJson):
+        prepared = payload.data.decode("utf-8")
+    else:
+        prepared = interface.codec.dumps([x.to_dict() for x in payload]).decode("utf-8")
+    return request("AddEtchEntityItem", params=(item_id, prepared,))
+
+
 class EtchTransaction:
-    def __init__(self, project_item: ProjectItem, interface: ApiInterface):
+    """ Collects etch items and sends them when the `with` block exits, in a single request unless the client has a
+    `chunking` sender, which splits them if there are too many for one. With `optimize` set, the
+    lines are first passed through `optimize_etch_lines` to remove duplicates, merge collinear segments, and order them
+    to minimize the travel between them, and the outcome is left in `report`. Texts are sent unchanged, before the
+    lines. """
+
+    def __init__(self, project_item: ProjectItem, interface: ApiInterface, optimize: bool = False):
         self._project_item = project_item
         self._interface = interface
         self._payload = []
+        self._optimize = optimize
+        self.report: Optional[EtchOptimizationReport] = None
 
     def __enter__(self):
         return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
-        prepared = json.dumps([x.to_dict() for x in self._payload])
+        # Nothing is sent if the block raised, and the exception is left to propagate
+        if exc_type is not None:
+            return
+        _send_items(self._interface, str(self._project_item.id), self._prepared_payload(), split=False)
+        self._interface.entity_changed(self._project_item, geometry=True)
 
-        data = request("AddEtchEntityItem", params=(str(self._project_item.id), prepared,))
-        response = self._interface(data)
-        if not response.result:
-            raise Exception("Failed to add etch item")
-        return response.result
+    def _prepared_payload(self) -> list[dict]:
+        if not self._optimize:
+            return [x.to_dict() for x in self._payload]
+
+        lines = [x for x in self._payload if isinstance(x, EtchLine)]
+        texts = [x.to_dict() for x in self._payload if not isinstance(x, EtchLine)]
+        rows = numpy.array([(x.start.x, x.start.y, x.end.x, x.end.y, x.width) for x in lines],
+                           dtype=float).reshape(-1, 5)
+        rows, self.report = _optimize_rows(self._interface, rows)
+        return texts + _row_dicts(rows)
 
 
     def add_line(self, start: Vector, end: Vector, width: float):
@@ -90,10 +262,7 @@ class EtchTransaction:
         :param end: The ending point of the line
         :param width: The width of the line
         """
-        payload = EtchLine(uuid4(),
-                           self._interface.convert_to_api(start),
-                           self._interface.convert_to_api(end),
-                           self._interface.convert_to_api(width))
+        payload = _make_line(self._interface, start, end, width)
         self._payload.append(payload)
 
     def add_text(self, position: Vector, r: float, text: str, font_id: int,
@@ -108,17 +277,126 @@ class EtchTransaction:
         :param vertical: Vertical alignment
         :param horizontal: Horizontal alignment
         """
-        payload = EtchText(uuid4(),
-                           self._interface.convert_to_api(position),
-                           r,
-                           text,
-                           font_id,
-                           int(vertical),
-                           int(horizontal))
+        payload = _make_text(self._interface, position, r, text, font_id, vertical, horizontal)
         self._payload.append(payload)
 
 
+class EtchWriter:
+    """ Streams items into an etch entity in chunks, for jobs too large to hold in a single transaction. Each item is
+    serialized as soon as it's added, and the serialized items are sent whenever `max_items` of them or `max_bytes` of
+    JSON have accumulated, so memory use stays constant no matter how many items are written. Any remaining items are
+    sent when the `with` block exits.
+
+    If a `progress` callable is given, it is called after every chunk with the total number of items and bytes sent so
+    far. With `rollback` set, an exception inside the block deletes the etch entity, since the server has no way of
+    removing individual etch items; use it with an etch created for the job. Writers are created with
+    `EtchItem.writer()`. """
+
+    def __init__(self, project_item: ProjectItem, interface: ApiInterface, max_items: int = 5000,
+                 max_bytes: int = 2 ** 22, progress: Optional[Callable[[int, int], None]] = None,
+                 rollback: bool = False):
+        if max_items < 1 or max_bytes < 1:
+            raise ValueError("max_items and max_bytes must be at least 1")
+
+        self._project_item = project_item
+        self._interface = interface
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self._progress = progress
+        self._rollback = rollback
+        self._buffer = bytearray()
+        self._count = 0
+        self.items_written = 0
+        self.bytes_written = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.flush()
+            return
+
+        self._buffer.clear()
+        self._count = 0
+        if self._rollback:
+            self._project_item.delete()
+
+    @property
+    def pending(self) -> int:
+        """ The number of items added but not yet sent """
+        return self._count
+
+    def add_line(self, start: Vector, end: Vector, width: float):
+        """
+        Add a line to the etch item.
+        :param start: The starting point of the line
+        :param end: The ending point of the line
+        :param width: The width of the line
+        """
+        self._append(_make_line(self._interface, start, end, width))
+
+    def add_text(self, position: Vector, r: float, text: str, font_id: int,
+                 vertical: VAlign = VAlign.CENTER,
+                 horizontal: HAlign = HAlign.CENTER):
+        """
+        Add text to the etch item.
+        :param position: The reference position of the text
+        :param r: The rotation of the text in radians.
+        :param text: The text to add to the etch item
+        :param font_id: The ID of the font to use, found in the workspace settings under "Fonts"
+        :param vertical: Vertical alignment
+        :param horizontal: Horizontal alignment
+        """
+        self._append(_make_text(self._interface, position, r, text, font_id, vertical, horizontal))
+
+    def add_lines(self, starts, ends, widths):
+        """ Add many lines at once. See `EtchItem.add_lines` for the accepted arguments. """
+        dumps = self._interface.codec.dumps
+        for item in _line_dicts(self._interface, starts, ends, widths):
+            self._append_serialized(dumps(item))
+
+    def add_texts(self, positions, rs, texts: Sequence[str], font_id, vertical=VAlign.CENTER,
+                  horizontal=HAlign.CENTER):
+        """ Add many texts at once. See `EtchItem.add_texts` for the accepted arguments. """
+        dumps = self._interface.codec.dumps
+        for item in _text_dicts(self._interface, positions, rs, texts, font_id, vertical, horizontal):
+            self._append_serialized(dumps(item))
+
+    def flush(self):
+        """ Send the items added so far """
+        if not self._count:
+            return
+
+        sent_items = self._count
+        sent_bytes = len(self._buffer) + 2
+        payload = RawJson(b"[" + self._buffer + b"]")
+        self._buffer.clear()
+        self._count = 0
+
+        data = _add_items_request(self._interface, str(self._project_item.id), payload)
+        self._interface.call_checked(data, "Failed to add etch item",
+                                     lambda: self._interface.entity_changed(self._project_item, geometry=True))
+
+        self.items_written += sent_items
+        self.bytes_written += sent_bytes
+        if self._progress is not None:
+            self._progress(self.items_written, self.bytes_written)
+
+    def _append(self, item: Union[EtchLine, EtchText]):
+        self._append_serialized(self._interface.codec.dumps(item.to_dict()))
+
+    def _append_serialized(self, item: bytes):
+        if self._count:
+            self._buffer += b","
+        self._buffer += item
+        self._count += 1
+        if self._count >= self.max_items or len(self._buffer) >= self.max_bytes:
+            self.flush()
+
+
 class EtchItem(ProjectItem):
+    __slots__ = ()
 
     def _add_payload(self, payload):
         working = []
@@ -127,16 +405,20 @@ class EtchItem(ProjectItem):
         else:
             working.append(payload)
 
-        prepared = json.dumps([x.to_dict() for x in working])
+        data = _add_items_request(self._interface, self._id_str(), working)
+        return self._interface.call_checked(data, "Failed to add etch item",
+                                            lambda: self._interface.entity_changed(self, geometry=True))
 
-        data = request("AddEtchEntityItem", params=(self._id_str(), prepared,))
-        response = self._interface(data)
-        if not response.result:
-            raise Exception("Failed to add etch item")
-        return response.result
+    def transaction(self, optimize: bool = False) -> EtchTransaction:
+        """ Create a context manager which sends all the items added inside its block in one request. See
+        `EtchTransaction` for the effect of `optimize`. """
+        return EtchTransaction(self, self._interface, optimize)
 
-    def transaction(self) -> EtchTransaction:
-        return EtchTransaction(self, self._interface)
+    def writer(self, max_items: int = 5000, max_bytes: int = 2 ** 22,
+               progress: Optional[Callable[[int, int], None]] = None, rollback: bool = False) -> EtchWriter:
+        """ Create a context manager which streams the items added inside its block to the server in chunks of at most
+        `max_items` items or `max_bytes` bytes. See `EtchWriter` for details. """
+        return EtchWriter(self, self._interface, max_items, max_bytes, progress, rollback)
 
     def add_line(self, start: Vector, end: Vector, width: float):
         """
@@ -145,10 +427,7 @@ class EtchItem(ProjectItem):
         :param end: The ending point of the line
         :param width: The width of the line
         """
-        payload = EtchLine(uuid4(),
-                           self._interface.convert_to_api(start),
-                           self._interface.convert_to_api(end),
-                           self._interface.convert_to_api(width))
+        payload = _make_line(self._interface, start, end, width)
         self._add_payload([payload])
 
     def add_text(self, position: Vector, r: float, text: str, font_id: int, vertical: VAlign, horizontal: HAlign):
@@ -161,11 +440,46 @@ class EtchItem(ProjectItem):
         :param vertical: Vertical alignment
         :param horizontal: Horizontal alignment
         """
-        payload = EtchText(uuid4(),
-                           self._interface.convert_to_api(position),
-                           r,
-                           text,
-                           font_id,
-                           int(vertical),
-                           int(horizontal))
+        payload = _make_text(self._interface, position, r, text, font_id, vertical, horizontal)
         self._add_payload([payload])
+
+    def add_lines(self, starts, ends, widths, optimize: bool = False) -> int:
+        """
+        Add many lines to the etch item at once, converting and serializing them directly from arrays. Very large sets
+        of lines are sent in several requests, sized by the client's `chunking` sender if it has one.
+        :param starts: The starting points of the lines, as an Nx2 array, a `VectorArray`, or a list of `Vector`
+        :param ends: The ending points of the lines, in the same form as `starts`
+        :param widths: The width of every line, or an array with the width of each line
+        :param optimize: Remove duplicate lines, merge collinear ones, and reorder them for minimal travel before
+            sending them, using `optimize_etch_lines` with its default options
+        :return: The number of lines added, which may be fewer than were given if `optimize` is set
+        """
+        rows = _line_rows(self._interface, starts, ends, widths)
+        if optimize:
+            rows, _ = _optimize_rows(self._interface, rows)
+        items = _row_dicts(rows)
+        self._add_bulk(items)
+        return len(items)
+
+    def add_texts(self, positions, rs, texts: Sequence[str], font_id, vertical=VAlign.CENTER,
+                  horizontal=HAlign.CENTER) -> int:
+        """
+        Add many texts to the etch item at once. Every argument other than `positions` and `texts` may be a single
+        value used for all of the texts or an array with a value for each.
+        :param positions: The reference positions of the texts, as an Nx2 array, a `VectorArray`, or a list of `Vector`
+        :param rs: The rotations of the texts in radians
+        :param texts: The string for each text
+        :param font_id: The ID of the font to use, found in the workspace settings under "Fonts"
+        :param vertical: Vertical alignment
+        :param horizontal: Horizontal alignment
+        :return: The number of texts added
+        """
+        items = _text_dicts(self._interface, positions, rs, texts, font_id, vertical, horizontal)
+        self._add_bulk(items)
+        return len(items)
+
+    def _add_bulk(self, items: list[dict]):
+        if not items:
+            return
+        _send_items(self._interface, self._id_str(), items)
+        self._interface.entity_changed(self, geometry=True)
@@ -0,0 +1,299 @@
+from __future__ import annotations
+import math
+from dataclasses import dataclass
+
+import numpy
+
+
+
+@dataclass
+class EtchOptimizationReport:
+    """ What an etch line optimization pass achieved. Travel is the total distance the laser head moves between the
+    end of one line and the start of the next, in the same units as the lines. """
+    lines_before: int
+    lines_after: int
+    duplicates_removed: int
+    lines_merged: int
+    travel_before: float
+    travel_after: float
+
+    @property
+    def line_reduction(self) -> float:
+        """ Fraction by which the number of lines, and so the size of the payload, was reduced """
+        return 1.0 - self.lines_after / self.lines_before if self.lines_before else 0.0
+
+    @property
+    def travel_reduction(self) -> float:
+        """ Fraction by which the travel between lines was reduced """
+        return 1.0 - self.travel_after / self.travel_before if self.travel_before else 0.0
+
+    def __str__(self):
+        return (f"{self.lines_before} -> {self.lines_after} lines ({self.line_reduction:.1%} fewer, "
+                f"{self.duplicates_removed} duplicates removed, {self.lines_merged} merged), travel "
+                f"{self.travel_before:.6g} -> {self.travel_after:.6g} ({self.travel_reduction:.1%} shorter)")
+
+
+def optimize_etch_lines(starts, ends, widths, tolerance: float = 1e-6, dedupe: bool = True, merge: bool = True,
+                        order: bool = True, two_opt: bool = False):
+    """ Reduce the number of etch lines and the laser head's travel between them.
+
+    :param starts: Nx2 array of line start points
+    :param ends: Nx2 array of line end points
+    :param widths: The width of every line, or an array with the width of each line
+    :param tolerance: Distance within which points, offsets, and widths are considered equal
+    :param dedupe: Remove lines identical to another line, in either direction
+    :param merge: Join collinear lines of equal width which overlap or touch end to end into single lines. This
+        groups the lines together, so without `order` the original order is not kept.
+    :param order: Reorder the lines, and flip their directions, by always moving to the nearest remaining line end
+    :param two_opt: Further improve the order by reversing runs of lines where that shortens the travel. This
+        examines a window of nearby lines in the order for each line, so it's best suited to jobs of moderate size.
+    :return: The start points, end points, and widths of the optimized lines, and an `EtchOptimizationReport`
+    """
+    starts = numpy.array(starts, dtype=float).reshape(-1, 2)
+    ends = numpy.array(ends, dtype=float).reshape(-1, 2)
+    if starts.shape != ends.shape:
+        raise ValueError("There must be the same number of start and end points")
+    widths = numpy.array(numpy.broadcast_to(numpy.asarray(widths, dtype=float), (len(starts),)))
+
+    lines_before = len(starts)
+    travel_before = _travel(starts, ends)
+
+    duplicates = 0
+    if dedupe and len(starts):
+        starts, ends, widths, duplicates = _dedupe(starts, ends, widths, tolerance)
+
+    merged = 0
+    if merge and len(starts):
+        count = len(starts)
+        starts, ends, widths = _merge_collinear(starts, ends, widths, tolerance)
+        merged = count - len(starts)
+
+    if order and len(starts) > 1:
+        starts, ends, widths = _order_nearest(starts, ends, widths)
+        if two_opt:
+            starts, ends, widths = _two_opt(starts, ends, widths)
+
+    report = EtchOptimizationReport(lines_before, len(starts), duplicates, merged, travel_before,
+                                    _travel(starts, ends))
+    return starts, ends, widths, report
+
+
+def _travel(starts: numpy.ndarray, ends: numpy.ndarray) -> float:
+    if len(starts) < 2:
+        return 0.0
+    return float(numpy.hypot(*(starts[1:] - ends[:-1]).T).sum())
+
+
+def _canonical(starts: numpy.ndarray, ends: numpy.ndarray) -> tuple[numpy.ndarray, numpy.ndarray]:
+    """ Put the endpoints of each line in a consistent order, so a line and its reverse look the same """
+    flip = (starts[:, 0] > ends[:, 0]) | ((starts[:, 0] == ends[:, 0]) & (starts[:, 1] > ends[:, 1]))
+    a = numpy.where(flip[:, None], ends, starts)
+    b = numpy.where(flip[:, None], starts, ends)
+    return a, b
+
+
+def _dedupe(starts, ends, widths, tolerance):
+    a, b = _canonical(starts, ends)
+    keys = numpy.round(numpy.column_stack((a, b, widths)) / tolerance).astype(numpy.int64)
+    _, first = numpy.unique(keys, axis=0, return_index=True)
+    first.sort()
+    return starts[first], ends[first], widths[first], len(starts) - len(first)
+
+
+def _merge_collinear(starts, ends, widths, tolerance):
+    """ Group the lines by width, direction, and perpendicular offset, then merge the overlapping or touching intervals
+    along each group's shared line """
+    delta = ends - starts
+    length = numpy.hypot(delta[:, 0], delta[:, 1])
+    movable = length > tolerance
+
+    # Directions are folded into [0, pi) so that a line and its reverse share a group
+    angle = numpy.mod(numpy.arctan2(delta[:, 1], delta[:, 0]), math.pi)
+    angle[angle > math.pi - tolerance] = 0.0
+    ux = numpy.cos(angle)
+    uy = numpy.sin(angle)
+    offset = starts[:, 0] * -uy + starts[:, 1] * ux
+    t0 = starts[:, 0] * ux + starts[:, 1] * uy
+    t1 = ends[:, 0] * ux + ends[:, 1] * uy
+    lo = numpy.minimum(t0, t1)
+    hi = numpy.maximum(t0, t1)
+
+    # The angle is compared with a tolerance scaled to the size of the drawing, so that lines which deviate by less
+    # than the tolerance over their extent are grouped together
+    extent = max(float(numpy.abs(numpy.concatenate((starts, ends))).max()), 1.0)
+    keys = numpy.column_stack((numpy.round(widths / tolerance), numpy.round(angle * extent / tolerance),
+                               numpy.round(offset / tolerance))).astype(numpy.int64)
+
+    fixed = numpy.flatnonzero(~movable)
+    candidates = numpy.flatnonzero(movable)
+    sort = numpy.lexsort((lo[candidates], keys[candidates, 2], keys[candidates, 1], keys[candidates, 0]))
+    candidates = candidates[sort]
+
+    out_s, out_e, out_w = [], [], []
+    lo_list = lo.tolist()
+    hi_list = hi.tolist()
+
+    def emit(i, members, start_t, end_t):
+        if members == 1:
+            # Lines which weren't merged with anything keep their exact original coordinates
+            out_s.append(starts[i])
+            out_e.append(ends[i])
+        else:
+            # Rebuild the merged line along the group's shared direction from the first line's offset
+            out_s.append((start_t * ux[i] - offset[i] * uy[i], start_t * uy[i] + offset[i] * ux[i]))
+            out_e.append((end_t * ux[i] - offset[i] * uy[i], end_t * uy[i] + offset[i] * ux[i]))
+        out_w.append(widths[i])
+
+    current = None
+    current_key = None
+    members = 0
+    run_lo = run_hi = 0.0
+    keys_list = keys.tolist()
+    for i in candidates.tolist():
+        key = keys_list[i]
+        if key == current_key and lo_list[i] <= run_hi + tolerance:
+            run_hi = max(run_hi, hi_list[i])
+            members += 1
+            continue
+        if current is not None:
+            emit(current, members, run_lo, run_hi)
+        current, current_key, members, run_lo, run_hi = i, key, 1, lo_list[i], hi_list[i]
+    if current is not None:
+        emit(current, members, run_lo, run_hi)
+
+    merged_s = numpy.array(out_s, dtype=float).reshape(-1, 2)
+    merged_e = numpy.array(out_e, dtype=float).reshape(-1, 2)
+    merged_w = numpy.array(out_w, dtype=float)
+
+    return (numpy.concatenate((merged_s, starts[fixed])), numpy.concatenate((merged_e, ends[fixed])),
+            numpy.concatenate((merged_w, widths[fixed])))
+
+
+def _order_nearest(starts, ends, widths):
+    """ Greedy nearest-neighbor ordering. Both ends of every line are held in a grid of points, and from the end of
+    each line the next line is the one with the nearest remaining endpoint, flipped if that endpoint is its end. """
+    count = len(starts)
+    points = numpy.concatenate((starts, ends))
+    grid = _PointGrid(points)
+
+    order = numpy.empty(count, dtype=numpy.int64)
+    flipped = numpy.zeros(count, dtype=bool)
+    point_list = points.tolist()
+
+    # Start from the line end nearest the lower left corner of the job
+    x, y = points.min(axis=0).tolist()
+    for n in range(count):
+        k = grid.pop_nearest(x, y)
+        line = k % count
+        reverse = k >= count
+        grid.discard(line if reverse else line + count)
+        order[n] = line
+        flipped[n] = reverse
+        x, y = point_list[line if reverse else line + count]
+
+    s = starts[order]
+    e = ends[order]
+    s[flipped], e[flipped] = e[flipped], s[flipped].copy()
+    return s, e, widths[order]
+
+
+class _PointGrid:
+    """ Uniform grid of points supporting removal of the nearest point to a location. This is a stripped down form of
+    `SpatialIndex` for the ordering pass, which makes one query per line and only ever deals with points, so it avoids
+    the cost of general bounding boxes. """
+
+    def __init__(self, points: numpy.ndarray):
+        low = points.min(axis=0)
+        span = points.max(axis=0) - low
+        self.cell = max(math.sqrt(max(span[0], 1e-12) * max(span[1], 1e-12) / len(points)),
+                        float(span.max()) / 4096, 1e-9)
+        self.points = points.tolist()
+        self.cell_of: list[tuple[int, int]] = []
+        self.cells: dict[tuple[int, int], list[int]] = {}
+
+        indices = numpy.floor(points / self.cell).astype(numpy.int64).tolist()
+        for k, (i, j) in enumerate(indices):
+            key = (i, j)
+            self.cell_of.append(key)
+            self.cells.setdefault(key, []).append(k)
+
+    def discard(self, k: int):
+        key = self.cell_of[k]
+        cell = self.cells[key]
+        cell.remove(k)
+        if not cell:
+            del self.cells[key]
+
+    def pop_nearest(self, x: float, y: float) -> int:
+        ci = math.floor(x / self.cell)
+        cj = math.floor(y / self.cell)
+        best = -1
+        best_d = math.inf
+        ring = 0
+        while True:
+            if (2 * ring + 1) ** 2 > len(self.cells):
+                # Few occupied cells remain, so it's cheaper to check every remaining point
+                for cell in self.cells.values():
+                    for k in cell:
+                        px, py = self.points[k]
+                        d = math.hypot(px - x, py - y)
+                        if d < best_d:
+                            best, best_d = k, d
+                break
+
+            for key in _ring(ci, cj, ring):
+                cell = self.cells.get(key)
+                if cell:
+                    for k in cell:
+                        px, py = self.points[k]
+                        d = math.hypot(px - x, py - y)
+                        if d < best_d:
+                            best, best_d = k, d
+            # Anything outside ring r is at least r cells away
+            if best >= 0 and best_d <= ring * self.cell:
+                break
+            ring += 1
+
+        self.discard(best)
+        return best
+
+
+def _two_opt(starts, ends, widths, window: int = 50, passes: int = 3):
+    """ Windowed 2-opt: reversing the run of lines i..j (and flipping each of them) replaces the travel moves
+    end[i-1] -> start[i] and end[j] -> start[j+1] with end[i-1] -> end[j] and start[i] -> start[j+1] """
+    s = starts.copy()
+    e = ends.copy()
+    w = widths.copy()
+    count = len(s)
+    for _ in range(passes):
+        improved = False
+        for i in range(1, count - 1):
+            j = numpy.arange(i + 1, min(i + window, count - 1))
+            if len(j) == 0:
+                continue
+            prev_end = e[i - 1]
+            before = numpy.hypot(*(s[i] - prev_end)) + numpy.hypot(*(s[j + 1] - e[j]).T)
+            after = numpy.hypot(*(e[j] - prev_end).T) + numpy.hypot(*(s[j + 1] - s[i]).T)
+            gain = before - after
+            best = int(numpy.argmax(gain))
+            if gain[best] > 1e-12:
+                k = int(j[best])
+                s[i:k + 1], e[i:k + 1] = e[i:k + 1][::-1].copy(), s[i:k + 1][::-1].copy()
+                w[i:k + 1] = w[i:k + 1][::-1].copy()
+                improved = True
+        if not improved:
+            break
+    return s, e, w
+
+
+def _ring(ci: int, cj: int, ring: int):
+    """ The cells on the square ring `ring` cells out from cell (ci, cj) """
+    if ring == 0:
+        yield ci, cj
+        return
+    for i in range(ci - ring, ci + ring + 1):
+        yield i, cj - ring
+        yield i, cj + ring
+    for j in range(cj - ring + 1, cj + ring):
+        yield ci - ring, j
+        yield ci + ring, j
@@ -0,0 +1,93 @@
+from __future__ import annotations
+from collections.abc import Sequence
+from typing import Iterator, Optional, Union
+
+from ._client_interface import ApiInterface
+from ._item_factory import create_entity
+from ._project_items import ProjectItem
+
+
+class LazyEntity:
+    """ Holds the raw values of one entity as returned by the server, and only constructs its `ProjectItem` the first
+    time it's asked for. The id, name, type name, and tags can be read from either form without materializing it. """
+    __slots__ = ("raw", "_item", "_interface")
+
+    def __init__(self, raw: Optional[dict], interface: ApiInterface, item: Optional[ProjectItem] = None):
+        self.raw = raw
+        self._item = item
+        self._interface = interface
+
+    @staticmethod
+    def of(item: ProjectItem) -> LazyEntity:
+        return LazyEntity(None, item._interface, item)
+
+    @property
+    def materialized(self) -> bool:
+        return self._item is not None
+
+    @property
+    def item(self) -> ProjectItem:
+        if self._item is None:
+            self._item = create_entity(self.raw, self._interface)
+        return self._item
+
+    @property
+    def id_str(self) -> str:
+        if self._item is not None:
+            return str(self._item.id)
+        return self.raw["Info"]["Id"].lower()
+
+    @property
+    def name(self) -> str:
+        if self._item is not None:
+            return self._item.name
+        return self.raw["Info"]["Name"]
+
+    @property
+    def type_name(self) -> str:
+        if self._item is not None:
+            return self._item.type_name
+        return self.raw["TypeName"].replace("ViewModel", "")
+
+    @property
+    def tags(self) -> tuple:
+        if self._item is not None:
+            return self._item.tags
+        return tuple(self.raw["Info"]["Tags"])
+
+    def reload(self, values: dict):
+        """ Replace the raw values, updating the item in place if it has already been constructed """
+        self.raw = values
+        if self._item is not None:
+            self._item._load(values)
+
+
+class LazyEntityList(Sequence):
+    """ A sequence of project items which are only constructed as they are accessed, so that taking the length of a
+    large project or looking at one item in it doesn't allocate an object for every entity. """
+
+    def __init__(self, entries: list[LazyEntity]):
+        self._entries = entries
+
+    @staticmethod
+    def from_raw(values: list[dict], interface: ApiInterface) -> LazyEntityList:
+        return LazyEntityList([LazyEntity(v, interface) for v in values])
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __getitem__(self, index: Union[int, slice]):
+        if isinstance(index, slice):
+            return LazyEntityList(self._entries[index])
+        return self._entries[index].item
+
+    def __iter__(self) -> Iterator[ProjectItem]:
+        for entry in self._entries:
+            yield entry.item
+
+    def __repr__(self):
+        return f"LazyEntityList({len(self)} entities)"
+
+    def entries(self) -> list[LazyEntity]:
+        return self._entries
+
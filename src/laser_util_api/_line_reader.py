@@ -0,0 +1,44 @@
+import socket
+from typing import Optional
+
+
+class LineReader:
+    """ Buffered reader for newline-delimited messages arriving on a stream socket. Bytes are received directly into a
+    reusable chunk with `recv_into`, and anything left over after a newline is kept in a persistent buffer for the
+    next call, so several messages arriving in a single read are never lost or merged. """
+
+    def __init__(self, sock: socket.socket, chunk_size: int = 65536):
+        self._socket = sock
+        self._chunk = bytearray(chunk_size)
+        self._view = memoryview(self._chunk)
+        self._buffer = bytearray()
+
+        # Position in the buffer up to which we already know there is no newline, so that repeated searches of a
+        # long partial message don't rescan the same bytes
+        self._scanned = 0
+
+    def pending(self) -> int:
+        """ Number of bytes received from the socket which have not yet been returned as part of a message """
+        return len(self._buffer)
+
+    def _take_line(self) -> Optional[bytes]:
+        index = self._buffer.find(b"\n", self._scanned)
+        if index < 0:
+            self._scanned = len(self._buffer)
+            return None
+
+        line = bytes(self._buffer[:index])
+        del self._buffer[:index + 1]
+        self._scanned = 0
+        return line
+
+    def read_line(self) -> bytes:
+        """ Block until a complete newline-terminated message is available and return it without the terminator. """
+        line = self._take_line()
+        while line is None:
+            count = self._socket.recv_into(self._chunk)
+            if count == 0:
+                raise ConnectionError("Connection closed by the server before a complete message was received")
+            self._buffer += self._view[:count]
+            line = self._take_line()
+        return line
@@ -0,0 +1,402 @@
+from __future__ import annotations
+import math
+
+import numpy
+
+# Points closer together than this, in millimeters, are treated as the same point by the Boolean operations
+BOOLEAN_EPSILON = 1e-6
+
+# Upper bound on the number of edge pairs held in memory at once when intersecting edges
+_PAIR_CHUNK = 1 << 20
+
+# Classification of a piece of one region's boundary against the other region
+_OUTSIDE = 0
+_INSIDE = 1
+_SAME = 2
+_OPPOSITE = 3
+
+
+def region_area(rings: list[numpy.ndarray]) -> float:
+    """ Total signed area of a region given as oriented rings, counter-clockwise outer boundaries counting as positive
+    and clockwise holes as negative """
+    return sum(_ring_area(r) for r in rings)
+
+
+def region_bounds(rings: list[numpy.ndarray]) -> tuple[float, float, float, float]:
+    points = numpy.concatenate(rings)
+    x0, y0 = points.min(axis=0).tolist()
+    x1, y1 = points.max(axis=0).tolist()
+    return x0, y0, x1, y1
+
+
+def bounds_overlap(a: tuple, b: tuple, eps: float = BOOLEAN_EPSILON) -> bool:
+    """ Whether two (min x, min y, max x, max y) boxes share more than a boundary """
+    return a[0] < b[2] - eps and b[0] < a[2] - eps and a[1] < b[3] - eps and b[1] < a[3] - eps
+
+
+def region_union(a: list[numpy.ndarray], b: list[numpy.ndarray],
+                 eps: float = BOOLEAN_EPSILON) -> list[numpy.ndarray]:
+    return _boolean(a, b, "union", eps)
+
+
+def region_intersection(a: list[numpy.ndarray], b: list[numpy.ndarray],
+                        eps: float = BOOLEAN_EPSILON) -> list[numpy.ndarray]:
+    return _boolean(a, b, "intersection", eps)
+
+
+def region_difference(a: list[numpy.ndarray], b: list[numpy.ndarray],
+                      eps: float = BOOLEAN_EPSILON) -> list[numpy.ndarray]:
+    return _boolean(a, b, "difference", eps)
+
+
+def oriented(ring: numpy.ndarray, positive: bool = True) -> numpy.ndarray:
+    """ The ring, reversed if needed so that it runs counter-clockwise (positive) or clockwise """
+    if (_ring_area(ring) > 0) != positive:
+        return ring[::-1].copy()
+    return ring
+
+
+# ==========================================================================================
+# Boolean operations by edge classification
+# ==========================================================================================
+def _boolean(a: list[numpy.ndarray], b: list[numpy.ndarray], op: str, eps: float) -> list[numpy.ndarray]:
+    """ Boolean operation between two regions made of oriented polygon rings (outer boundaries counter-clockwise,
+    holes clockwise). The edges of both regions are split wherever they cross or touch the other region's edges, each
+    piece is classified as inside, outside, or on the boundary of the other region, and the pieces which bound the
+    result are chained back together into rings. """
+    a = [r for r in a if len(r) >= 3]
+    b = [r for r in b if len(r) >= 3]
+    if not a or not b:
+        if op == "union":
+            return [r.copy() for r in a + b]
+        return [r.copy() for r in a] if op == "difference" else []
+
+    if not bounds_overlap(region_bounds(a), region_bounds(b), -eps):
+        if op == "union":
+            return [r.copy() for r in a + b]
+        return [r.copy() for r in a] if op == "difference" else []
+
+    # Rings of the first region whose bounds miss the second region entirely can neither cross it, contain any of it,
+    # or be contained by it, so they pass through a union or difference unchanged and are left out of the work. This
+    # keeps repeated operations on a region with many holes from slowing down as the holes accumulate.
+    if op != "intersection" and len(a) > 1:
+        near = _rings_near(a, region_bounds(b), eps)
+        passed = [r for r, n in zip(a, near) if not n]
+        if passed:
+            a = [r for r, n in zip(a, near) if n]
+            if not a:
+                return passed + ([r.copy() for r in b] if op == "union" else [])
+            return passed + _boolean(a, b, op, eps)
+
+    edges_a = _edges(a)
+    edges_b = _edges(b)
+    pieces_a, pieces_b = _split(edges_a, edges_b, eps)
+    class_a = _classify(pieces_a, edges_b, b, eps)
+    class_b = _classify(pieces_b, edges_a, a, eps)
+
+    if op == "union":
+        keep = [pieces_a[class_a == _OUTSIDE], pieces_a[class_a == _SAME], pieces_b[class_b == _OUTSIDE]]
+    elif op == "intersection":
+        keep = [pieces_a[class_a == _INSIDE], pieces_a[class_a == _SAME], pieces_b[class_b == _INSIDE]]
+    else:
+        inside_b = pieces_b[class_b == _INSIDE]
+        keep = [pieces_a[class_a == _OUTSIDE], pieces_a[class_a == _OPPOSITE], inside_b[:, [2, 3, 0, 1]]]
+
+    return _chain(numpy.concatenate(keep), eps)
+
+
+def _rings_near(rings: list[numpy.ndarray], bounds: tuple, eps: float) -> list[bool]:
+    """ For each ring, whether its bounds touch the given bounds """
+    points = numpy.concatenate(rings)
+    offsets = numpy.cumsum([0] + [len(r) for r in rings[:-1]])
+    low = numpy.minimum.reduceat(points, offsets, axis=0)
+    high = numpy.maximum.reduceat(points, offsets, axis=0)
+    near = ((low[:, 0] <= bounds[2] + eps) & (high[:, 0] >= bounds[0] - eps) & (low[:, 1] <= bounds[3] + eps) &
+            (high[:, 1] >= bounds[1] - eps))
+    return near.tolist()
+
+
+def _ring_area(ring: numpy.ndarray) -> float:
+    x = ring[:, 0]
+    y = ring[:, 1]
+    return 0.5 * (float(numpy.dot(x[:-1], y[1:]) - numpy.dot(y[:-1], x[1:])) + float(x[-1] * y[0] - y[-1] * x[0]))
+
+
+def _edges(rings: list[numpy.ndarray]) -> numpy.ndarray:
+    """ Every edge of every ring as rows of (x0, y0, x1, y1) """
+    return numpy.concatenate([numpy.column_stack((r, numpy.roll(r, -1, axis=0))) for r in rings])
+
+
+def _edge_bounds(edges: numpy.ndarray) -> tuple[float, float, float, float]:
+    x0 = min(float(edges[:, 0].min()), float(edges[:, 2].min()))
+    y0 = min(float(edges[:, 1].min()), float(edges[:, 3].min()))
+    x1 = max(float(edges[:, 0].max()), float(edges[:, 2].max()))
+    y1 = max(float(edges[:, 1].max()), float(edges[:, 3].max()))
+    return x0, y0, x1, y1
+
+
+def _edges_near(edges: numpy.ndarray, bounds: tuple, eps: float) -> numpy.ndarray:
+    """ Indices of the edges whose bounds come within eps of the given bounds """
+    x0, y0, x1, y1 = bounds
+    near = ((numpy.minimum(edges[:, 0], edges[:, 2]) <= x1 + eps) &
+            (numpy.maximum(edges[:, 0], edges[:, 2]) >= x0 - eps) &
+            (numpy.minimum(edges[:, 1], edges[:, 3]) <= y1 + eps) &
+            (numpy.maximum(edges[:, 1], edges[:, 3]) >= y0 - eps))
+    return numpy.flatnonzero(near)
+
+
+def _split(edges_a: numpy.ndarray, edges_b: numpy.ndarray, eps: float) -> tuple[numpy.ndarray, numpy.ndarray]:
+    """ Split the edges of each set at every point where they cross an edge of the other set, or where a vertex of the
+    other set lies on them. Only the edges which reach into the other set's bounds can be split, so the pairwise work
+    is limited to those. """
+    near_a = _edges_near(edges_a, _edge_bounds(edges_b), eps)
+    near_b = _edges_near(edges_b, _edge_bounds(edges_a), eps)
+    if not len(near_a) or not len(near_b):
+        return edges_a, edges_b
+    cuts_a, cuts_b = _find_cuts(edges_a[near_a], edges_b[near_b], eps)
+    cuts_a[:, 0] = near_a[cuts_a[:, 0].astype(numpy.int64)]
+    cuts_b[:, 0] = near_b[cuts_b[:, 0].astype(numpy.int64)]
+    return _apply_cuts(edges_a, cuts_a, eps), _apply_cuts(edges_b, cuts_b, eps)
+
+
+def _find_cuts(edges_a: numpy.ndarray, edges_b: numpy.ndarray, eps: float) -> tuple[numpy.ndarray, numpy.ndarray]:
+    """ (edge index, parameter) rows for the positions at which each set's edges must be split """
+    cuts_a = [numpy.zeros((0, 2))]
+    cuts_b = [numpy.zeros((0, 2))]
+
+    per = max(1, _PAIR_CHUNK // max(len(edges_b), 1))
+    p2 = edges_b[:, 0:2]
+    d2 = edges_b[:, 2:4] - p2
+    len2 = numpy.hypot(d2[:, 0], d2[:, 1])
+    for start in range(0, len(edges_a), per):
+        chunk = edges_a[start:start + per]
+        p1 = chunk[:, None, 0:2]
+        d1 = chunk[:, None, 2:4] - p1
+        len1 = numpy.hypot(d1[..., 0], d1[..., 1])
+
+        # Proper crossings
+        denom = d1[..., 0] * d2[None, :, 1] - d1[..., 1] * d2[None, :, 0]
+        r = p2[None, :, :] - p1
+        with numpy.errstate(divide="ignore", invalid="ignore"):
+            t = (r[..., 0] * d2[None, :, 1] - r[..., 1] * d2[None, :, 0]) / denom
+            u = (r[..., 0] * d1[..., 1] - r[..., 1] * d1[..., 0]) / denom
+        tol_t = eps / numpy.maximum(len1, eps)
+        tol_u = eps / numpy.maximum(len2, eps)[None, :]
+        crossing = ((numpy.abs(denom) > 1e-300) & (t > -tol_t) & (t < 1 + tol_t) & (u > -tol_u) & (u < 1 + tol_u))
+        i, j = numpy.nonzero(crossing)
+        cuts_a.append(numpy.column_stack((i + start, t[i, j])))
+        cuts_b.append(numpy.column_stack((j, u[i, j])))
+
+        # Vertices of one set lying on the edges of the other, which covers overlapping collinear edges
+        cuts_a.append(_vertices_on(p1[:, 0, :], d1[:, 0, :], len1[:, 0], p2, eps, start))
+        vb = _vertices_on(p2, d2, len2, chunk[:, 0:2], eps, 0)
+        cuts_b.append(vb)
+
+    return numpy.concatenate(cuts_a), numpy.concatenate(cuts_b)
+
+
+def _vertices_on(p: numpy.ndarray, d: numpy.ndarray, length: numpy.ndarray, vertices: numpy.ndarray, eps: float,
+                 offset: int) -> numpy.ndarray:
+    """ (edge index, parameter) rows for every vertex lying within eps of the interior of an edge """
+    rel = vertices[None, :, :] - p[:, None, :]
+    with numpy.errstate(divide="ignore", invalid="ignore"):
+        t = (rel[..., 0] * d[:, None, 0] + rel[..., 1] * d[:, None, 1]) / (length[:, None] ** 2)
+    dist = numpy.abs(rel[..., 0] * d[:, None, 1] - rel[..., 1] * d[:, None, 0]) / numpy.maximum(length, eps)[:, None]
+    on = (dist <= eps) & (t > 0) & (t < 1)
+    i, j = numpy.nonzero(on)
+    return numpy.column_stack((i + offset, t[i, j]))
+
+
+def _apply_cuts(edges: numpy.ndarray, cuts: numpy.ndarray, eps: float) -> numpy.ndarray:
+    """ Split edges at (edge index, parameter) positions, dropping pieces shorter than eps """
+    count = len(edges)
+    index = numpy.concatenate((numpy.arange(count), numpy.arange(count), cuts[:, 0].astype(numpy.int64)))
+    params = numpy.concatenate((numpy.zeros(count), numpy.ones(count), numpy.clip(cuts[:, 1], 0.0, 1.0)))
+    order = numpy.lexsort((params, index))
+    index = index[order]
+    params = params[order]
+
+    same = index[1:] == index[:-1]
+    e = edges[index[:-1][same]]
+    t0 = params[:-1][same, None]
+    t1 = params[1:][same, None]
+    d = e[:, 2:4] - e[:, 0:2]
+    pieces = numpy.column_stack((e[:, 0:2] + t0 * d, e[:, 0:2] + t1 * d))
+
+    # Keep the original vertices exactly at the ends of each edge
+    first = t0[:, 0] == 0.0
+    last = t1[:, 0] == 1.0
+    pieces[first, 0:2] = e[first, 0:2]
+    pieces[last, 2:4] = e[last, 2:4]
+
+    keep = numpy.hypot(pieces[:, 2] - pieces[:, 0], pieces[:, 3] - pieces[:, 1]) > eps
+    return pieces[keep]
+
+
+def _classify(pieces: numpy.ndarray, other_edges: numpy.ndarray, other_rings: list[numpy.ndarray],
+              eps: float) -> numpy.ndarray:
+    """ Classify each piece of boundary by its midpoint against the other region: on its boundary running the same or
+    the opposite way, or else inside or outside of it. Pieces whose midpoints lie outside the other region's bounds
+    are outside of it without further checks. """
+    result = numpy.full(len(pieces), _OUTSIDE)
+    if not len(pieces):
+        return result
+
+    x0, y0, x1, y1 = _edge_bounds(other_edges)
+    mid = 0.5 * (pieces[:, 0:2] + pieces[:, 2:4])
+    candidates = numpy.flatnonzero((mid[:, 0] >= x0 - eps) & (mid[:, 0] <= x1 + eps) & (mid[:, 1] >= y0 - eps) &
+                                   (mid[:, 1] <= y1 + eps))
+    if not len(candidates):
+        return result
+    pieces = pieces[candidates]
+    mid = mid[candidates]
+    direction = pieces[:, 2:4] - pieces[:, 0:2]
+
+    # Only edges reaching within eps of a midpoint can be the boundary the midpoint lies on
+    other_edges = other_edges[_edges_near(other_edges, (float(mid[:, 0].min()), float(mid[:, 1].min()),
+                                                        float(mid[:, 0].max()), float(mid[:, 1].max())), eps)]
+    p = other_edges[:, 0:2]
+    d = other_edges[:, 2:4] - p
+    length_sq = numpy.maximum(numpy.sum(d * d, axis=1), eps * eps)
+    nearest_dist = numpy.full(len(pieces), numpy.inf)
+    nearest_edge = numpy.zeros(len(pieces), dtype=numpy.int64)
+    per = max(1, _PAIR_CHUNK // max(len(other_edges), 1))
+    for start in range(0, len(pieces) if len(other_edges) else 0, per):
+        m = mid[start:start + per, None, :]
+        t = numpy.clip(numpy.sum((m - p[None]) * d[None], axis=2) / length_sq[None], 0.0, 1.0)
+        closest = p[None] + t[..., None] * d[None]
+        dist = numpy.hypot(*(m - closest).transpose(2, 0, 1))
+        k = numpy.argmin(dist, axis=1)
+        nearest_edge[start:start + per] = k
+        nearest_dist[start:start + per] = dist[numpy.arange(len(k)), k]
+
+    on_boundary = nearest_dist <= eps
+    if on_boundary.any():
+        along = numpy.sum(direction * d[nearest_edge], axis=1)
+        result[candidates[on_boundary & (along > 0)]] = _SAME
+        result[candidates[on_boundary & (along <= 0)]] = _OPPOSITE
+
+    rest = numpy.flatnonzero(~on_boundary)
+    if len(rest):
+        inside = numpy.zeros(len(rest), dtype=bool)
+        for ring in other_rings:
+            inside ^= _points_in_polygon(mid[rest], ring)
+        result[candidates[rest[inside]]] = _INSIDE
+    return result
+
+
+def _chain(pieces: numpy.ndarray, eps: float) -> list[numpy.ndarray]:
+    """ Join directed edges end to start into closed rings. Where several edges leave the same point, the one turning
+    furthest to the left is taken, which separates regions which only touch at a point into separate rings. """
+    if not len(pieces):
+        return []
+
+    vertex_ids = _snap(numpy.concatenate((pieces[:, 0:2], pieces[:, 2:4])), eps)
+    count = len(pieces)
+    starts = vertex_ids[:count].tolist()
+    ends = vertex_ids[count:].tolist()
+    direction = (pieces[:, 2:4] - pieces[:, 0:2]).tolist()
+
+    outgoing: dict[int, list[int]] = {}
+    for e, v in enumerate(starts):
+        outgoing.setdefault(v, []).append(e)
+
+    used = [False] * count
+    rings = []
+    for first in range(count):
+        if used[first]:
+            continue
+        ring = [first]
+        used[first] = True
+        current = first
+        closed = False
+        while True:
+            v = ends[current]
+            if v == starts[first]:
+                closed = True
+                break
+            options = [e for e in outgoing.get(v, ()) if not used[e]]
+            if not options:
+                break
+            if len(options) > 1:
+                dx, dy = direction[current]
+                options.sort(key=lambda e: -math.atan2(dx * direction[e][1] - dy * direction[e][0],
+                                                       dx * direction[e][0] + dy * direction[e][1]))
+            current = options[0]
+            used[current] = True
+            ring.append(current)
+
+        if not closed:
+            continue
+        points = _simplify(pieces[ring, 0:2], eps)
+        if len(points) >= 3 and abs(_ring_area(points)) > eps * eps:
+            rings.append(points)
+    return rings
+
+
+def _snap(points: numpy.ndarray, eps: float) -> numpy.ndarray:
+    """ Give every point an id, with points within about eps of one another sharing the same id """
+    ids = numpy.empty(len(points), dtype=numpy.int64)
+    grid: dict[tuple[int, int], int] = {}
+    keys = numpy.floor(points / eps).astype(numpy.int64).tolist()
+    next_id = 0
+    for n, (i, j) in enumerate(keys):
+        found = grid.get((i, j))
+        if found is None:
+            for di in (-1, 0, 1):
+                for dj in (-1, 0, 1):
+                    found = grid.get((i + di, j + dj))
+                    if found is not None:
+                        break
+                if found is not None:
+                    break
+        if found is None:
+            found = next_id
+            next_id += 1
+            grid[(i, j)] = found
+        ids[n] = found
+    return ids
+
+
+def _simplify(points: numpy.ndarray, eps: float) -> numpy.ndarray:
+    """ Remove vertices which lie on the straight line between their neighbors, left behind where edges were split """
+    while len(points) > 3:
+        prev = numpy.roll(points, 1, axis=0)
+        nxt = numpy.roll(points, -1, axis=0)
+        a = points - prev
+        b = nxt - points
+        cross = a[:, 0] * b[:, 1] - a[:, 1] * b[:, 0]
+        span = numpy.maximum(numpy.hypot(*(nxt - prev).T), eps)
+        straight = (numpy.abs(cross) / span <= eps) & (numpy.sum(a * b, axis=1) > 0)
+        if not straight.any():
+            break
+        # Remove every other flagged vertex so that runs of straight vertices are re-checked against their new
+        # neighbors
+        flagged = numpy.flatnonzero(straight)
+        drop = numpy.zeros(len(points), dtype=bool)
+        drop[flagged[::2]] = True
+        if drop[0] and drop[-1]:
+            drop[-1] = False
+        points = points[~drop]
+    return points
+
+
+def _points_in_polygon(points: numpy.ndarray, polygon: numpy.ndarray, chunk: int = 1 << 20) -> numpy.ndarray:
+    """ Even-odd test of each point against a closed polygon, counting the edges crossed by a ray in the +x
+    direction. The work is split so that no more than about `chunk` point-edge pairs are held at once. """
+    result = numpy.zeros(len(points), dtype=bool)
+    if len(polygon) < 3 or not len(points):
+        return result
+
+    x0, y0 = polygon[:, 0], polygon[:, 1]
+    x1, y1 = numpy.roll(x0, -1), numpy.roll(y0, -1)
+    per = max(1, chunk // len(polygon))
+    for start in range(0, len(points), per):
+        px = points[start:start + per, 0:1]
+        py = points[start:start + per, 1:2]
+        straddles = (y0 > py) != (y1 > py)
+        with numpy.errstate(divide="ignore", invalid="ignore"):
+            cross_x = x0 + (py - y0) * (x1 - x0) / (y1 - y0)
+        crossings = straddles & (px < cross_x)
+        result[start:start + per] = numpy.count_nonzero(crossings, axis=1) % 2 == 1
+    return result
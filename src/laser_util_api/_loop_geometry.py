@@ -0,0 +1,363 @@
+from __future__ import annotations
+import math
+from typing import Optional
+
+import numpy
+
+from ._loop_boolean import (BOOLEAN_EPSILON, oriented, region_area, region_difference, region_intersection,
+                            region_union, bounds_overlap, _points_in_polygon)
+from .vector import Aabb, Vector
+
+# Path kinds, matching the values of `PathKind` in the loop workspace
+_SEGMENT = 0
+_ARC_CW = 1
+_ARC_CCW = 2
+
+# Angles of the points where a circle reaches its extreme x and y values
+_EXTREME_ANGLES = numpy.array([0.0, 0.5 * math.pi, math.pi, 1.5 * math.pi])
+
+# Default maximum distance between an arc and the straight segments which approximate it, in millimeters
+DEFAULT_FLATTEN_TOLERANCE = 1e-3
+
+
+class LoopGeometry:
+    """ Local copy of the elements of a scratch loop, in millimeters, from which its bounds, area, perimeter, and
+    orientation can be computed and points tested against it without asking the server.
+
+    The loop is held the same way the server describes it: an Nx5 array of (x, y, cx, cy, kind) rows where each
+    element starts at (x, y) and runs to the start of the next, the last element closing back to the first. Arcs run
+    around their center (cx, cy) in the direction given by their kind. New elements are inserted after the element at
+    the cursor, and the cursor moves to the inserted element.
+
+    Loops created by the server's shape primitives have their shape reproduced exactly, but the order in which the
+    server lays out their elements isn't known, so their `ordered` flag is false and cursor-based edits can't be
+    mirrored onto them.
+
+    The bounds and flattened outline are cached until the next edit, so `path` should only be changed through the
+    editing methods. """
+
+    def __init__(self, path: Optional[numpy.ndarray] = None, cursor: Optional[int] = None, ordered: bool = True):
+        self.path = numpy.zeros((0, 5)) if path is None else numpy.array(path, dtype=float).reshape(-1, 5)
+        self.cursor = len(self.path) - 1 if cursor is None else cursor
+        self.ordered = ordered
+        self._cache: dict = {}
+
+    def __len__(self):
+        return len(self.path)
+
+    def copy(self) -> LoopGeometry:
+        return LoopGeometry(self.path.copy(), self.cursor, self.ordered)
+
+    # Shape primitives
+    # ==========================================================================================
+    @staticmethod
+    def circle(cx: float, cy: float, r: float) -> LoopGeometry:
+        return LoopGeometry([[cx + r, cy, cx, cy, _ARC_CCW]], ordered=False)
+
+    @staticmethod
+    def rectangle(x: float, y: float, w: float, h: float) -> LoopGeometry:
+        return LoopGeometry([[x, y, 0, 0, _SEGMENT],
+                             [x + w, y, 0, 0, _SEGMENT],
+                             [x + w, y + h, 0, 0, _SEGMENT],
+                             [x, y + h, 0, 0, _SEGMENT]], ordered=False)
+
+    @staticmethod
+    def rounded_rectangle(x: float, y: float, w: float, h: float, r: float) -> LoopGeometry:
+        return LoopGeometry([[x + r, y, 0, 0, _SEGMENT],
+                             [x + w - r, y, x + w - r, y + r, _ARC_CCW],
+                             [x + w, y + r, 0, 0, _SEGMENT],
+                             [x + w, y + h - r, x + w - r, y + h - r, _ARC_CCW],
+                             [x + w - r, y + h, 0, 0, _SEGMENT],
+                             [x + r, y + h, x + r, y + h - r, _ARC_CCW],
+                             [x, y + h - r, 0, 0, _SEGMENT],
+                             [x, y + r, x + r, y + r, _ARC_CCW]], ordered=False)
+
+    @staticmethod
+    def from_polygon(points: numpy.ndarray) -> LoopGeometry:
+        """ A loop of straight segments through an Nx2 array of vertices in millimeters """
+        points = numpy.asarray(points, dtype=float).reshape(-1, 2)
+        return LoopGeometry(numpy.column_stack((points, numpy.zeros((len(points), 3)))))
+
+    # Edits, mirroring the scratch loop methods
+    # ==========================================================================================
+    def move_cursor_to(self, i: int):
+        self.cursor = i
+
+    def insert(self, x: float, y: float, cx: float = 0.0, cy: float = 0.0, kind: int = _SEGMENT):
+        self.insert_path(numpy.array([[x, y, cx, cy, kind]], dtype=float))
+
+    def insert_relative(self, dx: float, dy: float, dcx: float = 0.0, dcy: float = 0.0, kind: int = _SEGMENT):
+        """ Insert an element whose start point, and center for arcs, are given relative to the start of the element at
+        the cursor, or to the origin in an empty loop """
+        if len(self.path):
+            x0, y0 = self.path[self.cursor % len(self.path), :2].tolist()
+        else:
+            x0, y0 = 0.0, 0.0
+        self.insert(x0 + dx, y0 + dy, x0 + dcx, y0 + dcy, kind)
+
+    def insert_path(self, rows: numpy.ndarray):
+        """ Insert an Nx5 array of elements after the cursor """
+        at = self.cursor % len(self.path) + 1 if len(self.path) else 0
+        self.path = numpy.concatenate((self.path[:at], rows, self.path[at:]))
+        self.cursor = at + len(rows) - 1
+        self._cache.clear()
+
+    def reverse(self):
+        """ Run the loop in the opposite direction. Each element now starts where it used to end and its arc direction
+        is flipped, which reverses the order of the elements. """
+        if not len(self.path):
+            return
+        ends = numpy.roll(self.path[:, :2], -1, axis=0)
+        reversed_path = numpy.column_stack((ends, self.path[:, 2:4], _flip_kinds(self.path[:, 4])))[::-1]
+        self.path = numpy.ascontiguousarray(reversed_path)
+        self.cursor = len(self.path) - 1 - self.cursor % len(self.path)
+        self._cache.clear()
+
+    def mirror_x(self, x0: float):
+        """ Mirror the loop across the vertical line at x0, which also reverses its orientation """
+        self.path[:, [0, 2]] = 2 * x0 - self.path[:, [0, 2]]
+        self.path[:, 4] = _flip_kinds(self.path[:, 4])
+        self._cache.clear()
+
+    def mirror_y(self, y0: float):
+        """ Mirror the loop across the horizontal line at y0, which also reverses its orientation """
+        self.path[:, [1, 3]] = 2 * y0 - self.path[:, [1, 3]]
+        self.path[:, 4] = _flip_kinds(self.path[:, 4])
+        self._cache.clear()
+
+    def transform(self, x: float, y: float, r: float):
+        """ Rotate the loop by r radians about the origin, then move it by (x, y) """
+        c = math.cos(r)
+        s = math.sin(r)
+        for i, j in ((0, 1), (2, 3)):
+            px = self.path[:, i].copy()
+            py = self.path[:, j]
+            self.path[:, i] = c * px - s * py + x
+            self.path[:, j] = s * px + c * py + y
+        self._cache.clear()
+
+    # Measurements
+    # ==========================================================================================
+    @property
+    def signed_area(self) -> float:
+        """ The enclosed area, positive when the loop runs counter-clockwise and negative when it runs clockwise """
+        if not len(self.path):
+            return 0.0
+        start, end = self._ends()
+        area = 0.5 * float(numpy.sum(start[:, 0] * end[:, 1] - start[:, 1] * end[:, 0]))
+
+        arcs = self.path[:, 4] != _SEGMENT
+        if arcs.any():
+            # Each arc adds the circular segment between its chord and itself
+            r, _, sweep = self._arc_params(arcs)
+            area += 0.5 * float(numpy.sum(r ** 2 * (sweep - numpy.sin(sweep))))
+        return area
+
+    @property
+    def perimeter(self) -> float:
+        if not len(self.path):
+            return 0.0
+        start, end = self._ends()
+        lengths = numpy.hypot(*(end - start).T)
+        arcs = self.path[:, 4] != _SEGMENT
+        if arcs.any():
+            r, _, sweep = self._arc_params(arcs)
+            lengths[arcs] = r * numpy.abs(sweep)
+        return float(lengths.sum())
+
+    @property
+    def is_positive(self) -> bool:
+        """ Whether the loop runs counter-clockwise, enclosing material rather than removing it """
+        return self.signed_area > 0
+
+    def bounds(self) -> tuple[float, float, float, float]:
+        """ The exact bounds of the loop as (min x, min y, max x, max y), including the parts of arcs which bulge past
+        their end points """
+        if not len(self.path):
+            raise ValueError("An empty loop has no bounds")
+        if "bounds" not in self._cache:
+            self._cache["bounds"] = self._compute_bounds()
+        return self._cache["bounds"]
+
+    def flatten(self, tolerance: float = DEFAULT_FLATTEN_TOLERANCE) -> numpy.ndarray:
+        """ The loop as an Nx2 array of polygon vertices, with arcs replaced by runs of straight segments which stay
+        within `tolerance` of them. The returned array is shared with the cache and must not be modified. """
+        key = ("flatten", tolerance)
+        if key not in self._cache:
+            self._cache[key] = self._compute_flatten(tolerance)
+        return self._cache[key]
+
+    def contains(self, points: numpy.ndarray, tolerance: float = DEFAULT_FLATTEN_TOLERANCE) -> numpy.ndarray:
+        """ Test whether each of an Nx2 array of points lies inside the area enclosed by the loop, regardless of its
+        orientation. Arcs are flattened to within `tolerance`, so points closer than that to the boundary may be
+        classified either way. """
+        points = numpy.asarray(points, dtype=float).reshape(-1, 2)
+        polygon = self.flatten(tolerance)
+        return _points_in_polygon(points, polygon)
+
+    # Boolean operations
+    # ==========================================================================================
+    def region(self, tolerance: float = DEFAULT_FLATTEN_TOLERANCE) -> list[numpy.ndarray]:
+        """ The area enclosed by the loop as a region for the Boolean operations: a single counter-clockwise ring with
+        arcs flattened to within `tolerance` """
+        return [oriented(self.flatten(tolerance))]
+
+    def overlaps(self, other: LoopGeometry, tolerance: float = DEFAULT_FLATTEN_TOLERANCE) -> bool:
+        """ Whether the areas enclosed by the two loops overlap, rather than being apart or only touching """
+        if not len(self.path) or not len(other.path) or not bounds_overlap(self.bounds(), other.bounds()):
+            return False
+        return region_area(region_intersection(self.region(tolerance), other.region(tolerance))) > BOOLEAN_EPSILON
+
+    def union(self, other: LoopGeometry, tolerance: float = DEFAULT_FLATTEN_TOLERANCE) -> list[LoopGeometry]:
+        """ The loops bounding the combined area of both loops, with arcs flattened to within `tolerance`. Outer
+        boundaries run counter-clockwise and any holes clockwise. """
+        return _loops(region_union(self.region(tolerance), other.region(tolerance)))
+
+    def intersection(self, other: LoopGeometry, tolerance: float = DEFAULT_FLATTEN_TOLERANCE) -> list[LoopGeometry]:
+        """ The loops bounding the area shared by both loops, which is empty if they don't overlap """
+        if not len(self.path) or not len(other.path) or not bounds_overlap(self.bounds(), other.bounds()):
+            return []
+        return _loops(region_intersection(self.region(tolerance), other.region(tolerance)))
+
+    def difference(self, other: LoopGeometry, tolerance: float = DEFAULT_FLATTEN_TOLERANCE) -> list[LoopGeometry]:
+        """ The loops bounding the area of this loop which is not inside the other """
+        return _loops(region_difference(self.region(tolerance), other.region(tolerance)))
+
+    # Internal
+    # ==========================================================================================
+    def _compute_bounds(self) -> tuple[float, float, float, float]:
+        points = [self.path[:, :2]]
+        arcs = self.path[:, 4] != _SEGMENT
+        if arcs.any():
+            r, a0, sweep = self._arc_params(arcs)
+            centers = self.path[arcs, 2:4]
+
+            # An axis extreme of an arc's circle is part of the arc when it lies within the arc's sweep from its start
+            offset = numpy.where(sweep[:, None] >= 0,
+                                 numpy.mod(_EXTREME_ANGLES[None, :] - a0[:, None], 2 * math.pi),
+                                 numpy.mod(a0[:, None] - _EXTREME_ANGLES[None, :], 2 * math.pi))
+            inside = offset <= numpy.abs(sweep)[:, None]
+            rows, cols = numpy.nonzero(inside)
+            angles = _EXTREME_ANGLES[cols]
+            points.append(centers[rows] + r[rows, None] * numpy.column_stack((numpy.cos(angles), numpy.sin(angles))))
+
+        points = numpy.concatenate(points)
+        x0, y0 = points.min(axis=0).tolist()
+        x1, y1 = points.max(axis=0).tolist()
+        return x0, y0, x1, y1
+
+    def _compute_flatten(self, tolerance: float) -> numpy.ndarray:
+        if not len(self.path):
+            return numpy.zeros((0, 2))
+
+        arcs = self.path[:, 4] != _SEGMENT
+        if not arcs.any():
+            return self.path[:, :2].copy()
+
+        r, a0, sweep = self._arc_params(arcs)
+        # The largest step angle for which the sagitta of a chord stays within the tolerance
+        ratio = numpy.clip(1.0 - tolerance / numpy.maximum(r, tolerance), -1.0, 1.0)
+        steps = numpy.maximum(numpy.ceil(numpy.abs(sweep) / numpy.maximum(2 * numpy.arccos(ratio), 1e-9)), 1)
+        arc_index = numpy.full(len(self.path), -1)
+        arc_index[arcs] = numpy.arange(arcs.sum())
+
+        pieces = []
+        for i, row in enumerate(self.path.tolist()):
+            k = arc_index[i]
+            if k < 0:
+                pieces.append(numpy.array([row[:2]]))
+                continue
+            angles = a0[k] + sweep[k] * numpy.arange(int(steps[k])) / steps[k]
+            pieces.append(numpy.column_stack((row[2] + r[k] * numpy.cos(angles), row[3] + r[k] * numpy.sin(angles))))
+            pieces[-1][0] = row[:2]
+        return numpy.concatenate(pieces)
+
+    def _ends(self) -> tuple[numpy.ndarray, numpy.ndarray]:
+        start = self.path[:, :2]
+        return start, numpy.roll(start, -1, axis=0)
+
+    def _arc_params(self, arcs: numpy.ndarray) -> tuple[numpy.ndarray, numpy.ndarray, numpy.ndarray]:
+        """ The radius, start angle, and signed sweep (positive counter-clockwise) of the arcs selected by a mask """
+        start, end = self._ends()
+        centers = self.path[arcs, 2:4]
+        d0 = start[arcs] - centers
+        d1 = end[arcs] - centers
+        r = numpy.hypot(d0[:, 0], d0[:, 1])
+        a0 = numpy.arctan2(d0[:, 1], d0[:, 0])
+        a1 = numpy.arctan2(d1[:, 1], d1[:, 0])
+
+        ccw = numpy.mod(a1 - a0, 2 * math.pi)
+        cw = numpy.mod(a0 - a1, 2 * math.pi)
+        # An arc which ends where it starts is a full circle
+        closed = numpy.hypot(*(end[arcs] - start[arcs]).T) <= 1e-12 * numpy.maximum(r, 1.0)
+        ccw[closed] = 2 * math.pi
+        cw[closed] = 2 * math.pi
+
+        sweep = numpy.where(self.path[arcs, 4] == _ARC_CW, -cw, ccw)
+        return r, a0, sweep
+
+
+class LocalLoopQueries:
+    """ Measurements of a loop handle made from its local `LoopGeometry`, shared by the sync and async handles. Loops
+    only have local geometry when they were created by a scratch pad with `track_geometry` enabled and have only been
+    changed in ways which can be reproduced locally. Results are in the client's units. """
+    _geometry: Optional[LoopGeometry]
+
+    @property
+    def geometry(self) -> Optional[LoopGeometry]:
+        """ The local copy of the loop's elements in millimeters, or None if the loop isn't being tracked """
+        return self._geometry
+
+    @property
+    def is_tracked(self) -> bool:
+        return self._geometry is not None
+
+    @property
+    def area(self) -> float:
+        """ The signed area enclosed by the loop, positive for a positive (counter-clockwise) loop """
+        units = self._interface.get_units()
+        return units.from_mm(units.from_mm(self._local().signed_area))
+
+    @property
+    def perimeter(self) -> float:
+        return self._interface.convert_from_api(self._local().perimeter)
+
+    @property
+    def is_positive(self) -> bool:
+        return self._local().is_positive
+
+    def contains(self, point):
+        """ Test whether a `Vector` lies inside the loop, or test each point of an Nx2 array or `VectorArray` at once
+        and return an array of booleans """
+        geometry = self._local()
+        if isinstance(point, Vector):
+            p = self._interface.convert_to_api(point)
+            return bool(geometry.contains(numpy.array([[p.x, p.y]]))[0])
+        return geometry.contains(numpy.asarray(self._interface.convert_to_api(point), dtype=float))
+
+    def _local_bounds(self) -> Aabb:
+        x0, y0, x1, y1 = self._local().bounds()
+        return Aabb(self._interface.convert_from_api(Vector(x0, y0)), self._interface.convert_from_api(Vector(x1, y1)))
+
+    def _local(self) -> LoopGeometry:
+        if self._geometry is None:
+            raise Exception("The loop's geometry is not being tracked locally; create it from a scratch pad with "
+                            "track_geometry enabled")
+        return self._geometry
+
+    def _edit_at_cursor(self) -> Optional[LoopGeometry]:
+        """ The geometry to apply a cursor-based edit to, dropping it if the server's element order isn't known """
+        if self._geometry is not None and not self._geometry.ordered:
+            self._geometry = None
+        return self._geometry
+
+
+def _loops(rings: list[numpy.ndarray]) -> list[LoopGeometry]:
+    return [LoopGeometry.from_polygon(r) for r in rings]
+
+
+def _flip_kinds(kinds: numpy.ndarray) -> numpy.ndarray:
+    flipped = kinds.copy()
+    flipped[kinds == _ARC_CW] = _ARC_CCW
+    flipped[kinds == _ARC_CCW] = _ARC_CW
+    return flipped
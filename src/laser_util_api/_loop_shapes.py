@@ -0,0 +1,235 @@
+from __future__ import annotations
+import math
+from collections import OrderedDict
+from typing import Callable, Hashable, Sequence
+
+import numpy
+
+# Path kinds, matching the values of `PathKind` in the loop workspace
+_SEGMENT = 0
+_ARC_CW = 1
+_ARC_CCW = 2
+
+
+class ShapeCache:
+    """ Least recently used cache of generated shape paths, keyed by the shape's name and parameters, so that a shape
+    which is created over and over again is only computed once. The cached paths are read-only arrays. """
+
+    def __init__(self, maxsize: int = 256):
+        if maxsize < 1:
+            raise ValueError("maxsize must be at least 1")
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._paths: OrderedDict[Hashable, numpy.ndarray] = OrderedDict()
+
+    def __len__(self):
+        return len(self._paths)
+
+    def get(self, key: Hashable, build: Callable[[], numpy.ndarray]) -> numpy.ndarray:
+        """ The path stored under the key, calling `build` to make and store it if it isn't there """
+        path = self._paths.get(key)
+        if path is not None:
+            self._paths.move_to_end(key)
+            self.hits += 1
+            return path
+
+        self.misses += 1
+        path = numpy.array(build(), dtype=float)
+        path.setflags(write=False)
+        self._paths[key] = path
+        if len(self._paths) > self.maxsize:
+            self._paths.popitem(last=False)
+        return path
+
+    def clear(self):
+        self._paths.clear()
+        self.hits = 0
+        self.misses = 0
+
+
+# ==========================================================================================
+# Shape generators
+# ==========================================================================================
+# Each generator returns an Nx5 array of (x, y, cx, cy, kind) rows in the same units as its parameters, running
+# counter-clockwise so that the loop is positive. The result can be passed to `LoopScratchPad.from_polyline`,
+# `LoopHandle.insert_path`, or `LoopGeometry`.
+
+def polygon_path(cx: float, cy: float, radius: float, sides: int, rotation: float = 0.0) -> numpy.ndarray:
+    """ A regular polygon with its vertices on a circle of the given radius, the first vertex at `rotation` radians
+    from the +x axis """
+    if sides < 3:
+        raise ValueError("A polygon must have at least 3 sides")
+    angles = rotation + 2 * math.pi * numpy.arange(sides) / sides
+    return _segments(numpy.column_stack((cx + radius * numpy.cos(angles), cy + radius * numpy.sin(angles))))
+
+
+def star_path(cx: float, cy: float, outer_radius: float, inner_radius: float, points: int,
+              rotation: float = 0.0) -> numpy.ndarray:
+    """ A star with its tips on the outer radius and the notches between them on the inner radius, the first tip at
+    `rotation` radians from the +x axis """
+    if points < 2:
+        raise ValueError("A star must have at least 2 points")
+    angles = rotation + math.pi * numpy.arange(2 * points) / points
+    radii = numpy.tile([outer_radius, inner_radius], points)
+    return _segments(numpy.column_stack((cx + radii * numpy.cos(angles), cy + radii * numpy.sin(angles))))
+
+
+def slot_path(x0: float, y0: float, x1: float, y1: float, width: float) -> numpy.ndarray:
+    """ A slot with rounded ends whose end centers are (x0, y0) and (x1, y1) """
+    length = math.hypot(x1 - x0, y1 - y0)
+    if length <= 0:
+        raise ValueError("The ends of a slot must be apart; use a circle instead")
+    h = 0.5 * width
+    # Normal to the left of the direction from the first end to the second
+    nx = -(y1 - y0) / length * h
+    ny = (x1 - x0) / length * h
+    return numpy.array([[x0 - nx, y0 - ny, 0, 0, _SEGMENT],
+                        [x1 - nx, y1 - ny, x1, y1, _ARC_CCW],
+                        [x1 + nx, y1 + ny, 0, 0, _SEGMENT],
+                        [x0 + nx, y0 + ny, x0, y0, _ARC_CCW]])
+
+
+def keyhole_path(cx: float, cy: float, radius: float, slot_width: float, slot_length: float,
+                 angle: float = -0.5 * math.pi) -> numpy.ndarray:
+    """ A round head centered on (cx, cy) with a narrower slot with a rounded end leading out of it in the direction
+    `angle`, the slot's end center being `slot_length` from the head's center """
+    h = 0.5 * slot_width
+    if not 0 < h < radius:
+        raise ValueError("The slot must be narrower than the head")
+    a = math.sqrt(radius * radius - h * h)
+    if slot_length <= a:
+        raise ValueError("The slot must reach out past the head")
+
+    # Built along +x and then rotated into place
+    path = numpy.array([[a, -h, 0, 0, _SEGMENT],
+                        [slot_length, -h, slot_length, 0, _ARC_CCW],
+                        [slot_length, h, 0, 0, _SEGMENT],
+                        [a, h, 0, 0, _ARC_CCW]])
+    return _place(path, cx, cy, angle)
+
+
+def dogbone_rectangle_path(x: float, y: float, width: float, height: float, tool_radius: float) -> numpy.ndarray:
+    """ A rectangle from the corner (x, y) with a relief circle of `tool_radius` at each corner, centered on the
+    corner's diagonal so that its edge passes through the corner. Reversed and cut from a body, this makes a pocket
+    which a square-cornered part of the same size fits into. """
+    r = tool_radius
+    d = r * math.sqrt(2.0)
+    if not 0 < 2 * d <= min(width, height):
+        raise ValueError("The tool radius is too large for the rectangle")
+    c = r / math.sqrt(2.0)
+    x1 = x + width
+    y1 = y + height
+    return numpy.array([[x + d, y, 0, 0, _SEGMENT],
+                        [x1 - d, y, x1 - c, y + c, _ARC_CCW],
+                        [x1, y + d, 0, 0, _SEGMENT],
+                        [x1, y1 - d, x1 - c, y1 - c, _ARC_CCW],
+                        [x1 - d, y1, 0, 0, _SEGMENT],
+                        [x + d, y1, x + c, y1 - c, _ARC_CCW],
+                        [x, y1 - d, 0, 0, _SEGMENT],
+                        [x, y + d, x + c, y + c, _ARC_CCW]])
+
+
+def finger_joint_path(x: float, y: float, width: float, height: float, finger_width: float, depth: float,
+                      sides: Sequence[bool] = (True, True, True, True)) -> numpy.ndarray:
+    """ A rectangular panel from the corner (x, y) with finger joint edges. Each selected side (bottom, right, top,
+    left) is divided into an odd number of equal fingers about `finger_width` wide, and every second finger is cut
+    back into the panel by `depth`, so the corners are left solid and the panel's bounds are those of the rectangle.
+    """
+    if len(sides) != 4:
+        raise ValueError("sides must give a flag for each of the bottom, right, top, and left sides")
+    if finger_width <= 0 or depth <= 0:
+        raise ValueError("The finger width and depth must be positive")
+
+    corners = numpy.array([[x, y], [x + width, y], [x + width, y + height], [x, y + height]], dtype=float)
+    points = []
+    for i, fingered in enumerate(sides):
+        start = corners[i]
+        end = corners[(i + 1) % 4]
+        points.append(start[None, :])
+        length = float(numpy.hypot(*(end - start)))
+        count = max(1, int(round(length / finger_width)))
+        if count % 2 == 0:
+            count += 1
+        if not fingered or count < 3:
+            continue
+        if depth >= length / count:
+            raise ValueError("The finger depth must be less than the finger width")
+
+        along = (end - start) / length
+        inward = numpy.array([-along[1], along[0]])
+        # The notches are fingers 1, 3, 5, ... each stepping in at its start and back out at its end
+        t = length * numpy.arange(1, count - 1, 2)[:, None] / count
+        t1 = t + length / count
+        notch = numpy.stack((start + t * along, start + t * along + depth * inward,
+                             start + t1 * along + depth * inward, start + t1 * along), axis=1)
+        points.append(notch.reshape(-1, 2))
+    return _segments(numpy.concatenate(points))
+
+
+def offset_path(points, distance: float, join: str = "round") -> numpy.ndarray:
+    """ Offset a closed polygon, given as an Nx2 array of vertices, outwards by `distance`, or inwards if it's
+    negative. The result runs counter-clockwise whichever way the polygon did.
+
+    Where the offset edges pull apart at a corner they're joined by an arc around the original vertex (`join` of
+    "round") or extended until they meet ("miter"); where they overlap they're trimmed to where they cross. The
+    offset should be small compared to the polygon's features, since parts of the outline which would vanish or
+    cross over each other aren't removed.
+    """
+    if join not in ("round", "miter"):
+        raise ValueError("join must be 'round' or 'miter'")
+    points = numpy.asarray(points, dtype=float).reshape(-1, 2)
+    # Drop repeated vertices, including a closing vertex equal to the first
+    keep = numpy.hypot(*(numpy.roll(points, -1, axis=0) - points).T) > 1e-12
+    points = points[keep]
+    if len(points) < 3:
+        raise ValueError("A polygon must have at least 3 distinct vertices")
+
+    x, y = points[:, 0], points[:, 1]
+    if numpy.dot(x, numpy.roll(y, -1)) - numpy.dot(y, numpy.roll(x, -1)) < 0:
+        points = points[::-1]
+    if distance == 0:
+        return _segments(points)
+
+    # Unit outward normals of the edge leaving each vertex and of the edge arriving at it
+    edge = numpy.roll(points, -1, axis=0) - points
+    edge /= numpy.hypot(edge[:, 0], edge[:, 1])[:, None]
+    n_out = numpy.column_stack((edge[:, 1], -edge[:, 0]))
+    n_in = numpy.roll(n_out, 1, axis=0)
+    turn = numpy.roll(edge, 1, axis=0)[:, 0] * edge[:, 1] - numpy.roll(edge, 1, axis=0)[:, 1] * edge[:, 0]
+
+    # The two offset edges pull apart where the polygon turns towards the side being offset away from
+    gap = turn * distance > 1e-12
+    rounded = gap if join == "round" else numpy.zeros(len(points), dtype=bool)
+
+    denom = numpy.maximum(1.0 + numpy.sum(n_in * n_out, axis=1), 1e-12)
+    meet = points + distance * (n_in + n_out) / denom[:, None]
+
+    rows = []
+    for i in range(len(points)):
+        if rounded[i]:
+            px, py = points[i].tolist()
+            kind = _ARC_CCW if turn[i] > 0 else _ARC_CW
+            rows.append([px + distance * n_in[i, 0], py + distance * n_in[i, 1], px, py, kind])
+            rows.append([px + distance * n_out[i, 0], py + distance * n_out[i, 1], 0, 0, _SEGMENT])
+        else:
+            rows.append([meet[i, 0], meet[i, 1], 0, 0, _SEGMENT])
+    return numpy.array(rows, dtype=float)
+
+
+def _segments(points: numpy.ndarray) -> numpy.ndarray:
+    return numpy.column_stack((points, numpy.zeros((len(points), 3))))
+
+
+def _place(path: numpy.ndarray, x: float, y: float, r: float) -> numpy.ndarray:
+    """ Rotate a path by r radians about the origin, then move it by (x, y), leaving the centers of segments at zero """
+    c = math.cos(r)
+    s = math.sin(r)
+    placed = path.copy()
+    arcs = path[:, 4] != _SEGMENT
+    for i, j, moved in ((0, 1, numpy.ones(len(path), dtype=bool)), (2, 3, arcs)):
+        px = path[moved, i]
+        py = path[moved, j]
+        placed[moved, i] = c * px - s * py + x
+        placed[moved, j] = s * px + c * py + y
+    return placed
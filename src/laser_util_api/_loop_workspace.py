@@ -1,81 +1,239 @@
 from __future__ import annotations
+import math
+from enum import IntEnum
+from collections import OrderedDict
+from typing import Callable, Hashable, Optional, Union, Sequence
+
+import numpy
 from jsonrpcclient import request, Ok
 
-from ._client_interface import ApiInterface
-from .vector import Vector, Xyr, Aabb
+from ._client_interface import ApiInterface, PendingResponse, RpcError
+from ._loop_geometry import LoopGeometry, LocalLoopQueries
+from . import _requests
+from ._loop_shapes import (ShapeCache, polygon_path, star_path, slot_path, keyhole_path, dogbone_rectangle_path,
+                           finger_joint_path, offset_path)
+from .vector import Vector, VectorArray, Xyr, Aabb
+
+# Number of individual insert calls sent per batch when the server has no bulk path method
+_FALLBACK_CHUNK = 500
+
+
+class PathKind(IntEnum):
+    """ Element types for the last column of an Nx5 path array """
+    SEGMENT = 0
+    ARC_CW = 1
+    ARC_CCW = 2
+
+
+PathLike = Union[numpy.ndarray, VectorArray, Sequence[Vector], Sequence[Sequence[float]]]
+
+
+def _as_path_array(elements: PathLike) -> numpy.ndarray:
+    """ Convert a path to an Nx5 array of (x, y, center x, center y, kind) rows. An Nx2 array, a `VectorArray`, or a
+    sequence of vectors is taken as a run of straight segments. """
+    if isinstance(elements, numpy.ndarray):
+        path = elements.astype(float, copy=False)
+    elif isinstance(elements, VectorArray):
+        path = elements.array
+    else:
+        path = numpy.array([[e.x, e.y] if isinstance(e, Vector) else e for e in elements], dtype=float)
+
+    if path.size == 0:
+        return numpy.zeros((0, 5))
+    if path.ndim != 2 or path.shape[1] not in (2, 5):
+        raise ValueError("A path must be an Nx2 array of points or an Nx5 array of (x, y, cx, cy, kind) rows")
+
+    if path.shape[1] == 2:
+        return numpy.hstack((path, numpy.zeros((len(path), 3))))
+
+    if not numpy.isin(path[:, 4], [k.value for k in PathKind]).all():
+        raise ValueError("The last column of an Nx5 path must contain PathKind values")
+    return path
 
 
-class LoopHandle:
-    def __init__(self, guid: str, interface: ApiInterface):
+class LoopHandle(LocalLoopQueries):
+    """ Handle to a loop in the scratch workspace. If the loop was created by a scratch pad with `track_geometry`
+    enabled, a local copy of its elements is kept up to date as it's edited through the handle, so that `bounds`,
+    `area`, `perimeter`, `is_positive`, and `contains` are answered without asking the server.
+
+    A handle to a loop from a scratch pad's `loop_cache` shares the loop with every other handle to the same shape.
+    The first change made through the handle creates the shape again as a loop of its own, which the change is then
+    applied to, so the cached loop is never changed. """
+
+    def __init__(self, guid: str, interface: ApiInterface, geometry: Optional[LoopGeometry] = None):
         self.id = guid
         self._interface = interface
+        self._geometry = geometry
+        self._recreate: Optional[Callable[[], str]] = None
+
+    @property
+    def is_shared(self) -> bool:
+        """ Whether the handle refers to a cached loop which it hasn't yet made its own copy of """
+        return self._recreate is not None
+
+    def _own(self):
+        """ Switch a handle to a cached loop over to a new copy of the loop before it's changed """
+        if self._recreate is not None:
+            recreate, self._recreate = self._recreate, None
+            self.id = recreate()
+            if self._geometry is not None:
+                self._geometry = self._geometry.copy()
+
+    def _edit(self, data: dict, apply: Callable[[LoopGeometry], None], at_cursor: bool = False):
+        """ Send a request which changes the loop and return its result, or the placeholder for it if deferred """
+        return self._applied(self._interface.result(self._interface(data)), apply, at_cursor)
+
+    def _applied(self, result, apply: Callable[[LoopGeometry], None], at_cursor: bool = False):
+        """ Apply a change to the tracked geometry once the request which made it has succeeded. Inside a batch or
+        pipeline that happens when the response arrives, so an edit the server rejects is never applied locally. """
+        def done():
+            geometry = self._edit_at_cursor() if at_cursor else self._geometry
+            if geometry is not None:
+                apply(geometry)
+
+        if isinstance(result, PendingResponse):
+            result.then(done)
+        else:
+            done()
+        return result
 
     def move_cursor_to(self, i: int):
+        self._own()
         data = request("LoopMoveCursorTo", params=(self.id, i))
-        response = self._interface(data)
-        return response.result
+        return self._edit(data, lambda g: g.move_cursor_to(i), at_cursor=True)
 
     def reverse(self):
+        self._own()
         data = request("LoopReverse", params=(self.id, ))
-        response = self._interface(data)
-        return response.result
+        return self._edit(data, lambda g: g.reverse())
 
     def insert_arc_abs(self, point: Vector, center: Vector, is_cw: bool):
+        self._own()
         p = self._interface.convert_to_api(point)
         c = self._interface.convert_to_api(center)
         data = request("LoopInsertArcAbs", params=(self.id, p.x, p.y, c.x, c.y, is_cw))
-        response = self._interface(data)
-        return response.result
+        kind = PathKind.ARC_CW if is_cw else PathKind.ARC_CCW
+        return self._edit(data, lambda g: g.insert(p.x, p.y, c.x, c.y, kind), at_cursor=True)
 
     def insert_arc_rel(self, point: Vector, center: Vector, is_cw: bool):
+        self._own()
         p = self._interface.convert_to_api(point)
         c = self._interface.convert_to_api(center)
         data = request("LoopInsertArcRel", params=(self.id, p.x, p.y, c.x, c.y, is_cw))
-        response = self._interface(data)
-        return response.result
+        kind = PathKind.ARC_CW if is_cw else PathKind.ARC_CCW
+        return self._edit(data, lambda g: g.insert_relative(p.x, p.y, c.x, c.y, kind), at_cursor=True)
 
     def insert_seg_abs(self, point: Vector) -> int:
+        self._own()
         p = self._interface.convert_to_api(point)
         data = request("LoopInsertSegAbs", params=(self.id, p.x, p.y))
-        response = self._interface(data)
-        return response.result
+        return self._edit(data, lambda g: g.insert(p.x, p.y), at_cursor=True)
 
     def insert_seg_rel(self, point: Vector) -> int:
+        self._own()
         p = self._interface.convert_to_api(point)
         data = request("LoopInsertSegRel", params=(self.id, p.x, p.y))
-        response = self._interface(data)
-        return response.result
+        return self._edit(data, lambda g: g.insert_relative(p.x, p.y), at_cursor=True)
+
+    def insert_path(self, elements: PathLike):
+        """ Insert a sequence of segments and arcs at the cursor, the same as calling `insert_seg_abs` or
+        `insert_arc_abs` once for each element, but converted to millimeters in one step and sent as a single request.
+
+        :param elements: Either an Nx2 array (or sequence of `Vector`) of segment start points, or an Nx5 array of
+        (x, y, cx, cy, kind) rows where `kind` is a `PathKind` value and the center is ignored for segments.
+        :return: The result of the last insertion
+
+        If the server does not have the bulk method, the elements are sent as individual insert calls, chunked into
+        JSON-RPC batches. Inside a `client.batch()` or `client.pipeline()` block the bulk request is deferred like any
+        other, so this fallback is not available there.
+        """
+        path = _as_path_array(elements)
+        if len(path) == 0:
+            return None
+
+        self._own()
+        units = self._interface.get_units()
+        coords = units.to_mm(path[:, :4])
+        kinds = path[:, 4].astype(int)
+
+        result = self._insert_path(coords, kinds)
+        return self._applied(result, lambda g: g.insert_path(numpy.column_stack((coords, kinds))), at_cursor=True)
+
+    def _insert_path(self, coords: numpy.ndarray, kinds: numpy.ndarray):
+        if "LoopInsertPath" not in self._interface.unsupported:
+            data = request("LoopInsertPath", params=(self.id, coords.ravel().tolist(), kinds.tolist()))
+            try:
+                response = self._interface(data)
+                return self._interface.result(response)
+            except RpcError as e:
+                if e.code != RpcError.METHOD_NOT_FOUND:
+                    raise
+                self._interface.unsupported.add("LoopInsertPath")
+
+        return self._insert_path_individually(coords, kinds)
+
+    def _insert_path_individually(self, coords: numpy.ndarray, kinds: numpy.ndarray):
+        calls = []
+        for (x, y, cx, cy), kind in zip(coords.tolist(), kinds.tolist()):
+            if kind == PathKind.SEGMENT:
+                calls.append(request("LoopInsertSegAbs", params=(self.id, x, y)))
+            else:
+                calls.append(request("LoopInsertArcAbs", params=(self.id, x, y, cx, cy, kind == PathKind.ARC_CW)))
+
+        result = None
+        for start in range(0, len(calls), _FALLBACK_CHUNK):
+            result = self._interface.call_batch(calls[start:start + _FALLBACK_CHUNK])[-1]
+        return result
 
     def mirror_x(self, x0: float):
+        self._own()
         x0 = self._interface.convert_to_api(x0)
         data = request("LoopMirrorX", params=(self.id, x0))
-        response = self._interface(data)
-        return response.result
+        return self._edit(data, lambda g: g.mirror_x(x0))
 
     def mirror_y(self, y0: float):
+        self._own()
         y0 = self._interface.convert_to_api(y0)
         data = request("LoopMirrorY", params=(self.id, y0))
-        response = self._interface(data)
-        return response.result
+        return self._edit(data, lambda g: g.mirror_y(y0))
 
     def transform(self, xyr: Xyr):
+        self._own()
         t = self._interface.convert_to_api(xyr)
         data = request("LoopTransform", params=(self.id, t.x, t.y, t.r))
-        response = self._interface(data)
-        return response.result
+        return self._edit(data, lambda g: g.transform(t.x, t.y, t.r))
+
+    def union(self, other: LoopHandle, local: bool = False) -> list[LoopHandle]:
+        """ Combine the areas of two loops into new loops. With `local` set, the result is worked out on the client
+        from the loops' tracked geometry, with arcs flattened, and only the resulting loops are uploaded. """
+        if local:
+            return [_upload(self._interface, g) for g in self._local().union(other._local())]
 
-    def union(self, other: LoopHandle) -> list[LoopHandle]:
         data = request("LoopUnion", params=(self.id, other.id))
         response = self._interface(data)
         return [LoopHandle(x, self._interface) for x in response.result]
 
-    def intersection(self, other: LoopHandle) -> list[LoopHandle]:
+    def intersection(self, other: LoopHandle, local: bool = False) -> list[LoopHandle]:
+        """ Find the area shared by two loops as new loops. If both loops are tracked and don't overlap, the empty
+        result is returned without a request. With `local` set, the result is worked out on the client as with
+        `union`. """
+        if self._geometry is not None and other._geometry is not None:
+            if local or not self._geometry.overlaps(other._geometry):
+                return [_upload(self._interface, g) for g in self._geometry.intersection(other._geometry)]
+        elif local:
+            self._local()
+            other._local()
+
         data = request("LoopIntersect", params=(self.id, other.id))
         response = self._interface(data)
         return [LoopHandle(x, self._interface) for x in response.result]
 
     @property
     def bounds(self) -> Aabb:
+        """ The bounds of the loop, computed locally if its geometry is being tracked """
+        if self._geometry is not None:
+            return self._local_bounds()
+
         data = request("GetLoopBounds", params=(self.id, ))
         response = self._interface(data)
         b_min = Vector(response.result["MinX"], response.result["MinY"])
@@ -83,34 +241,94 @@ class LoopHandle:
         return Aabb(self._interface.convert_from_api(b_min), self._interface.convert_from_api(b_max))
 
 
+class LoopCache:
+    """ Least recently used cache of scratch loops keyed by the shape they were created as, so that asking a scratch
+    pad for the same shape again returns a handle to the existing loop instead of creating another one on the server.
+
+    The server has no way of deleting a single scratch loop, so a loop dropped from the cache stays in the scratch
+    workspace until the scratch pad is cleared; the size limit bounds how many loops are held for reuse. """
+
+    def __init__(self, maxsize: int = 256):
+        if maxsize < 1:
+            raise ValueError("maxsize must be at least 1")
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._loops: OrderedDict[Hashable, tuple[str, LoopGeometry]] = OrderedDict()
+
+    def __len__(self):
+        return len(self._loops)
+
+    def lookup(self, key: Hashable) -> Optional[tuple[str, LoopGeometry]]:
+        """ The id and geometry of the loop stored under the key, or None if there isn't one """
+        entry = self._loops.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self._loops.move_to_end(key)
+        self.hits += 1
+        return entry
+
+    def add(self, key: Hashable, guid: str, geometry: LoopGeometry):
+        self._loops[key] = (guid, geometry)
+        if len(self._loops) > self.maxsize:
+            self._loops.popitem(last=False)
+
+    def clear(self):
+        """ Forget every cached loop, as when the scratch workspace is cleared """
+        self._loops.clear()
+
+
 class LoopScratchPad:
-    def __init__(self, interface: ApiInterface):
+    """ Creates loops in the scratch workspace. With `track_geometry` set, every loop created from here keeps a local
+    copy of its geometry; see `LoopHandle`.
+
+    With a `LoopCache` set as `loop_cache`, the shapes (`circle`, `rectangle`, `rounded_rectangle`, and the generated
+    shapes below) are only created once on the server for each set of parameters, and handles to them are
+    copy-on-write; see `LoopHandle`.
+
+    Besides the server's shape primitives, shapes such as polygons, slots, and finger joint panels are generated on
+    the client and uploaded as a whole path in one bulk request. The generated paths are kept in `shapes`, a
+    `ShapeCache` keyed by the shape's parameters, so creating the same shape again skips generating it. """
+
+    def __init__(self, interface: ApiInterface, track_geometry: bool = False):
         self._interface = interface
+        self.track_geometry = track_geometry
+        self.shapes = ShapeCache()
+        self.loop_cache: Optional[LoopCache] = None
+
+    def _handle(self, guid: str, geometry: LoopGeometry) -> LoopHandle:
+        return LoopHandle(guid, self._interface, geometry if self.track_geometry else None)
 
     def create(self) -> LoopHandle:
         data = request("LoopCreate")
         response = self._interface(data)
-        return LoopHandle(response.result, self._interface)
+        return self._handle(response.result, LoopGeometry())
 
+    def upload(self, geometry: LoopGeometry) -> LoopHandle:
+        """ Create a loop from a `LoopGeometry`, such as the result of a local Boolean operation, in two requests.
+        The new loop is tracked. """
+        return _upload(self._interface, geometry)
+
+    def from_polyline(self, points: PathLike) -> LoopHandle:
+        """ Create a new loop from a path in a single bulk upload. See `LoopHandle.insert_path` for the accepted
+        formats. """
+        handle = self.create()
+        handle.insert_path(points)
+        return handle
 
     def circle(self, center: Vector, radius: float) -> LoopHandle:
         c = self._interface.convert_to_api(center)
         r = self._interface.convert_to_api(radius)
 
-        data = request("LoopCircle", params=(c.x, c.y, r))
-        response = self._interface(data)
-        return LoopHandle(response.result, self._interface)
-
+        return self._primitive(LoopGeometry.circle(c.x, c.y, r), "LoopCircle", c.x, c.y, r)
 
     def rectangle(self, corner: Vector, width: float, height: float) -> LoopHandle:
         c = self._interface.convert_to_api(corner)
         w = self._interface.convert_to_api(width)
         h = self._interface.convert_to_api(height)
 
-        data = request("LoopRectangle", params=(c.x, c.y, w, h))
-        response = self._interface(data)
-        return LoopHandle(response.result, self._interface)
-
+        return self._primitive(LoopGeometry.rectangle(c.x, c.y, w, h), "LoopRectangle", c.x, c.y, w, h)
 
     def rounded_rectangle(self, corner: Vector, width: float, height: float, radius: float) -> LoopHandle:
         c = self._interface.convert_to_api(corner)
@@ -118,11 +336,112 @@ class LoopScratchPad:
         h = self._interface.convert_to_api(height)
         r = self._interface.convert_to_api(radius)
 
-        data = request("LoopRoundedRectangle", params=(c.x, c.y, w, h, r))
-        response = self._interface(data)
-        return LoopHandle(response.result, self._interface)
+        return self._primitive(LoopGeometry.rounded_rectangle(c.x, c.y, w, h, r), "LoopRoundedRectangle",
+                               c.x, c.y, w, h, r)
+
+    def _primitive(self, geometry: LoopGeometry, method: str, *params) -> LoopHandle:
+        def create() -> str:
+            response = self._interface(request(method, params=params))
+            return response.result
+
+        return self._cached((method, *params), create, geometry)
+
+    # Shapes generated on the client
+    # ==========================================================================================
+    def polygon(self, center: Vector, radius: float, sides: int, rotation: float = 0.0) -> LoopHandle:
+        """ A regular polygon with its vertices on a circle of the given radius, the first at `rotation` radians """
+        c = self._interface.convert_to_api(center)
+        r = self._interface.convert_to_api(radius)
+        return self._generated(("polygon", c.x, c.y, r, sides, rotation),
+                               lambda: polygon_path(c.x, c.y, r, sides, rotation))
+
+    def star(self, center: Vector, outer_radius: float, inner_radius: float, points: int,
+             rotation: float = 0.0) -> LoopHandle:
+        c = self._interface.convert_to_api(center)
+        r0 = self._interface.convert_to_api(outer_radius)
+        r1 = self._interface.convert_to_api(inner_radius)
+        return self._generated(("star", c.x, c.y, r0, r1, points, rotation),
+                               lambda: star_path(c.x, c.y, r0, r1, points, rotation))
+
+    def slot(self, start: Vector, end: Vector, width: float) -> LoopHandle:
+        """ A slot with rounded ends, `start` and `end` being the centers of the ends """
+        s = self._interface.convert_to_api(start)
+        e = self._interface.convert_to_api(end)
+        w = self._interface.convert_to_api(width)
+        return self._generated(("slot", s.x, s.y, e.x, e.y, w), lambda: slot_path(s.x, s.y, e.x, e.y, w))
+
+    def keyhole(self, center: Vector, radius: float, slot_width: float, slot_length: float,
+                angle: float = -0.5 * math.pi) -> LoopHandle:
+        """ A round head with a narrower round-ended slot leading out of it in the direction `angle` (straight down
+        by default), `slot_length` being the distance from the head's center to the center of the slot's end """
+        c = self._interface.convert_to_api(center)
+        r = self._interface.convert_to_api(radius)
+        w = self._interface.convert_to_api(slot_width)
+        length = self._interface.convert_to_api(slot_length)
+        return self._generated(("keyhole", c.x, c.y, r, w, length, angle),
+                               lambda: keyhole_path(c.x, c.y, r, w, length, angle))
+
+    def dogbone_rectangle(self, corner: Vector, width: float, height: float, tool_radius: float) -> LoopHandle:
+        """ A rectangle with dogbone relief circles at its corners; see `dogbone_rectangle_path` """
+        c = self._interface.convert_to_api(corner)
+        w = self._interface.convert_to_api(width)
+        h = self._interface.convert_to_api(height)
+        r = self._interface.convert_to_api(tool_radius)
+        return self._generated(("dogbone", c.x, c.y, w, h, r), lambda: dogbone_rectangle_path(c.x, c.y, w, h, r))
+
+    def finger_joint(self, corner: Vector, width: float, height: float, finger_width: float, depth: float,
+                     sides: Sequence[bool] = (True, True, True, True)) -> LoopHandle:
+        """ A rectangular panel with finger joint edges on the selected (bottom, right, top, left) sides; see
+        `finger_joint_path` """
+        c = self._interface.convert_to_api(corner)
+        w = self._interface.convert_to_api(width)
+        h = self._interface.convert_to_api(height)
+        f = self._interface.convert_to_api(finger_width)
+        d = self._interface.convert_to_api(depth)
+        sides = tuple(bool(s) for s in sides)
+        return self._generated(("finger_joint", c.x, c.y, w, h, f, d, sides),
+                               lambda: finger_joint_path(c.x, c.y, w, h, f, d, sides))
+
+    def offset(self, points: PathLike, distance: float, join: str = "round") -> LoopHandle:
+        """ A polygon given by its vertices, offset outwards by `distance` or inwards if it's negative; see
+        `offset_path` """
+        p = self._interface.get_units().to_mm(_as_path_array(points)[:, :2])
+        d = self._interface.convert_to_api(distance)
+        return self._generated(("offset", p.tobytes(), d, join), lambda: offset_path(p, d, join))
+
+    def _generated(self, key: tuple, build) -> LoopHandle:
+        path = self.shapes.get(key, build)
+
+        def create() -> str:
+            response = self._interface(request("LoopCreate"))
+            LoopHandle(response.result, self._interface)._insert_path(path[:, :4], path[:, 4].astype(int))
+            return response.result
+
+        return self._cached(key, create, LoopGeometry(path))
+
+    def _cached(self, key: tuple, create: Callable[[], str], geometry: LoopGeometry) -> LoopHandle:
+        """ A handle to a new loop, or to the cached loop for the key if there's a loop cache """
+        if self.loop_cache is None:
+            return self._handle(create(), geometry)
+
+        entry = self.loop_cache.lookup(key)
+        if entry is None:
+            entry = create(), geometry
+            self.loop_cache.add(key, *entry)
+        handle = self._handle(*entry)
+        handle._recreate = create
+        return handle
 
     def clear(self):
-        data = request("LoopsClearAll")
-        response = self._interface(data)
-        return response.result
+        response = self._interface(_requests.clear_loops())
+        if self.loop_cache is not None:
+            self.loop_cache.clear()
+        return self._interface.result(response)
+
+
+def _upload(interface: ApiInterface, geometry: LoopGeometry) -> LoopHandle:
+    response = interface(request("LoopCreate"))
+    handle = LoopHandle(response.result, interface)
+    handle._insert_path(geometry.path[:, :4], geometry.path[:, 4].astype(int))
+    handle._geometry = LoopGeometry(geometry.path.copy())
+    return handle
@@ -0,0 +1,201 @@
+from __future__ import annotations
+import math
+from typing import Optional, Sequence, Union
+
+import numpy
+
+from ._loop_boolean import _points_in_polygon
+from .vector import Aabb, VectorArray
+
+# Number of transforms sent in each operate_copies request by `operate_pattern` when the client has no `ChunkedSender`
+PATTERN_CHUNK = 2000
+
+# Upper bound on the number of point-edge pairs held in memory at once when measuring keep-out distances
+_PAIR_CHUNK = 1 << 20
+
+
+# ==========================================================================================
+# Pattern generators
+# ==========================================================================================
+# Each generator returns an Nx3 array of (x, y, r) transforms in the same units as its parameters, with r in radians,
+# ready to pass to `BodyHandle.operate_copies` or `BodyHandle.operate_pattern`.
+
+def grid_pattern(x0: float, y0: float, dx: float, dy: float, nx: int, ny: int, rotation: float = 0.0) -> numpy.ndarray:
+    """ A rectangular grid of nx by ny copies spaced dx and dy apart, starting from (x0, y0) and row by row, every
+    copy rotated by `rotation` """
+    return staggered_pattern(x0, y0, dx, dy, nx, ny, 0.0, rotation)
+
+
+def staggered_pattern(x0: float, y0: float, dx: float, dy: float, nx: int, ny: int, stagger: Optional[float] = None,
+                      rotation: float = 0.0) -> numpy.ndarray:
+    """ A grid of ny rows of nx copies in which every second row is shifted along by `stagger`, which defaults to
+    half the spacing between copies """
+    stagger = 0.5 * dx if stagger is None else stagger
+    j, i = numpy.divmod(numpy.arange(max(nx, 0) * max(ny, 0)), max(nx, 1))
+    x = x0 + i * dx + (j % 2) * stagger
+    y = y0 + j * dy
+    return numpy.column_stack((x, y, numpy.full(len(x), rotation, dtype=float)))
+
+
+def hex_pattern(x0: float, y0: float, pitch: float, nx: int, ny: int, rotation: float = 0.0) -> numpy.ndarray:
+    """ A hexagonal packing, in which every copy is `pitch` from each of its six nearest neighbors """
+    return staggered_pattern(x0, y0, pitch, pitch * math.sqrt(3.0) / 2, nx, ny, 0.5 * pitch, rotation)
+
+
+def polar_pattern(cx: float, cy: float, radius: float, count: int, start_angle: float = 0.0,
+                  sweep: float = 2 * math.pi, rotate: bool = True) -> numpy.ndarray:
+    """ Copies spaced evenly around a circle starting at `start_angle`. A full circle leaves the same gap between the
+    last copy and the first as between the others, while a partial `sweep` puts copies at both of its ends. With
+    `rotate` set each copy is turned by its angle, so a tool built pointing along +x points away from the center. """
+    if count < 1:
+        return numpy.zeros((0, 3))
+    full = abs(abs(sweep) - 2 * math.pi) < 1e-12
+    step = sweep / count if full or count == 1 else sweep / (count - 1)
+    angles = start_angle + step * numpy.arange(count)
+    r = angles if rotate else numpy.zeros(count)
+    return numpy.column_stack((cx + radius * numpy.cos(angles), cy + radius * numpy.sin(angles), r))
+
+
+def bolt_circle_pattern(cx: float, cy: float, diameter: float, count: int, start_angle: float = 0.0) -> numpy.ndarray:
+    """ Unrotated copies spaced evenly around a bolt circle of the given diameter """
+    return polar_pattern(cx, cy, 0.5 * diameter, count, start_angle, rotate=False)
+
+
+def path_pattern(points, spacing: float, offset: float = 0.0, closed: bool = False,
+                 rotate: bool = True) -> numpy.ndarray:
+    """ Copies spaced `spacing` apart along a polyline given by an Nx2 array of points, the first `offset` from its
+    start. With `rotate` set each copy is turned to face along the path. A closed path runs back to its first point. """
+    points = numpy.asarray(points.array if isinstance(points, VectorArray) else points, dtype=float).reshape(-1, 2)
+    if spacing <= 0:
+        raise ValueError("The spacing must be positive")
+    if closed and len(points):
+        points = numpy.concatenate((points, points[:1]))
+    if len(points) < 2:
+        return numpy.zeros((0, 3))
+
+    delta = numpy.diff(points, axis=0)
+    lengths = numpy.hypot(delta[:, 0], delta[:, 1])
+    ends = numpy.cumsum(lengths)
+    total = float(ends[-1])
+    stations = numpy.arange(offset, total + 1e-9 * max(total, 1.0), spacing)
+    if closed and len(stations) > 1 and total - stations[-1] + stations[0] < 1e-9 * max(total, 1.0):
+        stations = stations[:-1]
+    if not len(stations):
+        return numpy.zeros((0, 3))
+
+    # The segment each station falls on, skipping zero length segments
+    index = numpy.clip(numpy.searchsorted(ends, stations, side="right"), 0, len(lengths) - 1)
+    nonzero = numpy.flatnonzero(lengths > 0)
+    index = nonzero[numpy.clip(numpy.searchsorted(nonzero, index), 0, len(nonzero) - 1)]
+    t = numpy.clip((stations - (ends[index] - lengths[index])) / lengths[index], 0.0, 1.0)
+    xy = points[index] + t[:, None] * delta[index]
+    r = numpy.arctan2(delta[index, 1], delta[index, 0]) if rotate else numpy.zeros(len(xy))
+    return numpy.column_stack((xy, r))
+
+
+# ==========================================================================================
+# Clipping
+# ==========================================================================================
+def copy_bounds(transforms: numpy.ndarray, tool_bounds: Union[Aabb, Sequence[float]]) -> numpy.ndarray:
+    """ An Nx4 array of (min x, min y, max x, max y) bounds which contain each copy of a tool, found by moving the
+    corners of the tool's bounds with each transform """
+    transforms = numpy.asarray(transforms, dtype=float).reshape(-1, 3)
+    x0, y0, x1, y1 = _as_bounds(tool_bounds)
+    corners = numpy.array([[x0, y0], [x1, y0], [x1, y1], [x0, y1]])
+    c = numpy.cos(transforms[:, 2])[:, None]
+    s = numpy.sin(transforms[:, 2])[:, None]
+    x = c * corners[None, :, 0] - s * corners[None, :, 1] + transforms[:, 0:1]
+    y = s * corners[None, :, 0] + c * corners[None, :, 1] + transforms[:, 1:2]
+    return numpy.column_stack((x.min(axis=1), y.min(axis=1), x.max(axis=1), y.max(axis=1)))
+
+
+def clip_to_bounds(transforms: numpy.ndarray, bounds: Union[Aabb, Sequence[float]],
+                   tool_bounds: Union[Aabb, Sequence[float], None] = None, margin: float = 0.0) -> numpy.ndarray:
+    """ The transforms which place a copy of the tool entirely inside the bounds, shrunk by `margin`. Without
+    `tool_bounds`, only the transforms' positions are tested. """
+    transforms = numpy.asarray(transforms, dtype=float).reshape(-1, 3)
+    x0, y0, x1, y1 = _as_bounds(bounds)
+    if tool_bounds is None:
+        boxes = numpy.column_stack((transforms[:, 0:2], transforms[:, 0:2]))
+    else:
+        boxes = copy_bounds(transforms, tool_bounds)
+    keep = ((boxes[:, 0] >= x0 + margin) & (boxes[:, 1] >= y0 + margin) & (boxes[:, 2] <= x1 - margin) &
+            (boxes[:, 3] <= y1 - margin))
+    return transforms[keep]
+
+
+def exclude_keep_out(transforms: numpy.ndarray, keep_out, margin: float = 0.0) -> numpy.ndarray:
+    """ The transforms whose positions are outside every keep-out polygon, and at least `margin` away from their
+    edges. `keep_out` is a single Nx2 array of polygon vertices or a sequence of them. """
+    transforms = numpy.asarray(transforms, dtype=float).reshape(-1, 3)
+    keep = numpy.ones(len(transforms), dtype=bool)
+    for polygon in _as_polygons(keep_out):
+        points = transforms[:, 0:2]
+        keep &= ~_points_in_polygon(points, polygon)
+        if margin > 0:
+            keep &= _distance_to_polygon(points, polygon) >= margin
+    return transforms[keep]
+
+
+def _as_bounds(bounds: Union[Aabb, Sequence[float]]) -> tuple[float, float, float, float]:
+    if isinstance(bounds, Aabb):
+        return bounds.min_bound.x, bounds.min_bound.y, bounds.max_bound.x, bounds.max_bound.y
+    x0, y0, x1, y1 = bounds
+    return x0, y0, x1, y1
+
+
+def _as_polygons(keep_out) -> list[numpy.ndarray]:
+    """ A single polygon or a sequence of polygons as a list of Nx2 arrays """
+    if isinstance(keep_out, VectorArray):
+        return [keep_out.array]
+    try:
+        array = numpy.asarray(keep_out, dtype=float)
+    except ValueError:
+        # Polygons with different numbers of vertices
+        array = None
+    if array is not None and array.ndim == 2:
+        return [array.reshape(-1, 2)]
+    if array is not None and array.ndim == 3:
+        return list(array)
+    return [numpy.asarray(p.array if isinstance(p, VectorArray) else p, dtype=float).reshape(-1, 2)
+            for p in keep_out]
+
+
+def _distance_to_polygon(points: numpy.ndarray, polygon: numpy.ndarray) -> numpy.ndarray:
+    """ The distance from each point to the nearest edge of a closed polygon """
+    p = polygon
+    d = numpy.roll(polygon, -1, axis=0) - p
+    length_sq = numpy.maximum(numpy.sum(d * d, axis=1), 1e-300)
+    result = numpy.empty(len(points))
+    per = max(1, _PAIR_CHUNK // max(len(polygon), 1))
+    for start in range(0, len(points), per):
+        m = points[start:start + per, None, :]
+        t = numpy.clip(numpy.sum((m - p[None]) * d[None], axis=2) / length_sq[None], 0.0, 1.0)
+        offset = m - (p[None] + t[..., None] * d[None])
+        result[start:start + per] = numpy.hypot(offset[..., 0], offset[..., 1]).min(axis=1)
+    return result
+
+
+def _pattern_step(interface, chunk_size: Optional[int], count: int) -> int:
+    """ How many transforms `operate_pattern` passes to each `operate_copies` call """
+    if chunk_size is not None:
+        if chunk_size < 1:
+            raise ValueError("chunk_size must be at least 1")
+        return chunk_size
+    if interface.chunking is not None:
+        return max(count, 1)
+    return PATTERN_CHUNK
+
+
+def _clip_pattern(transforms, body_bounds: Optional[Aabb], tool_bounds: Optional[Aabb], margin: float,
+                  keep_out) -> numpy.ndarray:
+    """ The transforms of `operate_pattern` as an Nx3 array, clipped to the body's bounds if they're given and with
+    those in the keep-out polygons removed """
+    if not isinstance(transforms, numpy.ndarray):
+        transforms = [(t.x, t.y, t.r) for t in transforms]
+    transforms = numpy.asarray(transforms, dtype=float).reshape(-1, 3)
+    if body_bounds is not None:
+        transforms = clip_to_bounds(transforms, body_bounds, tool_bounds, margin)
+    if keep_out is not None:
+        transforms = exclude_keep_out(transforms, keep_out, margin)
+    return transforms
@@ -0,0 +1,104 @@
+from typing import Callable, Optional
+
+from jsonrpcclient import parse, Error
+
+from ._client_interface import PendingResponse, UnexpectedResponseError, RpcError
+from ._codec import JsonCodec
+
+
+class RpcPipeline:
+    """ Sends requests on the connection without waiting for each response, so that many requests can be in flight at
+    once. Every request is given a `PendingResponse`, and responses are matched back to them by their JSON-RPC id as
+    they are read, so out-of-order answers are handled and stale or unknown ones are detected.
+
+    Outgoing requests are coalesced into larger writes, and at most `max_in_flight` requests are left unanswered at any
+    time to keep both ends' socket buffers from filling up. Pipelines are used through `ApiClient.pipeline()`. """
+
+    def __init__(self, send: Callable[[bytes], None], read_line: Callable[[], bytes], max_in_flight: int = 256,
+                 write_size: int = 65536, codec: Optional[JsonCodec] = None):
+        if max_in_flight < 1:
+            raise ValueError("max_in_flight must be at least 1")
+
+        self._send = send
+        self._read_line = read_line
+        self.max_in_flight = max_in_flight
+        self._write_size = write_size
+        self._codec = codec if codec is not None else JsonCodec()
+        self._outgoing = bytearray()
+        self._in_flight: dict = {}
+        self._open = False
+
+    def __len__(self):
+        return len(self._in_flight)
+
+    def __enter__(self):
+        self._open = True
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self._open = False
+        if exc_type is not None:
+            # Responses must still be read so the connection stays in step, but their failures are not interesting
+            # compared to the exception that is already propagating
+            self._drain()
+            return
+
+        failures = self._drain()
+        if failures:
+            raise failures[0]
+
+    @property
+    def is_open(self) -> bool:
+        return self._open
+
+    def submit(self, request_data: dict) -> PendingResponse:
+        request_id = request_data["id"]
+        if request_id in self._in_flight:
+            raise ValueError(f"A request with id {request_id!r} is already in flight")
+
+        while len(self._in_flight) >= self.max_in_flight:
+            self._read_one()
+
+        pending = PendingResponse(request_id, lambda: self._wait_for(pending))
+        self._in_flight[request_id] = pending
+        self._outgoing += self._codec.encode_request(request_data)
+        self._outgoing += b"\n"
+        if len(self._outgoing) >= self._write_size:
+            self._flush_writes()
+        return pending
+
+    def wait_all(self):
+        """ Block until every request in flight has been answered, raising the first failure among them. """
+        failures = self._drain()
+        if failures:
+            raise failures[0]
+
+    def _drain(self) -> list[Exception]:
+        failures = []
+        while self._in_flight:
+            pending = self._read_one()
+            if pending.error is not None:
+                failures.append(pending.error)
+        return failures
+
+    def _flush_writes(self):
+        if self._outgoing:
+            self._send(bytes(self._outgoing))
+            self._outgoing.clear()
+
+    def _wait_for(self, pending: PendingResponse):
+        while not pending.done():
+            self._read_one()
+
+    def _read_one(self) -> PendingResponse:
+        self._flush_writes()
+        parsed = parse(self._codec.loads(self._read_line()))
+        pending = self._in_flight.pop(parsed.id, None)
+        if pending is None:
+            raise UnexpectedResponseError(f"Received a response for id {parsed.id!r}, which is not in flight")
+
+        if isinstance(parsed, Error):
+            pending.set_error(RpcError.from_response(parsed))
+        else:
+            pending.set_result(parsed.result)
+        return pending
@@ -0,0 +1,235 @@
+import queue
+import socket
+import threading
+import time
+from concurrent.futures import Future
+from dataclasses import dataclass
+from typing import Callable, Iterable, Optional
+
+from .client import ApiClient
+from .vector import Units
+
+_STOP = object()
+
+
+@dataclass
+class InstanceHealth:
+    """ Running statistics for one Laser Utility instance in a `ClientPool` """
+    port: int
+    healthy: bool = True
+    completed: int = 0
+    failed: int = 0
+    consecutive_failures: int = 0
+    busy_time: float = 0.0
+
+    @property
+    def mean_job_time(self) -> float:
+        runs = self.completed + self.failed
+        return self.busy_time / runs if runs else 0.0
+
+
+class _Job:
+    def __init__(self, fn: Callable, args: tuple, kwargs: dict):
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.future = Future()
+        self.attempts = 0
+
+
+class ClientPool:
+    """ A pool of persistent connections to every Laser Utility instance listening in a range of ports, which
+    dispatches independent jobs across them.
+
+    Each live instance gets its own `ApiClient` and worker thread. Workers pull jobs from a shared queue, so a faster
+    instance naturally takes on more of the work. A job is a callable whose first argument is the `ApiClient` it has
+    been given, and it must only use that client. If the connection to an instance fails, the instance is marked
+    unhealthy and the job is put back on the queue to be retried on another instance, up to `max_attempts` times. Any
+    other exception raised by the job is passed back through its future.
+
+    ```python
+    with ClientPool(range(5000, 5004)) as pool:
+        names = pool.map(lambda client, n: client.project.name(), range(10))
+    ```
+    """
+
+    def __init__(self, ports: Iterable[int] = range(5000, 5010), host: str = "localhost", units=Units.MM,
+                 probe_timeout: float = 0.25, max_attempts: int = 3, max_consecutive_failures: int = 1):
+        self.ports = list(ports)
+        self.host = host
+        self.units = units
+        self.probe_timeout = probe_timeout
+        self.max_attempts = max_attempts
+        self.max_consecutive_failures = max_consecutive_failures
+
+        self._queue: queue.Queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._clients: dict[int, ApiClient] = {}
+        self._health: dict[int, InstanceHealth] = {}
+        self._workers: dict[int, threading.Thread] = {}
+        self._closed = False
+
+    def __enter__(self):
+        self.discover()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def __len__(self):
+        return len(self.live_ports())
+
+    def live_ports(self) -> list[int]:
+        with self._lock:
+            return [port for port, health in self._health.items() if health.healthy]
+
+    def health(self) -> list[InstanceHealth]:
+        """ Get a snapshot of the statistics for every instance the pool has connected to """
+        with self._lock:
+            return [InstanceHealth(**vars(h)) for h in self._health.values()]
+
+    def discover(self) -> list[int]:
+        """ Probe the pool's port range for listening instances, connecting to any which are not already live in the
+        pool (including ones previously marked unhealthy), and return the list of live ports. """
+        if self._closed:
+            raise Exception("The pool has been closed")
+
+        for port in self.ports:
+            with self._lock:
+                health = self._health.get(port)
+                if health is not None and health.healthy:
+                    continue
+
+            if not self._probe(port):
+                continue
+
+            client = ApiClient(port=port, host=self.host, units=self.units)
+            try:
+                client.project.path()
+            except Exception:
+                client.close()
+                continue
+
+            with self._lock:
+                self._clients[port] = client
+                if health is None:
+                    self._health[port] = InstanceHealth(port)
+                else:
+                    health.healthy = True
+                    health.consecutive_failures = 0
+
+            worker = threading.Thread(target=self._work, args=(port, client), daemon=True,
+                                      name=f"laser-util-pool-{port}")
+            self._workers[port] = worker
+            worker.start()
+
+        return self.live_ports()
+
+    def submit(self, fn: Callable, *args, **kwargs) -> Future:
+        """ Queue a job to run on the next free instance as `fn(client, *args, **kwargs)` """
+        if self._closed:
+            raise Exception("The pool has been closed")
+        if not self.live_ports():
+            raise ConnectionError("There are no live Laser Utility instances in the pool")
+
+        job = _Job(fn, args, kwargs)
+        self._queue.put(job)
+        return job.future
+
+    def map(self, fn: Callable, *iterables, timeout: Optional[float] = None) -> list:
+        """ Run `fn(client, *items)` for each set of items from the iterables, spread across the pool's instances, and
+        return the results in order. The first exception raised by a job is re-raised. """
+        futures = [self.submit(fn, *items) for items in zip(*iterables)]
+        return [f.result(timeout) for f in futures]
+
+    def close(self):
+        """ Stop the workers once the queued jobs are finished and close every connection """
+        if self._closed:
+            return
+        self._closed = True
+
+        for _ in self._workers:
+            self._queue.put(_STOP)
+        for worker in self._workers.values():
+            worker.join()
+
+        # Anything left could not be run because every instance failed
+        self._fail_queued()
+        for client in self._clients.values():
+            client.close()
+
+    def _probe(self, port: int) -> bool:
+        try:
+            with socket.create_connection((self.host, port), timeout=self.probe_timeout):
+                return True
+        except OSError:
+            return False
+
+    def _work(self, port: int, client: ApiClient):
+        while True:
+            job = self._queue.get()
+            if job is _STOP:
+                return
+            if job.attempts == 0 and not job.future.set_running_or_notify_cancel():
+                continue
+
+            job.attempts += 1
+            start = time.perf_counter()
+            try:
+                result = job.fn(client, *job.args, **job.kwargs)
+            except (ConnectionError, socket.timeout) as e:
+                # The connection to this instance is broken, so the job is given to another instance if possible
+                if self._record_failure(port, time.perf_counter() - start, connection_lost=True):
+                    client.close()
+                    self._requeue_or_fail(job, e)
+                    self._fail_queued_if_no_instances()
+                    return
+                self._requeue_or_fail(job, e)
+            except BaseException as e:
+                self._record_failure(port, time.perf_counter() - start, connection_lost=False)
+                job.future.set_exception(e)
+            else:
+                self._record_success(port, time.perf_counter() - start)
+                job.future.set_result(result)
+
+    def _requeue_or_fail(self, job: _Job, error: Exception):
+        if job.attempts >= self.max_attempts or not self.live_ports():
+            job.future.set_exception(error)
+            return
+        self._queue.put(job)
+
+    def _record_success(self, port: int, elapsed: float):
+        with self._lock:
+            health = self._health[port]
+            health.completed += 1
+            health.consecutive_failures = 0
+            health.busy_time += elapsed
+
+    def _record_failure(self, port: int, elapsed: float, connection_lost: bool) -> bool:
+        """ Record a failed job, returning True if the instance has now been marked unhealthy """
+        with self._lock:
+            health = self._health[port]
+            health.failed += 1
+            health.busy_time += elapsed
+            if not connection_lost:
+                return False
+
+            health.consecutive_failures += 1
+            if health.consecutive_failures >= self.max_consecutive_failures:
+                health.healthy = False
+            return not health.healthy
+
+    def _fail_queued_if_no_instances(self):
+        if not self.live_ports():
+            self._fail_queued()
+
+    def _fail_queued(self):
+        while True:
+            try:
+                job = self._queue.get_nowait()
+            except queue.Empty:
+                return
+            if job is _STOP:
+                continue
+            if job.attempts > 0 or job.future.set_running_or_notify_cancel():
+                job.future.set_exception(ConnectionError("No live Laser Utility instance was available for the job"))
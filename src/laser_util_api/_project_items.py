@@ -1,5 +1,6 @@
 from __future__ import annotations
-from typing import Optional, Union
+import sys
+from typing import Callable, NamedTuple, Optional, Union
 
 from jsonrpcclient import request, Ok
 from uuid import UUID
@@ -7,12 +8,31 @@ from uuid import UUID
 from ._client_interface import ApiInterface
 from .vector import Xyr, Aabb, Vector
 
+_NIL_UUID = UUID("00000000-0000-0000-0000-000000000000")
+
+
+class _Change(NamedTuple):
+    """ A request which changes an entity, with the message to raise if the server refuses it and the change to make
+    to the local state once it has accepted it. `geometry` marks a change to the entity's bounds. """
+    data: dict
+    message: str
+    apply: Callable[[], None]
+    geometry: bool = False
+
 
 class ProjectItem:
+    # Large projects can hold many thousands of these, so they don't carry a per-instance __dict__
+    __slots__ = ("type_name", "id", "_interface", "_name", "_tags", "_aabb", "_origin_id", "_origin_parent", "_origin",
+                 "_visible", "_suppressed", "_drag_locked")
+
     def __init__(self, values: dict, interface: ApiInterface):
-        self.type_name = values["TypeName"].replace("ViewModel", "")
-        self.id = UUID(values["Info"]["Id"])
         self._interface = interface
+        self._load(values)
+
+    def _load(self, values: dict):
+        """ Set the item's state from the entity values returned by the server """
+        self.type_name = sys.intern(values["TypeName"].replace("ViewModel", ""))
+        self.id = UUID(values["Info"]["Id"])
 
         self._name = values["Info"]["Name"]
         self._tags = values["Info"]["Tags"]
@@ -22,7 +42,8 @@ class ProjectItem:
         self._aabb = Aabb(self._interface.convert_from_api(b_min), self._interface.convert_from_api(b_max))
 
         self._origin_id = values["Info"]["Origin"]["Id"]
-        self._origin_parent = UUID(values["Info"]["Origin"]["ParentId"])
+        parent = UUID(values["Info"]["Origin"]["ParentId"])
+        self._origin_parent = _NIL_UUID if parent == _NIL_UUID else parent
         self._origin = self._interface.convert_from_api(Xyr.from_dict(values["Info"]["Origin"]["Xyr"]))
         self._visible = values["Info"]["IsVisible"]
         self._suppressed = values["Info"]["IsSuppressed"]
@@ -31,6 +52,64 @@ class ProjectItem:
     def _id_str(self) -> str:
         return str(self.id)
 
+    def _update(self, change: _Change):
+        """ Send a checked request which changes the entity, then apply the change to the local state and notify the
+        interface's listeners once it has succeeded. Inside a batch or pipeline that happens when the response arrives,
+        so a change the server rejects is never shown locally. """
+        def done():
+            change.apply()
+            self._interface.entity_changed(self, geometry=change.geometry)
+
+        self._interface.call_checked(change.data, change.message, done)
+
+    # The requests for each change are built here and shared with `AsyncProjectItem`, which only differs in how it
+    # waits for the response
+    def _visible_change(self, value: bool) -> _Change:
+        return _Change(request("SetEntityVisibility", params=[self._id_str(), value]), "Failed to set entity visible",
+                       lambda: setattr(self, "_visible", value))
+
+    def _drag_locked_change(self, value: bool) -> _Change:
+        return _Change(request("SetEntityLocked", params=[self._id_str(), value]), "Failed to set entity locked",
+                       lambda: setattr(self, "_drag_locked", value))
+
+    def _for_construction_change(self, value: bool) -> _Change:
+        return _Change(request("SetEntityForConstruction", params=[self._id_str(), value]),
+                       "Failed to set entity suppressed", lambda: setattr(self, "_suppressed", value))
+
+    def _name_change(self, value: str) -> _Change:
+        return _Change(request("SetEntityName", params=[self._id_str(), value]), "Failed to set entity name",
+                       lambda: setattr(self, "_name", value))
+
+    def _add_tag_change(self, tag: str) -> _Change:
+        return _Change(request("AddTagToEntity", params=[self._id_str(), tag]), "Failed to add tag",
+                       lambda: self._tags.append(tag))
+
+    def _remove_tag_change(self, tag: str) -> _Change:
+        def remove():
+            self._tags.remove(tag)
+
+        return _Change(request("RemoveTagFromEntity", params=[self._id_str(), tag]), "Failed to remove tag", remove)
+
+    def _origin_change(self, value: Xyr) -> _Change:
+        t = self._interface.convert_to_api(value)
+        return _Change(request("SetEntityOrigin", params=[self._id_str(), t.x, t.y, t.r]),
+                       "Failed to set entity origin", lambda: setattr(self, "_origin", value), geometry=True)
+
+    def _origin_parent_change(self, value: Union[ProjectItem, UUID, None]) -> _Change:
+        if value is None:
+            value = _NIL_UUID
+        elif isinstance(value, ProjectItem):
+            value = value.id
+        return _Change(request("SetEntityOriginParent", params=[self._id_str(), str(value)]),
+                       "Failed to set entity origin parent", lambda: setattr(self, "_origin_parent", value),
+                       geometry=True)
+
+    def _zoom_request(self) -> dict:
+        return request("ZoomToEntity", params=[self._id_str()])
+
+    def _delete_request(self) -> dict:
+        return request("DeleteEntity", params=[self._id_str()])
+
     def __repr__(self):
         return f"[{self.type_name} ({str(self.id)[:8]}) {self._name}]"
 
@@ -44,11 +123,7 @@ class ProjectItem:
 
     @visible.setter
     def visible(self, value: bool):
-        data = request("SetEntityVisibility", params=[self._id_str(), value])
-        response = self._interface(data)
-        if not response.result:
-            raise Exception("Failed to set entity visible")
-        self._visible = value
+        self._update(self._visible_change(value))
 
     @property
     def drag_locked(self) -> bool:
@@ -56,11 +131,7 @@ class ProjectItem:
 
     @drag_locked.setter
     def drag_locked(self, value: bool):
-        data = request("SetEntityLocked", params=[self._id_str(), value])
-        response = self._interface(data)
-        if not response.result:
-            raise Exception("Failed to set entity locked")
-        self._drag_locked = value
+        self._update(self._drag_locked_change(value))
 
     @property
     def for_construction(self) -> bool:
@@ -68,11 +139,7 @@ class ProjectItem:
 
     @for_construction.setter
     def for_construction(self, value: bool):
-        data = request("SetEntityForConstruction", params=[self._id_str(), value])
-        response = self._interface(data)
-        if not response.result:
-            raise Exception("Failed to set entity suppressed")
-        self._suppressed = value
+        self._update(self._for_construction_change(value))
 
     @property
     def name(self) -> str:
@@ -80,29 +147,17 @@ class ProjectItem:
 
     @name.setter
     def name(self, value: str):
-        data = request("SetEntityName", params=[self._id_str(), value])
-        response = self._interface(data)
-        if not response.result:
-            raise Exception("Failed to set entity name")
-        self._name = value
+        self._update(self._name_change(value))
 
     @property
     def tags(self):
         return tuple(self._tags)
 
     def add_tag(self, tag: str):
-        data = request("AddTagToEntity", params=[self._id_str(), tag])
-        response = self._interface(data)
-        if not response.result:
-            raise Exception("Failed to add tag")
-        self._tags.append(tag)
+        self._update(self._add_tag_change(tag))
 
     def remove_tag(self, tag: str):
-        data = request("RemoveTagFromEntity", params=[self._id_str(), tag])
-        response = self._interface(data)
-        if not response.result:
-            raise Exception("Failed to remove tag")
-        self._tags.remove(tag)
+        self._update(self._remove_tag_change(tag))
 
     @property
     def origin(self) -> Xyr:
@@ -110,12 +165,7 @@ class ProjectItem:
 
     @origin.setter
     def origin(self, value: Xyr):
-        t = self._interface.convert_to_api(value)
-        data = request("SetEntityOrigin", params=[self._id_str(), t.x, t.y, t.r])
-        response = self._interface(data)
-        if not response.result:
-            raise Exception("Failed to set entity origin")
-        self._origin = value
+        self._update(self._origin_change(value))
 
     @property
     def origin_id(self) -> int:
@@ -123,33 +173,19 @@ class ProjectItem:
 
     @property
     def origin_parent(self) -> Optional[UUID]:
-        if self._origin_parent == UUID("00000000-0000-0000-0000-000000000000"):
+        if self._origin_parent == _NIL_UUID:
             return None
         return self._origin_parent
 
     @origin_parent.setter
     def origin_parent(self, value: Union[ProjectItem, UUID, None]):
-        if value is None:
-            value = UUID("00000000-0000-0000-0000-000000000000")
-        elif isinstance(value, ProjectItem):
-            value = value.id
-
-        data = request("SetEntityOriginParent", params=[self._id_str(), str(value)])
-        response = self._interface(data)
-        if not response.result:
-            raise Exception("Failed to set entity origin parent")
-        self._origin_parent = value
+        self._update(self._origin_parent_change(value))
 
     def zoom_to(self):
-        data = request("ZoomToEntity", params=[self._id_str()])
-        response = self._interface(data)
-        if not response.result:
-            raise Exception("Failed to zoom to entity")
+        self._interface.call_checked(self._zoom_request(), "Failed to zoom to entity")
 
     def delete(self):
-        data = request("DeleteEntity", params=[self._id_str()])
-        response = self._interface(data)
-        if not response.result:
-            raise Exception("Failed to delete entity")
+        self._interface.call_checked(self._delete_request(), "Failed to delete entity",
+                                     lambda: self._interface.entity_removed(self))
 
 
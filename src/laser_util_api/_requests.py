@@ -0,0 +1,123 @@
+""" Builders for the requests which both `ApiClient` and `AsyncApiClient` send, so that the two clients only differ in
+how they wait for the response and what they do with it locally """
+from pathlib import Path
+from typing import Union
+
+from jsonrpcclient import request
+
+from ._client_interface import ApiInterface
+
+
+# ==========================================================================================
+# Project
+# ==========================================================================================
+def project_name() -> dict:
+    return request("GetProjectName")
+
+
+def project_path() -> dict:
+    return request("GetProjectPath")
+
+
+def save_project_as(path: Union[Path, str]) -> dict:
+    return request("SaveProjectAs", params=(str(path),))
+
+
+def new_project() -> dict:
+    return request("CreateNewProject")
+
+
+def open_project(path: Union[Path, str]) -> dict:
+    return request("OpenProject", params=(str(path),))
+
+
+# ==========================================================================================
+# Work Settings
+# ==========================================================================================
+def material_options() -> dict:
+    return request("GetWorkSettingsMaterialOptions")
+
+
+def active_material() -> dict:
+    return request("GetWorkSettingsSelectedMaterial")
+
+
+def kerf() -> dict:
+    return request("GetWorkSettingsKerf")
+
+
+def set_kerf(interface: ApiInterface, value: float) -> dict:
+    return request("SetWorkSettingsKerf", params=[interface.convert_to_api(value)])
+
+
+def kerf_override() -> dict:
+    return request("GetWorkSettingsKerfOverride")
+
+
+def set_kerf_override(value: bool) -> dict:
+    return request("SetWorkSettingsKerfOverride", params=[value])
+
+
+def fonts() -> dict:
+    return request("GetWorkSettingsFonts")
+
+
+def find_font(id: int) -> dict:
+    return request("GetWorkSettingsFont", params=(id,))
+
+
+def create_font() -> dict:
+    return request("CreateWorkSettingsFont")
+
+
+def system_font_families() -> dict:
+    return request("GetSystemFontFamilies")
+
+
+# ==========================================================================================
+# Project Tree
+# ==========================================================================================
+def all_entities() -> dict:
+    return request("GetEntities")
+
+
+def find_entity(id: str) -> dict:
+    return request("FindEntity", params=(id,))
+
+
+def entities_with_tag(tag: str) -> dict:
+    return request("GetEntitiesByTag", params=(tag,))
+
+
+# ==========================================================================================
+# User Interface
+# ==========================================================================================
+def zoom_to_fit() -> dict:
+    return request("ZoomToFit")
+
+
+def zoom_to_bed() -> dict:
+    return request("ZoomToBed")
+
+
+# ==========================================================================================
+# Entity Creation and Scratch Workspace
+# ==========================================================================================
+def body_from_loop(loop_id: str) -> dict:
+    return request("CreateBodyEntityFromLoop", params=[loop_id])
+
+
+def body_from_body(body_id: str) -> dict:
+    return request("CreateBodyEntityFromBody", params=[body_id])
+
+
+def empty_etch() -> dict:
+    return request("CreateEtchEntityEmpty")
+
+
+def clear_loops() -> dict:
+    return request("LoopsClearAll")
+
+
+def create_scratch_body(loop_id: str) -> dict:
+    return request("BodyCreate", params=(loop_id,))
@@ -0,0 +1,302 @@
+from __future__ import annotations
+import heapq
+import math
+from typing import Callable, Hashable, Iterator, Optional
+from uuid import UUID
+
+from jsonrpcclient import request
+
+from ._client_interface import ApiInterface
+from ._entity_table import EntityTable
+from .vector import Aabb, Vector
+
+# An entry spanning more than this many grid cells is kept in a separate list which every query checks, rather than
+# being registered in each cell
+_MAX_CELLS_PER_ENTRY = 64
+
+
+class SpatialIndex:
+    """ Uniform grid over a set of bounding boxes, so that finding the boxes which overlap a region, contain a point,
+    or are nearest to a point only examines the entries in the nearby grid cells rather than every entry. Entries are
+    stored under a hashable key, and the queries return keys.
+
+    The cell size is chosen from the sizes of the boxes the index is built with, unless one is given. Entries can be
+    inserted and removed at any time without rebuilding the grid. """
+
+    def __init__(self, cell_size: Optional[float] = None):
+        self.cell_size = cell_size
+        self._boxes: dict[Hashable, Aabb] = {}
+        self._cells: dict[tuple[int, int], set] = {}
+        self._span: dict[Hashable, tuple[int, int, int, int]] = {}
+        self._oversized: set = set()
+
+        # Range of cell indices which have ever been occupied, as (min i, min j, max i, max j)
+        self._extent: Optional[tuple[int, int, int, int]] = None
+
+    @staticmethod
+    def from_boxes(boxes: dict[Hashable, Aabb], cell_size: Optional[float] = None) -> SpatialIndex:
+        index = SpatialIndex(cell_size)
+        if index.cell_size is None:
+            index.cell_size = _pick_cell_size(boxes.values())
+        for key, box in boxes.items():
+            index.insert(key, box)
+        return index
+
+    def __len__(self):
+        return len(self._boxes)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._boxes
+
+    def __iter__(self) -> Iterator[Hashable]:
+        return iter(self._boxes)
+
+    def box(self, key: Hashable) -> Aabb:
+        return self._boxes[key]
+
+    def insert(self, key: Hashable, box: Aabb):
+        """ Add an entry, replacing any existing entry with the same key """
+        if key in self._boxes:
+            self.remove(key)
+        if self.cell_size is None:
+            self.cell_size = _pick_cell_size([box])
+
+        self._boxes[key] = box
+        span = self._cell_span(box)
+        x0, y0, x1, y1 = span
+        if (x1 - x0 + 1) * (y1 - y0 + 1) > _MAX_CELLS_PER_ENTRY:
+            self._oversized.add(key)
+            return
+
+        self._span[key] = span
+        if self._extent is None:
+            self._extent = span
+        else:
+            e = self._extent
+            self._extent = (min(e[0], x0), min(e[1], y0), max(e[2], x1), max(e[3], y1))
+        for i in range(x0, x1 + 1):
+            for j in range(y0, y1 + 1):
+                self._cells.setdefault((i, j), set()).add(key)
+
+    def remove(self, key: Hashable):
+        """ Remove an entry, doing nothing if it isn't in the index """
+        if self._boxes.pop(key, None) is None:
+            return
+
+        span = self._span.pop(key, None)
+        if span is None:
+            self._oversized.discard(key)
+            return
+
+        x0, y0, x1, y1 = span
+        for i in range(x0, x1 + 1):
+            for j in range(y0, y1 + 1):
+                cell = self._cells[(i, j)]
+                cell.discard(key)
+                if not cell:
+                    del self._cells[(i, j)]
+
+    def clear(self):
+        self._boxes = {}
+        self._cells = {}
+        self._span = {}
+        self._oversized = set()
+        self._extent = None
+
+    def overlapping(self, region: Aabb) -> list[Hashable]:
+        """ Find the keys of every entry whose box touches or overlaps the region """
+        return [key for key in self._candidates(region) if self._boxes[key].intersects(region)]
+
+    def intersects_any(self, region: Aabb, ignore: tuple = ()) -> bool:
+        """ Check whether any entry's box touches or overlaps the region, such as to test a candidate placement for a
+        collision. Entries whose keys are in `ignore` are skipped. """
+        return any(key not in ignore and self._boxes[key].intersects(region) for key in self._candidates(region))
+
+    def containing(self, point: Vector) -> list[Hashable]:
+        """ Find the keys of every entry whose box contains the point """
+        candidates = self._cells.get(self._cell_of(point.x, point.y), set()) | self._oversized
+        return [key for key in candidates if self._boxes[key].intersects(point)]
+
+    def nearest(self, point: Vector, k: int = 1) -> list[tuple[Hashable, float]]:
+        """ Find the `k` entries whose boxes are closest to the point, as (key, distance) pairs in order of
+        increasing distance. A point inside a box is at distance zero from it. """
+        if k <= 0 or not self._boxes:
+            return []
+
+        found: list[tuple[float, int, Hashable]] = []
+        seen = set()
+        counter = 0
+
+        def consider(keys):
+            nonlocal counter
+            for key in keys:
+                if key in seen:
+                    continue
+                seen.add(key)
+                counter += 1
+                heapq.heappush(found, (-self._boxes[key].closest_distance(point), counter, key))
+                if len(found) > k:
+                    heapq.heappop(found)
+
+        consider(self._oversized)
+
+        # Search rings of cells around the point's cell. Anything not seen by the end of ring r is more than r cells
+        # away, so the search stops once k entries are known to be closer than that.
+        ci, cj = self._cell_of(point.x, point.y)
+        limit = self._ring_limit(ci, cj)
+        ring = 0
+        while ring <= limit:
+            for cell in _ring_cells(ci, cj, ring):
+                keys = self._cells.get(cell)
+                if keys:
+                    consider(keys)
+            if len(found) >= k and -found[0][0] <= ring * self.cell_size:
+                break
+            ring += 1
+
+        return [(key, float(-neg)) for neg, _, key in sorted(found, reverse=True)]
+
+    # Internal
+    # ==========================================================================================
+    def _cell_of(self, x: float, y: float) -> tuple[int, int]:
+        return math.floor(x / self.cell_size), math.floor(y / self.cell_size)
+
+    def _cell_span(self, box: Aabb) -> tuple[int, int, int, int]:
+        x0, y0 = self._cell_of(box.min_bound.x, box.min_bound.y)
+        x1, y1 = self._cell_of(box.max_bound.x, box.max_bound.y)
+        return x0, y0, x1, y1
+
+    def _candidates(self, region: Aabb) -> set:
+        if not self._boxes:
+            return set()
+
+        x0, y0, x1, y1 = self._cell_span(region)
+        if (x1 - x0 + 1) * (y1 - y0 + 1) > len(self._cells):
+            # The region covers more cells than are occupied, so it's cheaper to walk the occupied ones
+            found = set(self._oversized)
+            for (i, j), keys in self._cells.items():
+                if x0 <= i <= x1 and y0 <= j <= y1:
+                    found.update(keys)
+            return found
+
+        found = set(self._oversized)
+        for i in range(x0, x1 + 1):
+            for j in range(y0, y1 + 1):
+                keys = self._cells.get((i, j))
+                if keys:
+                    found.update(keys)
+        return found
+
+    def _ring_limit(self, ci: int, cj: int) -> int:
+        """ The ring at which every occupied cell has been visited """
+        if self._extent is None:
+            return 0
+        x0, y0, x1, y1 = self._extent
+        return max(ci - x0, x1 - ci, cj - y0, y1 - cj, 0)
+
+
+class EntitySpatialIndex(SpatialIndex):
+    """ Spatial index over the bounds of the project's entities, keyed by entity UUID. It is built from a snapshot of
+    the project tree and registers itself as a listener on the interface, so that entities created or deleted by this
+    client are inserted and removed as it happens. An entity moved by the client, such as by setting its origin or
+    adding etch items, has its bounds re-fetched from the server before the next query. Changes made by anything other
+    than this client are only seen after `rebuild()`. """
+
+    def __init__(self, interface: ApiInterface, snapshot: Callable[[], EntityTable], cell_size: Optional[float] = None):
+        super().__init__(cell_size)
+        self._interface = interface
+        self._snapshot = snapshot
+        self._fixed_cell_size = cell_size
+        self._loaded = False
+        self._stale: set[UUID] = set()
+
+    def rebuild(self):
+        """ Rebuild the index from a fresh snapshot of the project tree """
+        table = self._snapshot()
+        boxes = {UUID(id_str): Aabb(Vector(b[0], b[1]), Vector(b[2], b[3]))
+                 for id_str, b in zip(table.ids, table.bounds.tolist())}
+
+        self.clear()
+        self.cell_size = self._fixed_cell_size or _pick_cell_size(boxes.values())
+        for key, box in boxes.items():
+            self.insert(key, box)
+        self._stale = set()
+        self._loaded = True
+
+    def __len__(self):
+        self._ensure_current()
+        return super().__len__()
+
+    def overlapping(self, region: Aabb) -> list[UUID]:
+        self._ensure_current()
+        return super().overlapping(region)
+
+    def intersects_any(self, region: Aabb, ignore: tuple = ()) -> bool:
+        self._ensure_current()
+        return super().intersects_any(region, ignore)
+
+    def containing(self, point: Vector) -> list[UUID]:
+        self._ensure_current()
+        return super().containing(point)
+
+    def nearest(self, point: Vector, k: int = 1) -> list[tuple[UUID, float]]:
+        self._ensure_current()
+        return super().nearest(point, k)
+
+    # Entity listener methods
+    # ==========================================================================================
+    def entity_added(self, item):
+        if self._loaded:
+            self.insert(item.id, item.aabb)
+
+    def entity_changed(self, item, geometry: bool):
+        if self._loaded and geometry:
+            self._stale.add(item.id)
+
+    def entity_removed(self, item):
+        if self._loaded:
+            self.remove(item.id)
+            self._stale.discard(item.id)
+
+    def entities_reset(self):
+        self.clear()
+        self._stale = set()
+        self._loaded = False
+
+    # Internal
+    # ==========================================================================================
+    def _ensure_current(self):
+        if not self._loaded:
+            self.rebuild()
+            return
+        if not self._stale:
+            return
+
+        stale = list(self._stale)
+        self._stale = set()
+        results = self._interface.call_batch([request("FindEntity", params=(str(key),)) for key in stale])
+        for key, values in zip(stale, results):
+            b = values["Bounds"]
+            self.insert(key, Aabb(self._interface.convert_from_api(Vector(b["MinX"], b["MinY"])),
+                                  self._interface.convert_from_api(Vector(b["MaxX"], b["MaxY"]))))
+
+
+def _pick_cell_size(boxes) -> float:
+    """ Use the median of the larger side of each box, so that a typical entry falls in one to four cells """
+    sizes = sorted(max(b.max_bound.x - b.min_bound.x, b.max_bound.y - b.min_bound.y) for b in boxes)
+    sizes = [s for s in sizes if s > 0]
+    if not sizes:
+        return 1.0
+    return sizes[len(sizes) // 2]
+
+
+def _ring_cells(ci: int, cj: int, ring: int) -> Iterator[tuple[int, int]]:
+    if ring == 0:
+        yield ci, cj
+        return
+    for i in range(ci - ring, ci + ring + 1):
+        yield i, cj - ring
+        yield i, cj + ring
+    for j in range(cj - ring + 1, cj + ring):
+        yield ci - ring, j
+        yield ci + ring, j
@@ -0,0 +1,248 @@
+from __future__ import annotations
+from bisect import bisect_left
+from typing import Optional
+from uuid import UUID
+
+from jsonrpcclient import request
+
+from ._client_interface import ApiInterface
+from ._lazy_entities import LazyEntity, LazyEntityList
+from ._project_items import ProjectItem
+
+
+class TreeCache:
+    """ Client-side copy of the project tree, holding the project's entities indexed by UUID, by position, by tag, by
+    name, and by type, plus a sorted list of UUID strings for prefix searches, so that repeated lookups don't require
+    any traffic with the server. Entities are kept as the raw values returned by the server and are only turned into
+    `ProjectItem` objects when they are looked up.
+
+    The cache registers itself as a listener on the interface so that changes made by this client (setting
+    properties, adding or removing tags, deleting items, creating bodies and etches, opening a new project) are
+    applied to it directly. Changes which move an entity on the server, such as setting its origin or adding etch
+    items, mark it as stale and it is re-fetched by itself the next time it is looked up. Changes made by anything
+    other than this client, such as edits in the user interface, are only seen after `refresh()`.
+
+    The entities are stored in a dict by UUID, which keeps them in project order, so that each change made by the
+    client is applied in constant time. The list used for lookups by position and the sorted UUID strings are rebuilt
+    the next time they're needed after an entity is added or removed, so a run of changes pays for that once. """
+
+    def __init__(self, interface: ApiInterface):
+        self._interface = interface
+        self._loaded = False
+        self._by_id: dict[str, LazyEntity] = {}
+        self._by_tag: dict[str, dict[str, LazyEntity]] = {}
+        self._by_name: dict[str, dict[str, LazyEntity]] = {}
+        self._by_type: dict[str, dict[str, LazyEntity]] = {}
+        self._keys_of: dict[str, tuple] = {}
+        self._ordered: Optional[list[LazyEntity]] = None
+        self._sorted_ids: Optional[list[str]] = None
+        self._stale: set[str] = set()
+
+    @property
+    def loaded(self) -> bool:
+        return self._loaded
+
+    def refresh(self):
+        """ Fetch the full project tree from the server and rebuild every index """
+        response = self._interface(request("GetEntities"))
+        self._set_entries([LazyEntity(values, self._interface) for values in response.result])
+
+    def invalidate(self):
+        """ Drop the cached tree, so that it is fetched again on the next lookup """
+        self._loaded = False
+        self._by_id = {}
+        self._by_tag = {}
+        self._by_name = {}
+        self._by_type = {}
+        self._keys_of = {}
+        self._ordered = None
+        self._sorted_ids = None
+        self._stale = set()
+
+    def items(self) -> LazyEntityList:
+        self._ensure_loaded()
+        self._refresh_stale()
+        return LazyEntityList(list(self._by_id.values()))
+
+    def __len__(self):
+        self._ensure_loaded()
+        return len(self._by_id)
+
+    def at(self, index: int) -> ProjectItem:
+        self._ensure_loaded()
+        if self._ordered is None:
+            self._ordered = list(self._by_id.values())
+        return self._fresh(self._ordered[index])
+
+    def by_id(self, id: UUID) -> Optional[ProjectItem]:
+        self._ensure_loaded()
+        entry = self._by_id.get(str(id))
+        return None if entry is None else self._fresh(entry)
+
+    def with_tag(self, tag: str) -> list[ProjectItem]:
+        self._ensure_loaded()
+        return [self._fresh(entry) for entry in self._by_tag.get(tag, {}).values()]
+
+    def with_prefix(self, prefix: str) -> list[ProjectItem]:
+        """ Find every item whose UUID string starts with the prefix, in UUID order """
+        return [self._fresh(entry) for entry in self._prefix_entries(prefix)]
+
+    def find(self, name: Optional[str] = None, type: Optional[str] = None, tag: Optional[str] = None,
+             prefix: Optional[str] = None) -> list[ProjectItem]:
+        """ Find the items matching every one of the given criteria """
+        self._ensure_loaded()
+
+        candidates = []
+        if name is not None:
+            candidates.append(self._by_name.get(name, {}))
+        if type is not None:
+            candidates.append(self._by_type.get(type, {}))
+        if tag is not None:
+            candidates.append(self._by_tag.get(tag, {}))
+        if prefix is not None:
+            candidates.append({entry.id_str: entry for entry in self._prefix_entries(prefix)})
+
+        if not candidates:
+            return list(self.items())
+
+        # Walk the smallest of the matching index entries and check membership in the others
+        candidates.sort(key=len)
+        smallest, others = candidates[0], candidates[1:]
+        return [self._fresh(entry) for id_str, entry in smallest.items() if all(id_str in o for o in others)]
+
+    # Entity listener methods
+    # ==========================================================================================
+    def entity_added(self, item: ProjectItem):
+        if not self.loaded:
+            return
+
+        id_str = str(item.id)
+        if id_str in self._by_id:
+            self.entity_changed(item, False)
+            return
+
+        entry = LazyEntity.of(item)
+        self._by_id[id_str] = entry
+        self._ordered = None
+        self._sorted_ids = None
+        self._index(entry)
+
+    def entity_changed(self, item: ProjectItem, geometry: bool):
+        if not self.loaded:
+            return
+
+        id_str = str(item.id)
+        cached = self._by_id.get(id_str)
+        if cached is None:
+            # Not known to this snapshot, so the snapshot can't be trusted to be complete
+            self.invalidate()
+            return
+
+        if not cached.materialized or cached.item is not item:
+            # A different instance for the same entity was modified, and it now holds the newest known state.
+            # Replacing the value keeps the entity's place in the dict's order.
+            entry = LazyEntity.of(item)
+            self._by_id[id_str] = entry
+            self._ordered = None
+            cached = entry
+
+        self._unindex(id_str)
+        self._index(cached)
+        if geometry:
+            self._stale.add(id_str)
+
+    def entity_removed(self, item: ProjectItem):
+        if not self.loaded:
+            return
+
+        id_str = str(item.id)
+        cached = self._by_id.pop(id_str, None)
+        if cached is None:
+            return
+        self._ordered = None
+        self._sorted_ids = None
+        self._unindex(id_str)
+        self._stale.discard(id_str)
+
+    def entities_reset(self):
+        self.invalidate()
+
+    # Internal
+    # ==========================================================================================
+    def _ensure_loaded(self):
+        if not self._loaded:
+            self.refresh()
+
+    def _set_entries(self, entries: list[LazyEntity]):
+        self.invalidate()
+        self._loaded = True
+        for entry in entries:
+            self._by_id[entry.id_str] = entry
+            self._index(entry)
+
+    def _prefix_entries(self, prefix: str) -> list[LazyEntity]:
+        self._ensure_loaded()
+        if self._sorted_ids is None:
+            self._sorted_ids = sorted(self._by_id)
+        sorted_ids = self._sorted_ids
+        prefix = prefix.lower()
+        found = []
+        i = bisect_left(sorted_ids, prefix)
+        while i < len(sorted_ids) and sorted_ids[i].startswith(prefix):
+            found.append(self._by_id[sorted_ids[i]])
+            i += 1
+        return found
+
+    def _index(self, entry: LazyEntity):
+        id_str = entry.id_str
+        keys = (entry.name, entry.type_name, entry.tags)
+        self._keys_of[id_str] = keys
+        self._by_name.setdefault(keys[0], {})[id_str] = entry
+        self._by_type.setdefault(keys[1], {})[id_str] = entry
+        for tag in keys[2]:
+            self._by_tag.setdefault(tag, {})[id_str] = entry
+
+    def _unindex(self, id_str: str):
+        keys = self._keys_of.pop(id_str, None)
+        if keys is None:
+            return
+
+        name, type_name, tags = keys
+        _discard(self._by_name, name, id_str)
+        _discard(self._by_type, type_name, id_str)
+        for tag in tags:
+            _discard(self._by_tag, tag, id_str)
+
+    def _reload(self, entry: LazyEntity, values: dict):
+        entry.reload(values)
+        self._unindex(entry.id_str)
+        self._index(entry)
+
+    def _fresh(self, entry: LazyEntity) -> ProjectItem:
+        """ Get an entry's item, first re-fetching it in place if a change made by the client has altered it on the
+        server """
+        id_str = entry.id_str
+        if id_str in self._stale:
+            self._stale.discard(id_str)
+            response = self._interface(request("FindEntity", params=(id_str,)))
+            self._reload(entry, response.result)
+        return entry.item
+
+    def _refresh_stale(self):
+        """ Re-fetch every stale item in a single batch """
+        if not self._stale:
+            return
+
+        stale = [self._by_id[id_str] for id_str in self._stale]
+        self._stale = set()
+        results = self._interface.call_batch([request("FindEntity", params=(e.id_str,)) for e in stale])
+        for entry, values in zip(stale, results):
+            self._reload(entry, values)
+
+
+def _discard(index: dict[str, dict[str, LazyEntity]], key: str, id_str: str):
+    entries = index.get(key)
+    if entries is not None:
+        entries.pop(id_str, None)
+        if not entries:
+            del index[key]
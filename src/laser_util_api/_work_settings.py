@@ -31,10 +31,12 @@ class MaterialOption:
         t = self._rpc.convert_from_api(self._thickness)
         return f"[{self.category}, {self._material}, {t:0.3}{suffix}]"
 
+    def _activate_request(self) -> dict:
+        return request("SetWorkSettingsSelectedMaterial", params=(self._key,))
+
     def set_active(self):
-        data = request("SetWorkSettingsSelectedMaterial", params=(self._key,))
-        response = self._rpc(data)
-        return response.result
+        response = self._rpc(self._activate_request())
+        return self._rpc.result(response)
 
 
 class FontOption:
@@ -51,14 +53,22 @@ class FontOption:
     def __repr__(self):
         return f"[Font ID={self.id} {self._family}, {self._size}]"
 
+    def _family_request(self, value: str) -> dict:
+        return request("SetWorkSettingsFontFamily", params=(self.id, value))
+
+    def _size_request(self, value: float) -> dict:
+        return request("SetWorkSettingsFontSize", params=(self.id, value))
+
+    def _delete_request(self) -> dict:
+        return request("RemoveWorkSettingsFont", params=(self.id,))
+
     @property
     def family(self) -> str:
         return self._family
 
     @family.setter
     def family(self, value: str):
-        data = request("SetWorkSettingsFontFamily", params=(self.id, value))
-        response = self._rpc(data)
+        response = self._rpc(self._family_request(value))
 
     @property
     def size(self) -> float:
@@ -66,9 +76,7 @@ class FontOption:
 
     @size.setter
     def size(self, value: float):
-        data = request("SetWorkSettingsFontSize", params=(self.id, value))
-        response = self._rpc(data)
+        response = self._rpc(self._size_request(value))
 
     def delete(self):
-        data = request("RemoveWorkSettingsFont", params=(self.id,))
-        response = self._rpc(data)
\ No newline at end of file
+        response = self._rpc(self._delete_request())
\ No newline at end of file
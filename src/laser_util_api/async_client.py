@@ -0,0 +1,327 @@
+import asyncio
+from collections import OrderedDict
+from pathlib import Path
+from typing import Optional, Union
+
+from jsonrpcclient import parse, Error, Ok
+
+from ._common import is_uuid, UUID
+from ._client_interface import AsyncApiInterface, UnexpectedResponseError, RpcError
+from ._async_items import (AsyncProjectItem, AsyncEtchItem, AsyncMaterialOption, AsyncFontOption, AsyncLoopHandle,
+                           AsyncBodyHandle, AsyncLoopScratchPad, AsyncBodyScratchPad, create_async_entity)
+from .vector import Units
+from ._codec import JsonCodec, get_codec
+from . import _requests
+from ._chunking import ChunkedSender
+
+# Large enough for a full GetEntities response on a big project to arrive as a single line
+_STREAM_LIMIT = 2 ** 28
+
+# Number of abandoned request ids remembered so that a late response to one is skipped instead of being treated as
+# unexpected
+_ABANDONED_LIMIT = 1024
+
+
+# ==========================================================================================
+# Body and Loop Scratch Workspace
+# ==========================================================================================
+class AsyncScratchPad:
+    def __init__(self, interface: AsyncApiInterface):
+        self.loops = AsyncLoopScratchPad(interface)
+        self.bodies = AsyncBodyScratchPad(interface)
+
+
+# ==========================================================================================
+# High-level Project Methods
+# ==========================================================================================
+class AsyncProjectCommands:
+    def __init__(self, interface: AsyncApiInterface):
+        self._rpc = interface
+
+    async def name(self) -> str:
+        response = await self._rpc(_requests.project_name())
+        return response.result
+
+    async def path(self) -> str:
+        response = await self._rpc(_requests.project_path())
+        return response.result
+
+    async def save_as(self, path: Union[Path, str]):
+        response = await self._rpc(_requests.save_project_as(path))
+        return response.result
+
+    async def new(self):
+        response = await self._rpc(_requests.new_project())
+        self._rpc.entities_reset()
+        return response.result
+
+    async def open(self, path: Union[Path, str]):
+        response = await self._rpc(_requests.open_project(path))
+        self._rpc.entities_reset()
+        return response.result
+
+
+# ==========================================================================================
+# WorkSettings Methods
+# ==========================================================================================
+class AsyncWorkSettingsCommands:
+    def __init__(self, interface: AsyncApiInterface):
+        self._rpc = interface
+
+    async def material_options(self) -> list[AsyncMaterialOption]:
+        response = await self._rpc(_requests.material_options())
+        return [AsyncMaterialOption(item, self._rpc) for item in response.result]
+
+    async def active_material(self) -> AsyncMaterialOption:
+        response = await self._rpc(_requests.active_material())
+        return AsyncMaterialOption(response.result, self._rpc)
+
+    async def kerf(self) -> float:
+        response = await self._rpc(_requests.kerf())
+        return self._rpc.convert_from_api(response.result)
+
+    async def set_kerf(self, value: float):
+        await self._rpc.call_checked(_requests.set_kerf(self._rpc, value), "Failed to set kerf")
+
+    async def kerf_override(self) -> bool:
+        response = await self._rpc(_requests.kerf_override())
+        return response.result
+
+    async def set_kerf_override(self, value: bool):
+        await self._rpc.call_checked(_requests.set_kerf_override(value), "Failed to set kerf override")
+
+    async def fonts(self) -> list[AsyncFontOption]:
+        response = await self._rpc(_requests.fonts())
+        return [AsyncFontOption(item, self._rpc) for item in response.result]
+
+    async def find_font(self, id: int) -> AsyncFontOption:
+        response = await self._rpc(_requests.find_font(id))
+        return AsyncFontOption(response.result, self._rpc)
+
+    async def create_font(self) -> AsyncFontOption:
+        response = await self._rpc(_requests.create_font())
+        return AsyncFontOption(response.result, self._rpc)
+
+    async def get_system_font_families(self) -> list[str]:
+        response = await self._rpc(_requests.system_font_families())
+        return response.result
+
+
+# ==========================================================================================
+# Project Tree/Entity Methods
+# ==========================================================================================
+class AsyncTreeCommands:
+    def __init__(self, interface: AsyncApiInterface):
+        self._rpc = interface
+
+    async def get(self, key: Union[int, str, UUID]) -> AsyncProjectItem:
+        """ Find an entity by position, UUID, or UUID prefix, the same way as indexing `ApiClient.tree` """
+        if isinstance(key, int):
+            return (await self.all())[key]
+
+        if isinstance(key, UUID):
+            return await self.by_id(str(key))
+
+        if isinstance(key, str):
+            if is_uuid(key):
+                return await self.by_id(key)
+
+            for item in await self.all():
+                if str(item.id).startswith(key):
+                    return item
+
+        raise ValueError("key must be an integer, UUID, or string")
+
+    async def all(self) -> list[AsyncProjectItem]:
+        """ Get all entities in the project """
+        response = await self._rpc(_requests.all_entities())
+        return [create_async_entity(item, self._rpc) for item in response.result]
+
+    async def by_id(self, id: str) -> AsyncProjectItem:
+        """ Find an entity by its ID """
+        response = await self._rpc(_requests.find_entity(id))
+        return create_async_entity(response.result, self._rpc)
+
+    async def with_tag(self, tag: str) -> list[AsyncProjectItem]:
+        """ Find all entities with a specific tag """
+        response = await self._rpc(_requests.entities_with_tag(tag))
+        return [create_async_entity(item, self._rpc) for item in response.result]
+
+
+# ==========================================================================================
+# User Interface Methods
+# ==========================================================================================
+class AsyncUiCommands:
+    def __init__(self, interface: AsyncApiInterface):
+        self._rpc = interface
+
+    async def zoom_to_fit(self):
+        response = await self._rpc(_requests.zoom_to_fit())
+        return response.result
+
+    async def zoom_to_bed(self):
+        response = await self._rpc(_requests.zoom_to_bed())
+        return response.result
+
+
+# ==========================================================================================
+# Entity Creation
+# ==========================================================================================
+class AsyncCreationCommands:
+    def __init__(self, interface: AsyncApiInterface):
+        self._rpc = interface
+
+    async def body(self, source: Union[AsyncLoopHandle, AsyncBodyHandle]) -> AsyncProjectItem:
+        if isinstance(source, AsyncLoopHandle):
+            data = _requests.body_from_loop(source.id)
+        elif isinstance(source, AsyncBodyHandle):
+            data = _requests.body_from_body(source.id)
+        else:
+            raise ValueError("source must be an AsyncLoopHandle or AsyncBodyHandle")
+
+        response = await self._rpc(data)
+        item = AsyncProjectItem(response.result, self._rpc)
+        self._rpc.entity_added(item)
+        return item
+
+    async def etch(self) -> AsyncEtchItem:
+        response = await self._rpc(_requests.empty_etch())
+        item = AsyncEtchItem(response.result, self._rpc)
+        self._rpc.entity_added(item)
+        return item
+
+
+class AsyncApiClient:
+    """ Client for the Laser Utility API built on asyncio streams. It mirrors `ApiClient`, except that every method
+    which talks to the server is a coroutine, and property setters on returned objects are replaced by `set_*`
+    coroutines.
+
+    Requests from any number of concurrent tasks share the one connection. Responses are matched back to their
+    requests by JSON-RPC id, so calls made concurrently with `asyncio.gather` are all in flight at the same time. """
+
+    def __init__(self, port: int = 5000, host: str = "localhost", units=Units.MM,
+                 codec: Union[str, JsonCodec, None] = None, timeout: Optional[float] = None,
+                 chunking: Optional[ChunkedSender] = None):
+        self.port = port
+        self.host = host
+        self.units = units
+        self.timeout = timeout
+        self._reader: Optional[asyncio.StreamReader] = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._read_task: Optional[asyncio.Task] = None
+        self._connect_lock: Optional[asyncio.Lock] = None
+        self._in_flight: dict[object, asyncio.Future] = {}
+        self._abandoned: OrderedDict[object, None] = OrderedDict()
+        self.codec = codec if isinstance(codec, JsonCodec) else get_codec(codec)
+        self._interface = AsyncApiInterface(lambda: self.units, self._rpc, codec=self.codec)
+        self._interface.chunking = chunking
+
+        # Sub-interfaces
+        self.scratch = AsyncScratchPad(self._interface)
+        self.project = AsyncProjectCommands(self._interface)
+        self.tree = AsyncTreeCommands(self._interface)
+        self.create = AsyncCreationCommands(self._interface)
+        self.work_settings = AsyncWorkSettingsCommands(self._interface)
+        self.ui = AsyncUiCommands(self._interface)
+
+    @property
+    def chunking(self) -> Optional[ChunkedSender]:
+        """ The `ChunkedSender` used for large bulk requests, if any; see `ApiClient.chunking` """
+        return self._interface.chunking
+
+    @chunking.setter
+    def chunking(self, value: Optional[ChunkedSender]):
+        self._interface.chunking = value
+
+    async def __aenter__(self):
+        await self.connect()
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+
+    async def connect(self):
+        if self._connect_lock is None:
+            self._connect_lock = asyncio.Lock()
+
+        async with self._connect_lock:
+            if self._writer is None:
+                self._reader, self._writer = await asyncio.open_connection(self.host, self.port, limit=_STREAM_LIMIT)
+                self._read_task = asyncio.ensure_future(self._read_loop())
+
+    async def close(self):
+        if self._writer is None:
+            return
+
+        writer, self._writer = self._writer, None
+        self._read_task.cancel()
+        writer.close()
+        try:
+            await writer.wait_closed()
+        except ConnectionError:
+            pass
+        self._fail_in_flight(ConnectionError("Connection was closed"))
+
+    async def _rpc(self, request_data: dict) -> Ok:
+        if self._writer is None:
+            await self.connect()
+
+        request_id = request_data["id"]
+        future = asyncio.get_running_loop().create_future()
+        self._in_flight[request_id] = future
+        try:
+            self._writer.write(self.codec.encode_request(request_data) + b"\n")
+            await self._writer.drain()
+            if self.timeout is None:
+                return await future
+            return await asyncio.wait_for(future, self.timeout)
+        except asyncio.TimeoutError:
+            self._abandon(request_id)
+            raise TimeoutError(f"No response to {request_data['method']} within {self.timeout} s") from None
+        except BaseException:
+            # The write failed or the caller was cancelled, so nothing will wait for the response any more
+            self._abandon(request_id)
+            raise
+
+    def _abandon(self, request_id):
+        """ Stop waiting for a request, remembering its id for a while so that a late response to it is skipped """
+        if self._in_flight.pop(request_id, None) is not None:
+            self._abandoned[request_id] = None
+            if len(self._abandoned) > _ABANDONED_LIMIT:
+                self._abandoned.popitem(last=False)
+
+    async def _read_loop(self):
+        try:
+            while True:
+                line = await self._reader.readline()
+                if not line:
+                    raise ConnectionError("Connection closed by the server")
+
+                parsed = parse(self.codec.loads(line))
+                future = self._in_flight.pop(parsed.id, None)
+                if future is None:
+                    if parsed.id in self._abandoned:
+                        del self._abandoned[parsed.id]
+                        continue
+                    raise UnexpectedResponseError(f"Received a response for id {parsed.id!r}, which is not in flight")
+                if future.done():
+                    continue
+
+                if isinstance(parsed, Error):
+                    future.set_exception(RpcError.from_response(parsed))
+                else:
+                    future.set_result(parsed)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self._fail_in_flight(e)
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
+
+    def _fail_in_flight(self, error: Exception):
+        in_flight, self._in_flight = self._in_flight, {}
+        self._abandoned.clear()
+        for future in in_flight.values():
+            if not future.done():
+                future.set_exception(error)
@@ -1,20 +1,28 @@
 import socket
-import json
-import time
 from pathlib import Path
-from typing import Union
+from typing import Iterator, Optional, Union
 
 from ._common import is_uuid, UUID
 from ._etch_item import EtchItem
 from ._work_settings import MaterialOption, FontOption
 from .vector import Units
-from ._client_interface import ApiInterface
+from ._client_interface import ApiInterface, UnexpectedResponseError, RpcError
 from ._loop_workspace import LoopScratchPad, LoopHandle
 from ._body_workspace import BodyHandle, BodyScratchPad
 from ._item_factory import create_entity
-from jsonrpcclient import request, parse, Error, Ok
+from ._line_reader import LineReader
+from ._batch import RpcBatch
+from ._pipeline import RpcPipeline
+from ._codec import JsonCodec, get_codec
+from . import _requests
+from ._chunking import ChunkedSender
+from jsonrpcclient import parse, Error, Ok
 
 from ._project_items import ProjectItem
+from ._tree_cache import TreeCache
+from ._lazy_entities import LazyEntityList
+from ._entity_table import EntityTable
+from ._spatial_index import EntitySpatialIndex
 
 
 # ==========================================================================================
@@ -34,32 +42,27 @@ class ProjectCommands:
         self._rpc = interface
 
     def name(self) -> str:
-        data = request("GetProjectName")
-        response = self._rpc(data)
+        response = self._rpc(_requests.project_name())
         print(response)
         return response.result
 
     def path(self) -> str:
-        data = request("GetProjectPath")
-        response = self._rpc(data)
+        response = self._rpc(_requests.project_path())
         return response.result
 
     def save_as(self, path: Union[Path, str]):
-        data = request("SaveProjectAs", params=(str(path),))
-        response = self._rpc(data)
-        return response.result
+        response = self._rpc(_requests.save_project_as(path))
+        return self._rpc.result(response)
 
     def new(self):
-        data = request("CreateNewProject")
-        response = self._rpc(data)
-        return response.result
+        response = self._rpc(_requests.new_project())
+        self._rpc.entities_reset()
+        return self._rpc.result(response)
 
     def open(self, path: Union[Path, str]):
-        if isinstance(path, Path):
-            path = str(path)
-        data = request("OpenProject", params=(path,))
-        response = self._rpc(data)
-        return response.result
+        response = self._rpc(_requests.open_project(path))
+        self._rpc.entities_reset()
+        return self._rpc.result(response)
 
 
 # ==========================================================================================
@@ -70,59 +73,45 @@ class WorkSettingsCommands:
         self._rpc = interface
 
     def material_options(self) -> list[MaterialOption]:
-        data = request("GetWorkSettingsMaterialOptions")
-        response = self._rpc(data)
+        response = self._rpc(_requests.material_options())
         return [MaterialOption(item, self._rpc) for item in response.result]
 
     def active_material(self) -> MaterialOption:
-        data = request("GetWorkSettingsSelectedMaterial")
-        response = self._rpc(data)
+        response = self._rpc(_requests.active_material())
         return MaterialOption(response.result, self._rpc)
 
     @property
     def kerf(self) -> float:
-        data = request("GetWorkSettingsKerf")
-        response = self._rpc(data)
+        response = self._rpc(_requests.kerf())
         return self._rpc.convert_from_api(response.result)
 
     @kerf.setter
     def kerf(self, value: float):
-        data = request("SetWorkSettingsKerf", params=[self._rpc.convert_to_api(value)])
-        response = self._rpc(data)
-        if not response.result:
-            raise Exception("Failed to set kerf")
+        self._rpc.call_checked(_requests.set_kerf(self._rpc, value), "Failed to set kerf")
 
     @property
     def kerf_override(self) -> bool:
-        data = request("GetWorkSettingsKerfOverride")
-        response = self._rpc(data)
+        response = self._rpc(_requests.kerf_override())
         return response.result
 
     @kerf_override.setter
     def kerf_override(self, value: bool):
-        data = request("SetWorkSettingsKerfOverride", params=[value])
-        response = self._rpc(data)
-        if not response.result:
-            raise Exception("Failed to set kerf override")
+        self._rpc.call_checked(_requests.set_kerf_override(value), "Failed to set kerf override")
 
     def fonts(self) -> list[FontOption]:
-        data = request("GetWorkSettingsFonts")
-        response = self._rpc(data)
+        response = self._rpc(_requests.fonts())
         return [FontOption(item, self._rpc) for item in response.result]
 
     def find_font(self, id: int) -> FontOption:
-        data = request("GetWorkSettingsFont", params=(id,))
-        response = self._rpc(data)
+        response = self._rpc(_requests.find_font(id))
         return FontOption(response.result, self._rpc)
 
     def create_font(self) -> FontOption:
-        data = request("CreateWorkSettingsFont")
-        response = self._rpc(data)
+        response = self._rpc(_requests.create_font())
         return FontOption(response.result, self._rpc)
 
     def get_system_font_families(self) -> list[str]:
-        data = request("GetSystemFontFamilies")
-        response = self._rpc(data)
+        response = self._rpc(_requests.system_font_families())
         return response.result
 
 
@@ -132,12 +121,78 @@ class WorkSettingsCommands:
 class TreeCommands:
     def __init__(self, interface: ApiInterface):
         self._rpc = interface
+        self._cache: Optional[TreeCache] = None
+        self._spatial: Optional[EntitySpatialIndex] = None
+
+    @property
+    def cache_enabled(self) -> bool:
+        return self._cache is not None
+
+    def enable_cache(self):
+        """ Keep a client-side copy of the project tree, so that iterating, indexing, and finding items by tag don't
+        make a request each time. Changes made through this client are applied to the cache as they happen, but
+        changes made elsewhere (such as in the user interface) are only seen after calling `refresh()`. """
+        if self._cache is None:
+            self._cache = TreeCache(self._rpc)
+            self._rpc.entity_listeners.append(self._cache)
+
+    def disable_cache(self):
+        if self._cache is not None:
+            self._rpc.entity_listeners.remove(self._cache)
+            self._cache = None
+
+    def refresh(self):
+        """ Re-fetch the cached project tree from the server, and mark the spatial index to be rebuilt. Does nothing
+        if neither is enabled. """
+        if self._cache is not None:
+            self._cache.refresh()
+        if self._spatial is not None:
+            self._spatial.entities_reset()
+
+    @property
+    def spatial_index(self) -> Optional[EntitySpatialIndex]:
+        return self._spatial
+
+    def enable_spatial_index(self, cell_size: Optional[float] = None) -> EntitySpatialIndex:
+        """ Keep a spatial index over the bounds of the project's entities, keyed by UUID, for box, point, and
+        nearest-neighbor queries which don't need to check every entity. It is built from `table()` on the first query,
+        and entities created, moved, or deleted through this client are updated in it as they happen. Changes made
+        elsewhere are only seen after calling `refresh()`. """
+        if self._spatial is None:
+            self._spatial = EntitySpatialIndex(self._rpc, self.table, cell_size)
+            self._rpc.entity_listeners.append(self._spatial)
+        return self._spatial
+
+    def disable_spatial_index(self):
+        if self._spatial is not None:
+            self._rpc.entity_listeners.remove(self._spatial)
+            self._spatial = None
 
     def __iter__(self):
-        return _TreeIterator(self._all())
+        if self._cache is not None:
+            return iter(self._cache.items())
+        return iter(self._all())
+
+    def stream(self) -> Iterator[ProjectItem]:
+        """ Iterate over the project's entities, materializing each project item only as it's reached. The response
+        is still decoded in one step with the client's codec; what's saved is building a project item for every entity,
+        so a scan of a very large project which stops early only pays for the items it looked at. With the tree cache
+        enabled this is the same as iterating over the tree. """
+        if self._cache is not None:
+            yield from self._cache.items()
+            return
+
+        yield from self._all()
+
+    def __len__(self):
+        if self._cache is not None:
+            return len(self._cache)
+        return len(self._all())
 
     def __getitem__(self, key: Union[int, str, UUID]):
         if isinstance(key, int):
+            if self._cache is not None:
+                return self._cache.at(key)
             return self._all()[key]
 
         if isinstance(key, UUID):
@@ -147,45 +202,64 @@ class TreeCommands:
             if is_uuid(key):
                 return self._by_id(key)
 
-            for item in self._all():
-                if str(item.id).startswith(key):
-                    return item
+            if self._cache is not None:
+                found = self._cache.with_prefix(key)
+                if found:
+                    return found[0]
+            else:
+                for item in self._all():
+                    if str(item.id).startswith(key):
+                        return item
 
         raise ValueError("key must be an integer, UUID, or string")
 
-    def _all(self) -> list[ProjectItem]:
-        """ Get all entities in the project """
-        data = request("GetEntities")
-        response = self._rpc(data)
-        return [create_entity(item, self._rpc) for item in response.result]
+    def find(self, name: Optional[str] = None, type: Optional[str] = None, tag: Optional[str] = None,
+             prefix: Optional[str] = None) -> list[ProjectItem]:
+        """ Find all entities matching every one of the given criteria.
+        :param name: The exact name of the entity
+        :param type: The entity type name, such as "Body" or "Etch"
+        :param tag: A tag the entity must have
+        :param prefix: The start of the entity's UUID string
+
+        With the tree cache enabled, this is answered from indexes built once per snapshot of the tree. Otherwise the
+        tree is fetched once and indexed for this call. """
+        cache = self._cache
+        if cache is None:
+            cache = TreeCache(self._rpc)
+        return cache.find(name=name, type=type, tag=tag, prefix=prefix)
+
+    def table(self) -> EntityTable:
+        """ Get a columnar snapshot of every entity in the project, with the bounds and origins held in NumPy arrays
+        for vectorized queries over the whole tree. With the tree cache enabled this is built from the cache,
+        otherwise the tree is fetched once. Entities are not turned into project items to build it. """
+        if self._cache is not None:
+            entries = self._cache.items().entries()
+        else:
+            entries = self._all().entries()
+        return EntityTable.from_entries(entries, self._rpc.get_units())
+
+    def _all(self) -> LazyEntityList:
+        """ Get all entities in the project, which are only turned into project items as they are accessed """
+        response = self._rpc(_requests.all_entities())
+        return LazyEntityList.from_raw(response.result, self._rpc)
 
     def _by_id(self, id: str) -> ProjectItem:
         """ Find an entity by its ID """
-        data = request("FindEntity", params=(id,))
-        response = self._rpc(data)
+        if self._cache is not None:
+            item = self._cache.by_id(UUID(id))
+            if item is not None:
+                return item
+
+        response = self._rpc(_requests.find_entity(id))
         return create_entity(response.result, self._rpc)
 
     def with_tag(self, tag: str) -> list[ProjectItem]:
         """ Find all entities with a specific tag """
-        data = request("GetEntitiesByTag", params=(tag,))
-        response = self._rpc(data)
-        return [create_entity(item, self._rpc) for item in response.result]
+        if self._cache is not None:
+            return self._cache.with_tag(tag)
 
-
-class _TreeIterator:
-    def __init__(self, items: list[ProjectItem]):
-        self._items = items
-        self._index = 0
-
-    def __iter__(self):
-        return self
-
-    def __next__(self):
-        if self._index >= len(self._items):
-            raise StopIteration
-        item = self._items[self._index]
-        self._index += 1
-        return item
+        response = self._rpc(_requests.entities_with_tag(tag))
+        return [create_entity(item, self._rpc) for item in response.result]
 
 
 # ==========================================================================================
@@ -197,14 +271,12 @@ class UiCommands:
         self._rpc = interface
 
     def zoom_to_fit(self):
-        data = request("ZoomToFit")
-        response = self._rpc(data)
-        return response.result
+        response = self._rpc(_requests.zoom_to_fit())
+        return self._rpc.result(response)
 
     def zoom_to_bed(self):
-        data = request("ZoomToBed")
-        response = self._rpc(data)
-        return response.result
+        response = self._rpc(_requests.zoom_to_bed())
+        return self._rpc.result(response)
 
 
 # ==========================================================================================
@@ -216,28 +288,45 @@ class CreationCommands:
 
     def body(self, source: Union[LoopHandle, BodyHandle]) -> ProjectItem:
         if isinstance(source, LoopHandle):
-            data = request("CreateBodyEntityFromLoop", params=[source.id])
+            data = _requests.body_from_loop(source.id)
         elif isinstance(source, BodyHandle):
-            data = request("CreateBodyEntityFromBody", params=[source.id])
+            data = _requests.body_from_body(source.id)
         else:
             raise ValueError("source must be a LoopHandle or BodyHandle")
 
         response = self._rpc(data)
-        return ProjectItem(response.result, self._rpc)
+        item = ProjectItem(response.result, self._rpc)
+        self._rpc.entity_added(item)
+        return item
 
     def etch(self) -> EtchItem:
-        data = request("CreateEtchEntityEmpty")
-        response = self._rpc(data)
-        return EtchItem(response.result, self._rpc)
+        response = self._rpc(_requests.empty_etch())
+        item = EtchItem(response.result, self._rpc)
+        self._rpc.entity_added(item)
+        return item
 
 
 class ApiClient:
-    def __init__(self, port: int = 5000, host: str = "localhost", units=Units.MM):
+    def __init__(self, port: int = 5000, host: str = "localhost", units=Units.MM,
+                 codec: Union[str, JsonCodec, None] = None, timeout: Optional[float] = None,
+                 chunking: Optional[ChunkedSender] = None):
+        """ Create a client for the Laser Utility instance listening on the given port. The `codec` is the JSON
+        library used to encode requests and decode responses; by default the fastest one installed is used, trying
+        orjson, then ujson, then the standard library. If a `timeout` in seconds is given, a request which isn't
+        answered in that time raises `TimeoutError` and the connection is closed, to be opened again by the next
+        request. With a `chunking` sender, large bulk requests are split and retried as described in `ChunkedSender`.
+        """
         self.port = port
         self.host = host
+        self.timeout = timeout
         self.socket = None
+        self._reader = None
+        self._batch = None
+        self._pipeline = None
         self.units = units
-        self._interface = ApiInterface(lambda: self.units, self._rpc)
+        self.codec = codec if isinstance(codec, JsonCodec) else get_codec(codec)
+        self._interface = ApiInterface(lambda: self.units, self._rpc, self._send_batch, codec=self.codec)
+        self._interface.chunking = chunking
 
         # Sub-interfaces
         self.scratch = ScratchPad(self._interface)
@@ -247,46 +336,107 @@ class ApiClient:
         self.work_settings = WorkSettingsCommands(self._interface)
         self.ui = UiCommands(self._interface)
 
+    @property
+    def chunking(self) -> Optional[ChunkedSender]:
+        """ The `ChunkedSender` which splits large `operate_copies` calls and etch item uploads into chunks sized to
+        the server's speed, retries failed chunks, and reports the timing of each chunk, or None if bulk requests are
+        sent whole """
+        return self._interface.chunking
+
+    @chunking.setter
+    def chunking(self, value: Optional[ChunkedSender]):
+        self._interface.chunking = value
+
+    def batch(self) -> RpcBatch:
+        """ Create a context manager which collects every call made inside its block into a single JSON-RPC batch,
+        sent in one round trip when the block exits. Calls made inside the block return `PendingResponse` placeholders
+        (or nothing, for property setters) which are resolved by request id once the batch is sent. Reading a
+        placeholder's `.result` inside the block sends everything queued so far.
+
+        Setters which normally raise on failure will raise when the batch is sent instead. """
+        if self._pipeline is not None and self._pipeline.is_open:
+            raise Exception("A batch cannot be opened while a pipeline is open")
+        if self._batch is None or not self._batch.is_open:
+            self._batch = RpcBatch(self._rpc_batch)
+        return self._batch
+
+    def pipeline(self, max_in_flight: int = 256) -> RpcPipeline:
+        """ Create a context manager inside of which requests are sent without waiting for their responses, keeping
+        up to `max_in_flight` of them in flight on the connection at once. Calls return `PendingResponse` placeholders
+        which are matched to their responses by request id. All outstanding responses are read when the block exits,
+        and the first failure among them is raised.
+
+        Unlike a batch, requests in a pipeline are sent as they are made, so reading a placeholder's `.result` only
+        waits for that request's response rather than splitting anything. """
+        if self._batch is not None and self._batch.is_open:
+            raise Exception("A pipeline cannot be opened while a batch is open")
+        if self._pipeline is not None and self._pipeline.is_open:
+            raise Exception("A pipeline is already open")
+
+        self._connect()
+        self._pipeline = RpcPipeline(self.socket.sendall, self._reader.read_line, max_in_flight, codec=self.codec)
+        return self._pipeline
+
     def close(self):
         if self.socket is not None:
             self.socket.close()
             self.socket = None
+            self._reader = None
 
     def _connect(self):
         if self.socket is None:
             self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self.socket.settimeout(self.timeout)
             self.socket.connect((self.host, self.port))
+            self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            self._reader = LineReader(self.socket)
             print("Connected to server")
 
     def _rpc(self, request_data: dict):
+        if self._batch is not None and self._batch.is_open:
+            return self._batch.add(request_data)
+        if self._pipeline is not None and self._pipeline.is_open:
+            return self._pipeline.submit(request_data)
+
         self._connect()
-        payload = json.dumps(request_data) + "\n"
-        self.socket.sendall(payload.encode("utf-8"))
-        response = self._receive()
+        try:
+            self.socket.sendall(self.codec.encode_request(request_data) + b"\n")
+            response = self._receive()
+        except OSError:
+            # A connection which failed or timed out part way through a request can't be trusted to be in step with
+            # the server any more
+            self.close()
+            raise
+        if response.id != request_data["id"]:
+            raise UnexpectedResponseError(f"Expected a response to request id {request_data['id']!r}, "
+                                          f"received one for id {response.id!r}")
         return response
 
+    def _send_batch(self, requests: list[dict]):
+        # Sends a batch immediately on behalf of the interface, after anything already queued or in flight so that
+        # requests reach the server in the order they were made
+        if self._batch is not None and self._batch.is_open:
+            self._batch.flush()
+        if self._pipeline is not None and self._pipeline.is_open:
+            self._pipeline.wait_all()
+        return self._rpc_batch(requests)
+
+    def _rpc_batch(self, requests: list[dict]):
+        self._connect()
+        try:
+            self.socket.sendall(self.codec.encode_request(requests) + b"\n")
+            return self.codec.loads(self._reader.read_line())
+        except OSError:
+            self.close()
+            raise
+
     def _receive(self):
-        # Receive a newline-terminated JSON object from the socket with a 5-second timeout
+        # Receive a single newline-terminated JSON object from the socket
         if self.socket is None:
             raise Exception("Socket is not connected")
 
-        time.sleep(0.010)
-
-        # self.socket.settimeout(5)
-        response = b""
-        while True:
-            try:
-                data = self.socket.recv(1024)
-                if not data:
-                    break
-                response += data
-                if b"\n" in data:
-                    break
-            except socket.timeout:
-                break
-
-        payload = json.loads(response.decode("utf-8"))
+        payload = self.codec.loads(self._reader.read_line())
         result = parse(payload)
         if isinstance(result, Error):
-            raise Exception(result.message)
+            raise RpcError.from_response(result)
         return result
@@ -1,5 +1,6 @@
 from __future__ import annotations
 
+import math
 from enum import Enum
 
 import numpy
@@ -29,6 +30,7 @@ class Units(Enum):
 
 @dataclass
 class Xyr:
+    __slots__ = ("x", "y", "r")
     x: float
     y: float
     r: float
@@ -44,6 +46,7 @@ class Xyr:
 
 @dataclass
 class Vector:
+    __slots__ = ("x", "y")
     x: float
     y: float
 
@@ -62,8 +65,7 @@ class Vector:
         if isinstance(other, int):
             return Vector(self.x * other, self.y * other)
         elif isinstance(other, Transform):
-            moved = other * numpy.array([self.x, self.y, 1])
-            return Vector(moved[0], moved[1])
+            return other * self
         else:
             raise TypeError("Can only multiply by scalar or a transform")
 
@@ -73,6 +75,9 @@ class Vector:
     def norm(self):
         return numpy.sqrt(self.x ** 2 + self.y ** 2)
 
+    def distance_to(self, other: Vector) -> float:
+        return (self - other).norm()
+
     def unit(self):
         return self / self.norm()
 
@@ -103,49 +108,235 @@ class Vector:
         yield self.y
 
 
+class VectorArray:
+    """ An array of 2D vectors backed by an (N, 2) NumPy array, with the same operations as `Vector` applied to every
+    element at once. Operations with a single `Vector` broadcast it against every element, and operations with another
+    `VectorArray` of the same length are element-wise. Indexing with an integer gives a `Vector`, while slices, masks,
+    and index arrays give a `VectorArray`. """
+    __slots__ = ("array",)
+
+    def __init__(self, values):
+        if isinstance(values, VectorArray):
+            values = values.array
+        elif isinstance(values, (list, tuple)) and values and isinstance(values[0], Vector):
+            values = [(v.x, v.y) for v in values]
+        array = numpy.asarray(values, dtype=float)
+        if array.size == 0:
+            array = array.reshape(0, 2)
+        if array.ndim != 2 or array.shape[1] != 2:
+            raise ValueError(f"Expected an (N, 2) array of points, got shape {array.shape}")
+        self.array = array
+
+    @staticmethod
+    def from_xy(x, y) -> VectorArray:
+        return VectorArray(numpy.column_stack((x, y)))
+
+    @property
+    def x(self) -> numpy.ndarray:
+        return self.array[:, 0]
+
+    @property
+    def y(self) -> numpy.ndarray:
+        return self.array[:, 1]
+
+    def __len__(self):
+        return len(self.array)
+
+    def __getitem__(self, item):
+        if isinstance(item, (int, numpy.integer)):
+            x, y = self.array[item]
+            return Vector(float(x), float(y))
+        return VectorArray(self.array[item])
+
+    def __iter__(self):
+        for x, y in self.array.tolist():
+            yield Vector(x, y)
+
+    def __array__(self, dtype=None, copy=None):
+        return self.array if dtype is None else self.array.astype(dtype)
+
+    def __repr__(self):
+        return f"VectorArray({len(self)} points)"
+
+    def __add__(self, other: Union[VectorArray, Vector, numpy.ndarray]) -> VectorArray:
+        return VectorArray(self.array + _as_xy(other))
+
+    def __sub__(self, other: Union[VectorArray, Vector, numpy.ndarray]) -> VectorArray:
+        return VectorArray(self.array - _as_xy(other))
+
+    def __neg__(self) -> VectorArray:
+        return VectorArray(-self.array)
+
+    def __mul__(self, other: Union[float, int, numpy.ndarray, Transform]) -> VectorArray:
+        if isinstance(other, Transform):
+            return other.apply(self)
+        if isinstance(other, numpy.ndarray) and other.ndim == 1:
+            # One scale factor per vector
+            return VectorArray(self.array * other[:, None])
+        if isinstance(other, (float, int, numpy.number)):
+            return VectorArray(self.array * other)
+        raise TypeError("Can only multiply by a scalar, an array of scalars, or a transform")
+
+    def __rmul__(self, other: Union[float, int, numpy.ndarray]) -> VectorArray:
+        if isinstance(other, Transform):
+            raise TypeError("Use transform * points to apply a transform")
+        return self * other
+
+    def __truediv__(self, other: Union[float, numpy.ndarray]) -> VectorArray:
+        if isinstance(other, numpy.ndarray) and other.ndim == 1:
+            return VectorArray(self.array / other[:, None])
+        return VectorArray(self.array / other)
+
+    def norm(self) -> numpy.ndarray:
+        return numpy.hypot(self.array[:, 0], self.array[:, 1])
+
+    def unit(self) -> VectorArray:
+        return self / self.norm()
+
+    def distance_to(self, other: Union[VectorArray, Vector]) -> numpy.ndarray:
+        return (self - other).norm()
+
+    def dot(self, other: Union[VectorArray, Vector]) -> numpy.ndarray:
+        o = _as_xy(other)
+        return self.array[:, 0] * o[..., 0] + self.array[:, 1] * o[..., 1]
+
+    def cross(self, other: Union[VectorArray, Vector]) -> numpy.ndarray:
+        o = _as_xy(other)
+        return self.array[:, 0] * o[..., 1] - self.array[:, 1] * o[..., 0]
+
+    def signed_angle(self, other: Union[VectorArray, Vector]) -> numpy.ndarray:
+        return numpy.arctan2(self.cross(other), self.dot(other))
+
+    def angle_to(self, other: Union[VectorArray, Vector]) -> numpy.ndarray:
+        other_norm = other.norm()
+        cos = self.dot(other) / (self.norm() * other_norm)
+        return numpy.arccos(numpy.clip(cos, -1.0, 1.0))
+
+    def bounds(self) -> Aabb:
+        return Aabb.from_points(self.array)
+
+    def to_array(self) -> numpy.ndarray:
+        return self.array
+
+    def to_vectors(self) -> list[Vector]:
+        return list(self)
+
+
+def _as_xy(value) -> Union[numpy.ndarray, tuple]:
+    if isinstance(value, VectorArray):
+        return value.array
+    if isinstance(value, Vector):
+        return numpy.array((value.x, value.y))
+    return numpy.asarray(value, dtype=float)
+
+
 ORIGIN = Vector(0, 0)
 AXIS_X = Vector(1.0, 0)
 AXIS_Y = Vector(0, 1.0)
 
 
 class Transform:
-    def __init__(self, matrix: Union[numpy.matrix, numpy.ndarray]):
-        self.matrix = matrix if isinstance(matrix, numpy.matrix) else numpy.matrix(matrix)
+    """ A 2D affine transform, stored as the six values of the top two rows of its 3x3 homogeneous matrix
 
-    def __mul__(self, other: Union[numpy.matrix, Transform, Vector]):
-        if isinstance(other, numpy.matrix):
-            return Transform(self.matrix @ other)
-        elif isinstance(other, Transform):
-            return Transform(self.matrix @ other.matrix)
+        | m00  m01  m02 |
+        | m10  m11  m12 |
+        |  0    0    1  |
+
+    Composing, inverting, and applying a transform to a single vector are done in plain Python, which is much faster
+    than NumPy for a problem this small. The full matrix is available as a NumPy array through `matrix`, and a
+    transform can be constructed from any 3x3 array. """
+    __slots__ = ("m00", "m01", "m02", "m10", "m11", "m12")
+
+    def __init__(self, matrix: Union[numpy.ndarray, list]):
+        m = numpy.asarray(matrix, dtype=float)
+        if m.shape != (3, 3):
+            raise ValueError(f"Expected a 3x3 matrix, got shape {m.shape}")
+        (self.m00, self.m01, self.m02), (self.m10, self.m11, self.m12) = m[:2].tolist()
+
+    @staticmethod
+    def _of(m00: float, m01: float, m02: float, m10: float, m11: float, m12: float) -> Transform:
+        t = Transform.__new__(Transform)
+        t.m00 = m00
+        t.m01 = m01
+        t.m02 = m02
+        t.m10 = m10
+        t.m11 = m11
+        t.m12 = m12
+        return t
+
+    @property
+    def matrix(self) -> numpy.ndarray:
+        return numpy.array([[self.m00, self.m01, self.m02],
+                            [self.m10, self.m11, self.m12],
+                            [0.0, 0.0, 1.0]])
+
+    def __array__(self, dtype=None, copy=None):
+        return self.matrix if dtype is None else self.matrix.astype(dtype)
+
+    def __mul__(self, other: Union[numpy.ndarray, Transform, Vector, VectorArray]):
+        if isinstance(other, Transform):
+            return Transform._of(self.m00 * other.m00 + self.m01 * other.m10,
+                                 self.m00 * other.m01 + self.m01 * other.m11,
+                                 self.m00 * other.m02 + self.m01 * other.m12 + self.m02,
+                                 self.m10 * other.m00 + self.m11 * other.m10,
+                                 self.m10 * other.m01 + self.m11 * other.m11,
+                                 self.m10 * other.m02 + self.m11 * other.m12 + self.m12)
         elif isinstance(other, Vector):
-            moved = self.matrix @ numpy.array([other.x, other.y, 1])
-            if moved.shape == (1, 4):
-                return Vector(moved[0, 0], moved[0, 1])
-            return Vector(moved[0], moved[1])
+            return Vector(self.m00 * other.x + self.m01 * other.y + self.m02,
+                          self.m10 * other.x + self.m11 * other.y + self.m12)
+        elif isinstance(other, VectorArray):
+            return self.apply(other)
+        elif isinstance(other, numpy.ndarray):
+            return self * Transform(other)
         else:
-            raise TypeError("Can only multiply by numpy matrix, Vector, or Transform")
+            raise TypeError("Can only multiply by a 3x3 matrix, Vector, VectorArray, or Transform")
+
+    def __repr__(self):
+        return f"Transform([[{self.m00}, {self.m01}, {self.m02}], [{self.m10}, {self.m11}, {self.m12}], [0, 0, 1]])"
 
     def __str__(self):
         return numpy.array_str(self.matrix, suppress_small=True, precision=6)
 
+    def apply(self, points: Union[VectorArray, numpy.ndarray]) -> Union[VectorArray, numpy.ndarray]:
+        """ Transform every point in an (N, 2) array or `VectorArray` with a single matrix product, returning the same
+        kind of object that was given """
+        array = points.array if isinstance(points, VectorArray) else numpy.asarray(points, dtype=float)
+        rotation = numpy.array([[self.m00, self.m10], [self.m01, self.m11]])
+        moved = array @ rotation + (self.m02, self.m12)
+        return VectorArray(moved) if isinstance(points, VectorArray) else moved
+
     def to_xyr(self) -> Xyr:
-        return Xyr(self.matrix[0, 2], self.matrix[1, 2], numpy.arctan2(self.matrix[1, 0], self.matrix[0, 0]))
+        return Xyr(self.m02, self.m12, math.atan2(self.m10, self.m00))
 
     @staticmethod
     def from_xyr(xyr: Xyr) -> Transform:
-        return Transform(numpy.array([[numpy.cos(xyr.r), -numpy.sin(xyr.r), xyr.x],
-                                      [numpy.sin(xyr.r), numpy.cos(xyr.r), xyr.y],
-                                      [0, 0, 1]]))
+        c = math.cos(xyr.r)
+        s = math.sin(xyr.r)
+        return Transform._of(c, -s, xyr.x, s, c, xyr.y)
+
+    @staticmethod
+    def from_xyrs(values: Union[list[Xyr], numpy.ndarray]) -> list[Transform]:
+        """ Create a transform for each of a list of `Xyr` values or an (N, 3) array of x, y, r, computing the sines
+        and cosines for all of them at once """
+        if isinstance(values, numpy.ndarray):
+            xyr = values.reshape(-1, 3).astype(float)
+        else:
+            xyr = numpy.array([(v.x, v.y, v.r) for v in values], dtype=float).reshape(-1, 3)
+
+        cos = numpy.cos(xyr[:, 2]).tolist()
+        sin = numpy.sin(xyr[:, 2]).tolist()
+        of = Transform._of
+        return [of(c, -s, x, s, c, y) for c, s, x, y in zip(cos, sin, xyr[:, 0].tolist(), xyr[:, 1].tolist())]
 
     @staticmethod
     def identity() -> Transform:
-        return Transform(numpy.eye(3))
+        return Transform._of(1.0, 0.0, 0.0, 0.0, 1.0, 0.0)
 
     @staticmethod
     def rotate(theta: float):
-        return Transform(numpy.array([[numpy.cos(theta), -numpy.sin(theta), 0],
-                                      [numpy.sin(theta), numpy.cos(theta), 0],
-                                      [0, 0, 1]]))
+        c = math.cos(theta)
+        s = math.sin(theta)
+        return Transform._of(c, -s, 0.0, s, c, 0.0)
 
     @staticmethod
     def translate(*args):
@@ -159,16 +350,23 @@ class Transform:
 
     @staticmethod
     def _translate(x, y):
-        m = numpy.eye(3)
-        m[0, 2] = x
-        m[1, 2] = y
-        return Transform(m)
+        return Transform._of(1.0, 0.0, x, 0.0, 1.0, y)
 
     def invert(self) -> Transform:
-        return Transform(numpy.linalg.inv(self.matrix))
+        det = self.m00 * self.m11 - self.m01 * self.m10
+        if det == 0:
+            raise ValueError("Transform is not invertible")
+        i00 = self.m11 / det
+        i01 = -self.m01 / det
+        i10 = -self.m10 / det
+        i11 = self.m00 / det
+        return Transform._of(i00, i01, -(i00 * self.m02 + i01 * self.m12),
+                             i10, i11, -(i10 * self.m02 + i11 * self.m12))
 
 
 class Aabb:
+    __slots__ = ("min_bound", "max_bound", "__corners")
+
     def __init__(self, min_bound: Vector, max_bound: Vector):
         self.min_bound = min_bound
         self.max_bound = max_bound
@@ -241,7 +439,13 @@ class Aabb:
         raise NotImplemented(f"No closest point method for type {type(geom)}")
 
     @staticmethod
-    def from_points(points: list[Vector]) -> Aabb:
+    def from_points(points: Union[list[Vector], VectorArray, numpy.ndarray]) -> Aabb:
+        if isinstance(points, (VectorArray, numpy.ndarray)):
+            array = points.array if isinstance(points, VectorArray) else numpy.asarray(points, dtype=float)
+            low = array.min(axis=0)
+            high = array.max(axis=0)
+            return Aabb(Vector(float(low[0]), float(low[1])), Vector(float(high[0]), float(high[1])))
+
         xs = [p.x for p in points]
         ys = [p.y for p in points]
         return Aabb(Vector(min(xs), min(ys)), Vector(max(xs), max(ys)))
@@ -0,0 +1,186 @@
+import math
+from types import SimpleNamespace
+
+import numpy
+import pytest
+
+from laser_util_api import Units, Vector
+from laser_util_api._body_workspace import BodyScratchPad, _copies_near
+from laser_util_api._client_interface import ApiInterface
+from laser_util_api._loop_boolean import (region_area, region_bounds, region_difference, region_intersection,
+                                          region_union, oriented)
+from laser_util_api._loop_geometry import LoopGeometry
+from laser_util_api._loop_workspace import LoopScratchPad
+
+
+def square(x0: float, y0: float, x1: float, y1: float) -> numpy.ndarray:
+    return numpy.array([[x0, y0], [x1, y0], [x1, y1], [x0, y1]], dtype=float)
+
+
+def ring_area(ring: numpy.ndarray) -> float:
+    return region_area([ring])
+
+
+# ==========================================================================================
+# Boolean operations
+# ==========================================================================================
+def test_overlapping_squares():
+    a = [square(0, 0, 2, 2)]
+    b = [square(1, 1, 3, 3)]
+
+    assert region_area(region_union(a, b)) == pytest.approx(7.0)
+    assert region_area(region_intersection(a, b)) == pytest.approx(1.0)
+    assert region_area(region_difference(a, b)) == pytest.approx(3.0)
+    assert region_area(region_difference(b, a)) == pytest.approx(3.0)
+
+
+def test_results_are_counter_clockwise():
+    a = [square(0, 0, 2, 2)]
+    b = [square(1, 1, 3, 3)]
+
+    for result in (region_union(a, b), region_intersection(a, b), region_difference(a, b)):
+        assert len(result) == 1
+        assert ring_area(result[0]) > 0
+
+
+def test_cut_inside_leaves_clockwise_hole():
+    result = region_difference([square(0, 0, 4, 4)], [square(1, 1, 3, 3)])
+
+    assert len(result) == 2
+    areas = sorted(ring_area(r) for r in result)
+    assert areas[0] == pytest.approx(-4.0)
+    assert areas[1] == pytest.approx(16.0)
+    assert region_bounds(result) == pytest.approx((0, 0, 4, 4))
+
+
+def test_filling_hole_restores_outer_ring():
+    holed = region_difference([square(0, 0, 4, 4)], [square(1, 1, 3, 3)])
+    result = region_union(holed, [square(0.5, 0.5, 3.5, 3.5)])
+
+    assert len(result) == 1
+    assert ring_area(result[0]) == pytest.approx(16.0)
+
+
+def test_squares_sharing_an_edge():
+    a = [square(0, 0, 1, 1)]
+    b = [square(1, 0, 2, 1)]
+
+    union = region_union(a, b)
+    assert len(union) == 1
+    assert region_area(union) == pytest.approx(2.0)
+    assert region_area(region_intersection(a, b)) == pytest.approx(0.0)
+    assert region_area(region_difference(a, b)) == pytest.approx(1.0)
+
+
+def test_disjoint_squares():
+    a = [square(0, 0, 1, 1)]
+    b = [square(5, 5, 6, 6)]
+
+    assert region_intersection(a, b) == []
+    assert region_area(region_union(a, b)) == pytest.approx(2.0)
+    assert region_area(region_difference(a, b)) == pytest.approx(1.0)
+
+
+def test_clockwise_input_is_reoriented():
+    ring = square(0, 0, 2, 1)[::-1]
+
+    assert ring_area(ring) == pytest.approx(-2.0)
+    assert ring_area(oriented(ring)) == pytest.approx(2.0)
+    assert ring_area(oriented(ring, positive=False)) == pytest.approx(-2.0)
+
+
+# ==========================================================================================
+# Skipping operations that can't change a body
+# ==========================================================================================
+def test_copies_near_keeps_only_copies_touching_bounds():
+    tool = LoopGeometry.rectangle(0, 0, 1, 1)
+    xyrs = numpy.array([[5, 5, 0], [20, 20, 0], [10.2, 0, 0], [11.2, 0, 0], [0.5, 5, math.pi]])
+
+    assert _copies_near((0, 0, 10, 10), tool, xyrs) == [0, 2, 4]
+
+
+def test_copies_near_with_no_copies():
+    tool = LoopGeometry.rectangle(0, 0, 1, 1)
+    assert _copies_near((0, 0, 10, 10), tool, numpy.zeros((0, 3))) == []
+
+
+class FakeServer:
+    """ Answers scratch workspace requests with new ids, keeping the methods it was sent """
+
+    def __init__(self):
+        self.methods = []
+
+    def __call__(self, data: dict):
+        self.methods.append(data["method"])
+        return SimpleNamespace(result=f"id-{len(self.methods)}")
+
+    def sent(self, method: str) -> int:
+        return self.methods.count(method)
+
+
+@pytest.fixture
+def server():
+    return FakeServer()
+
+
+@pytest.fixture
+def pads(server):
+    interface = ApiInterface(lambda: Units.MM, server)
+    return LoopScratchPad(interface, track_geometry=True), BodyScratchPad(interface)
+
+
+def cutter(loops: LoopScratchPad, x: float, y: float, size: float = 1.0):
+    loop = loops.rectangle(Vector(x, y), size, size)
+    loop.reverse()
+    return loop
+
+
+def test_operate_skips_cut_outside_body(server, pads):
+    loops, bodies = pads
+    body = bodies.create(loops.rectangle(Vector(0, 0), 10, 10))
+
+    assert body.operate(cutter(loops, 20, 20)) is None
+    assert server.sent("BodyOperate") == 0
+
+    body.operate(cutter(loops, 5, 5))
+    assert server.sent("BodyOperate") == 1
+
+
+def test_operate_always_sends_additions_without_region(server, pads):
+    loops, bodies = pads
+    body = bodies.create(loops.rectangle(Vector(0, 0), 10, 10))
+
+    body.operate(loops.rectangle(Vector(2, 2), 1, 1))
+    assert server.sent("BodyOperate") == 1
+
+
+def test_operate_skips_changes_already_made(server, pads):
+    loops, bodies = pads
+    body = bodies.create(loops.rectangle(Vector(0, 0), 10, 10), local=True)
+
+    body.operate(cutter(loops, 2, 2))
+    assert body.operate(cutter(loops, 2, 2)) is None
+    assert body.operate(loops.rectangle(Vector(5, 5), 1, 1)) is None
+    assert server.sent("BodyOperate") == 1
+    assert body.area == pytest.approx(99.0)
+
+
+def test_operate_sends_tools_without_tracked_geometry(server):
+    interface = ApiInterface(lambda: Units.MM, server)
+    loops = LoopScratchPad(interface)
+    body = BodyScratchPad(interface).create(loops.rectangle(Vector(0, 0), 10, 10))
+
+    body.operate(cutter(loops, 20, 20))
+    assert server.sent("BodyOperate") == 1
+
+
+def test_operate_copies_sends_only_copies_near_body(server, pads):
+    loops, bodies = pads
+    body = bodies.create(loops.rectangle(Vector(0, 0), 10, 10))
+    tool = cutter(loops, 0, 0)
+
+    assert body.operate_copies(tool, numpy.array([[20, 20, 0], [30, 0, 0]])) is None
+    assert server.sent("BodyOperateCopies") == 0
+
+    body.operate_copies(tool, numpy.array([[20, 20, 0], [4, 4, 0]]))
+    assert server.sent("BodyOperateCopies") == 1